@@ -0,0 +1,245 @@
+"""
+Reproceso historico por rango de StudyDate, en paralelo y reanudable.
+
+El rango se divide en shards de BACKFILL_SHARD_DAYS dias. Cada shard lo
+procesa un proceso del pool (BACKFILL_WORKERS): busca sus estudios en
+Orthanc con /tools/find y los pasa a `launcher.procesar_estudios` en lotes
+de BACKFILL_BATCH. Los procesos se crean con "spawn" e importan el pipeline
+por su cuenta, asi que cada uno tiene sus propios clientes de Orthanc y
+Mongo (y su propio lector de EasyOCR: calcular la memoria por worker). Los
+limites de concurrencia y tasa de Orthanc (orthanc/acceso.py) son por
+proceso: los del pool se reparten la parte de este comando
+(ORTHANC_PROCESSES se multiplica por --workers en sus procesos).
+
+Cada shard terminado sin errores se registra en el checkpoint
+(BACKFILL_CHECKPOINT); al relanzar el mismo comando se saltan los shards ya
+completados. Un shard con una etapa fallida o con algun estudio que un
+extractor no pudo procesar (estudios_fallidos del reporte, p. ej. Orthanc
+caido) queda en "con_errores" del checkpoint, con esos estudios y su error,
+y se reintenta en la siguiente corrida: los JSON ya exportados se omiten,
+asi que solo se rehacen los estudios que faltan.
+Para un reproceso nuevo del mismo rango, usar otro --checkpoint o borrarlo.
+
+Con --reprocesar se borran antes los JSON exportados de cada estudio del
+shard (ocr_output/, header_ct/, header_pet/), para regenerarlos tras un
+cambio de parametros o de parser; la carga a Mongo solo reescribe los
+documentos cuyo contenido cambio. Al reintentar un shard "con_errores" solo
+se borran los de sus estudios fallidos: los demas ya se regeneraron en el
+intento anterior.
+
+Uso (desde DMS_pipeline/):
+    python backfill.py --desde 2023-01-01 --hasta 2023-12-31 --workers 4
+    python backfill.py --desde 20230101 --hasta 20231231 --shard-dias 14 --reprocesar
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import BACKFILL_BATCH, BACKFILL_CHECKPOINT, BACKFILL_SHARD_DAYS, BACKFILL_WORKERS, ORTHANC_PROCESSES
+
+
+logger = logging.getLogger(__name__)
+
+DIRECTORIOS_SALIDA = ("ocr_output", "header_ct", "header_pet")
+
+Shard = Tuple[str, str]  # (desde, hasta) como YYYYMMDD, ambos incluidos
+
+
+def _fecha(texto: str) -> date:
+    for formato in ("%Y%m%d", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"fecha inválida: {texto!r} (usar YYYYMMDD o YYYY-MM-DD)")
+
+
+def dividir_rango(desde: date, hasta: date, dias: int) -> List[Shard]:
+    """Shards consecutivos de `dias` dias que cubren [desde, hasta]."""
+    if hasta < desde:
+        raise ValueError("La fecha final es anterior a la inicial")
+    dias = max(1, dias)
+    shards = []
+    inicio = desde
+    while inicio <= hasta:
+        fin = min(inicio + timedelta(days=dias - 1), hasta)
+        shards.append((inicio.strftime("%Y%m%d"), fin.strftime("%Y%m%d")))
+        inicio = fin + timedelta(days=1)
+    return shards
+
+
+def _clave(shard: Shard) -> str:
+    return f"{shard[0]}-{shard[1]}"
+
+
+def leer_checkpoint(ruta: Path) -> Dict[str, Any]:
+    if not ruta.exists():
+        return {"completados": {}}
+    with open(ruta, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def guardar_checkpoint(ruta: Path, checkpoint: Dict[str, Any]) -> None:
+    # Escritura atomica: un corte a mitad de camino no deja el archivo a medias
+    temporal = ruta.with_name(ruta.name + ".tmp")
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+    os.replace(temporal, ruta)
+
+
+# --- Dentro de cada proceso del pool ---
+
+def _iniciar_worker(nivel: int) -> None:
+    logging.basicConfig(
+        level=nivel,
+        format="%(asctime)s - %(levelname)s - %(processName)s - %(name)s - %(message)s",
+        force=True,
+    )
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("httpcore").setLevel(logging.WARNING)
+
+
+def _borrar_exportados(study_id: str) -> int:
+    borrados = 0
+    for directorio in DIRECTORIOS_SALIDA:
+        for archivo in Path(directorio).glob(f"*_{study_id}.json"):
+            archivo.unlink()
+            borrados += 1
+    return borrados
+
+
+def procesar_shard(
+    shard: Shard, lote: int = BACKFILL_BATCH, reprocesar: bool = False, borrar: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """Procesa los estudios de un shard. Corre en un proceso del pool.
+    Con `reprocesar` borra antes los JSON de `borrar` (None: de todos sus estudios)."""
+    # Import diferido: el proceso principal no carga el pipeline (ni EasyOCR)
+    import launcher
+    from fuentes import fuente_orthanc
+
+    t0 = time.perf_counter()
+    estudios = fuente_orthanc().client.post_tools_find(json={"Level": "Study", "Query": {"StudyDate": _clave(shard)}})
+    resultado = {"shard": _clave(shard), "estudios": len(estudios), "estado": "ok", "etapas_con_error": [],
+                 "estudios_fallidos": {}}
+    if reprocesar:
+        borrados = sum(_borrar_exportados(study_id) for study_id in (estudios if borrar is None else borrar))
+        logger.info("[BACKFILL] %s: %d JSON previos borrados", _clave(shard), borrados)
+
+    lote = max(1, lote)
+    for i in range(0, len(estudios), lote):
+        reporte = launcher.procesar_estudios(estudios[i:i + lote], origen="backfill")
+        fallidos = reporte.get("estudios_fallidos", {})
+        etapas = reporte["etapas_con_error"] + [e["nombre"] for e in reporte["etapas"] if e.get("estudios_fallidos")]
+        if reporte["estado"] != "ok" or fallidos:
+            resultado["estado"] = "con_errores"
+            resultado["etapas_con_error"] += [e for e in dict.fromkeys(etapas) if e not in resultado["etapas_con_error"]]
+            resultado["estudios_fallidos"].update(fallidos)
+    resultado["wall_s"] = round(time.perf_counter() - t0, 3)
+    return resultado
+
+
+# --- Proceso principal ---
+
+@contextmanager
+def _parte_orthanc(workers: int):
+    """Los procesos del pool se reparten la parte de Orthanc de este comando
+    (ORTHANC_PROCESSES x workers, ver orthanc/acceso.py); leen config al
+    importarse, asi que la reciben por el entorno."""
+    previo = os.environ.get("ORTHANC_PROCESSES")
+    os.environ["ORTHANC_PROCESSES"] = str(max(1, ORTHANC_PROCESSES) * max(1, workers))
+    try:
+        yield
+    finally:
+        if previo is None:
+            os.environ.pop("ORTHANC_PROCESSES", None)
+        else:
+            os.environ["ORTHANC_PROCESSES"] = previo
+
+
+def ejecutar(shards: List[Shard], workers: int, checkpoint_ruta: Path, lote: int = BACKFILL_BATCH,
+             reprocesar: bool = False) -> Dict[str, Any]:
+    """Procesa los shards pendientes del checkpoint. Devuelve el checkpoint actualizado."""
+    checkpoint = leer_checkpoint(checkpoint_ruta)
+    completados = checkpoint.setdefault("completados", {})
+    con_errores = checkpoint.setdefault("con_errores", {})  # ultimo intento fallido de cada shard pendiente
+    pendientes = [s for s in shards if _clave(s) not in completados]
+    logger.info(
+        "[BACKFILL] %d shards (%d ya completados, %d pendientes) con %d workers",
+        len(shards), len(shards) - len(pendientes), len(pendientes), workers,
+    )
+    if not pendientes:
+        return checkpoint
+
+    contexto = multiprocessing.get_context("spawn")  # sin heredar clientes de Mongo/httpx por fork
+    t0 = time.perf_counter()
+    hechos = errores = 0
+    with _parte_orthanc(workers), ProcessPoolExecutor(
+        max_workers=max(1, workers), mp_context=contexto,
+        initializer=_iniciar_worker, initargs=(logging.getLogger().level,),
+    ) as pool:
+        # Un shard ya intentado solo rehace (y borra) sus estudios fallidos
+        futuros = {
+            pool.submit(procesar_shard, s, lote, reprocesar,
+                        list(con_errores[_clave(s)].get("estudios_fallidos", {})) if _clave(s) in con_errores else None): s
+            for s in pendientes
+        }
+        try:
+            for futuro in as_completed(futuros):
+                clave = _clave(futuros[futuro])
+                try:
+                    resultado = futuro.result()
+                except Exception:
+                    errores += 1
+                    logger.exception("[BACKFILL] Shard %s falló", clave)
+                    continue
+                fin = datetime.utcnow().isoformat()
+                if resultado["estado"] == "ok":
+                    completados[clave] = {**resultado, "fin": fin}
+                    con_errores.pop(clave, None)
+                    hechos += 1
+                else:
+                    con_errores[clave] = {**resultado, "fin": fin}
+                    errores += 1
+                    logger.warning("[BACKFILL] Shard %s con errores en %s (%d estudio(s) fallidos): se reintentará",
+                                   clave, resultado["etapas_con_error"], len(resultado["estudios_fallidos"]))
+                guardar_checkpoint(checkpoint_ruta, checkpoint)
+                logger.info(
+                    "[BACKFILL] %s: %d estudios en %.1f s | %d/%d shards (%.0f s transcurridos)",
+                    clave, resultado["estudios"], resultado["wall_s"], hechos + errores, len(pendientes),
+                    time.perf_counter() - t0,
+                )
+        except KeyboardInterrupt:
+            logger.warning("[BACKFILL] Interrumpido: el checkpoint conserva los shards completados")
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+    logger.info("[BACKFILL] Terminado: %d shards completados, %d con errores", hechos, errores)
+    return checkpoint
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproceso paralelo por rango de StudyDate")
+    parser.add_argument("--desde", type=_fecha, required=True, help="StudyDate inicial (YYYYMMDD o YYYY-MM-DD)")
+    parser.add_argument("--hasta", type=_fecha, required=True, help="StudyDate final, incluida")
+    parser.add_argument("--shard-dias", type=int, default=BACKFILL_SHARD_DAYS)
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="procesos en paralelo")
+    parser.add_argument("--lote", type=int, default=BACKFILL_BATCH, help="estudios por corrida del launcher")
+    parser.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT)
+    parser.add_argument("--reprocesar", action="store_true", help="borra los JSON exportados de cada estudio antes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    shards = dividir_rango(args.desde, args.hasta, args.shard_dias)
+    ejecutar(shards, args.workers, Path(args.checkpoint), args.lote, args.reprocesar)
+
+
+if __name__ == "__main__":
+    main()
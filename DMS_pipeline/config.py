@@ -45,10 +45,39 @@ ORTHANC_URL = os.getenv("ORTHANC_URL", "-")
 ORTHANC_USER = os.getenv("ORTHANC_USER", "-")
 ORTHANC_PASS = os.getenv("ORTHANC_PASS", "-")
 
+# Acceso a Orthanc (ver orthanc/acceso.py): concurrencia AIMD, tasa, reintentos y circuit breaker
+ORTHANC_TIMEOUT = float(os.getenv("ORTHANC_TIMEOUT", 60))
+ORTHANC_CONCURRENCY_MIN = as_int(os.getenv("ORTHANC_CONCURRENCY_MIN", None), 1)
+ORTHANC_CONCURRENCY_MAX = as_int(os.getenv("ORTHANC_CONCURRENCY_MAX", None), 8)
+ORTHANC_P95_TARGET_MS = as_int(os.getenv("ORTHANC_P95_TARGET_MS", None), 500)
+ORTHANC_AIMD_WINDOW = as_int(os.getenv("ORTHANC_AIMD_WINDOW", None), 20)
+ORTHANC_RATE = float(os.getenv("ORTHANC_RATE", 0))  # requests/s; 0 = sin limite
+ORTHANC_BURST = as_int(os.getenv("ORTHANC_BURST", None), 20)
+# Procesos que se reparten la concurrencia maxima y la tasa de arriba (cada uno usa 1/N; ver orthanc/acceso.py)
+ORTHANC_PROCESSES = as_int(os.getenv("ORTHANC_PROCESSES", None), 1)
+ORTHANC_RETRIES = as_int(os.getenv("ORTHANC_RETRIES", None), 4)
+ORTHANC_BACKOFF_BASE_MS = as_int(os.getenv("ORTHANC_BACKOFF_BASE_MS", None), 200)
+ORTHANC_BACKOFF_MAX_S = float(os.getenv("ORTHANC_BACKOFF_MAX_S", 10))
+ORTHANC_BREAKER_FAILURES = as_int(os.getenv("ORTHANC_BREAKER_FAILURES", None), 5)
+ORTHANC_BREAKER_COOLDOWN_S = float(os.getenv("ORTHANC_BREAKER_COOLDOWN_S", 30))
+
+# Metadatos de Orthanc memorizados por corrida (ver orthanc/metadatos.py): estudios expandidos que se conservan
+ORTHANC_MEMO_STUDIES = as_int(os.getenv("ORTHANC_MEMO_STUDIES", None), 500)
+# Estudios por pagina de /tools/find al listar todo Orthanc (scan completo; ver fuentes/)
+ORTHANC_FIND_PAGE = as_int(os.getenv("ORTHANC_FIND_PAGE", None), 1000)
+
+# Cache local de instancias DICOM (ver orthanc/cache.py); 0 MB = desactivada
+DICOM_CACHE_DIR = os.getenv("DICOM_CACHE_DIR", "dicom_cache")
+DICOM_CACHE_MAX_MB = as_int(os.getenv("DICOM_CACHE_MAX_MB", None), 2048)
+
+# Ingesta desde un directorio DICOM local (ver fuentes/directorio.py); 0 workers = un proceso por CPU
+SOURCE_DIR_WORKERS = as_int(os.getenv("SOURCE_DIR_WORKERS", None), 0)
+SOURCE_DIR_BATCH = as_int(os.getenv("SOURCE_DIR_BATCH", None), 256)
+
 # MongoDB (preferir MONGO_URI completa; si no, construir con partes)
 DB_NAME = os.getenv("DB_NAME", "CondorDB")
 _MONGO_URI_ENV = os.getenv("MONGO_URI")
-_MONGO_HOST = os.getenv("MONGO_HOST", "-)
+_MONGO_HOST = os.getenv("MONGO_HOST", "-")
 _MONGO_PORT = as_int(os.getenv("MONGO_PORT", None), 27017)
 _MONGO_USERNAME = os.getenv("MONGO_USERNAME", "-")
 _MONGO_PASSWORD = os.getenv("MONGO_PASSWORD", "-")
@@ -66,10 +95,54 @@ else:
 COL_OCR = os.getenv("MONGO_COL_OCR", "dose_report")
 COL_CT = os.getenv("MONGO_COL_CT", "series_ct")
 COL_PET = os.getenv("MONGO_COL_PET", "series_pet1")
+COL_VTL = os.getenv("MONGO_COL_VTL", "dose_series")  # OCR x CT por serie (ver mongo/vtl.py)
+COL_VERSIONS = os.getenv("MONGO_COL_VERSIONS", "data_versions")  # tokens de cache (ver mongo/versiones.py)
+COL_TOMBSTONES = os.getenv("MONGO_COL_TOMBSTONES", "data_tombstones")  # bajas para ?since= (ver mongo/versiones.py)
+COL_RUNS = os.getenv("MONGO_COL_RUNS", "pipeline_runs")  # telemetria por corrida (ver telemetria.py)
+COL_QUEUE = os.getenv("MONGO_COL_QUEUE", "pipeline_queue")  # cola de estudios del modo worker (ver mongo/cola.py)
 
 # Scheduler
 SCHEDULER_INTERVAL_MINUTES = as_int(os.getenv("SCHEDULER_INTERVAL_MINUTES", None), 5)
 SCHEDULER_RUN_ON_START = as_bool(os.getenv("SCHEDULER_RUN_ON_START", None), True)
+# Estudios de la cola que procesa cada ciclo (mas recientes primero, con la cuota de backfill; ver scheduler.py)
+SCHEDULER_MAX_STUDIES = as_int(os.getenv("SCHEDULER_MAX_STUDIES", None), 50)
+
+# Launcher: etapas independientes (OCR, headers CT, headers PET) en paralelo
+PIPELINE_WORKERS = as_int(os.getenv("PIPELINE_WORKERS", None), 3)
+# Etapas a correr (ocr, ct, pet, upload separadas por coma); vacio = todas
+PIPELINE_STAGES = os.getenv("PIPELINE_STAGES", "")
+
+# Perfilado por etapa (ver perfilado.py): vacio = desactivado, "all" = todas
+PROFILE_STAGES = os.getenv("PIPELINE_PROFILE", "")
+PROFILE_DIR = os.getenv("PIPELINE_PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = as_int(os.getenv("PIPELINE_PROFILE_INTERVAL_MS", None), 10)
+PROFILE_TOP = as_int(os.getenv("PIPELINE_PROFILE_TOP", None), 25)
+PROFILE_MEMORY = as_bool(os.getenv("PIPELINE_PROFILE_MEMORY", None), True)
+
+# Disparador por evento de Orthanc (ver disparador.py)
+TRIGGER_HOST = os.getenv("TRIGGER_HOST", "127.0.0.1")
+TRIGGER_PORT = as_int(os.getenv("TRIGGER_PORT", None), 8765)
+TRIGGER_TOKEN = os.getenv("TRIGGER_TOKEN", "")
+TRIGGER_DEBOUNCE_SECONDS = as_int(os.getenv("TRIGGER_DEBOUNCE_SECONDS", None), 10)
+TRIGGER_BATCH = as_int(os.getenv("TRIGGER_BATCH", None), 20)
+# Espera maxima del estudio mas viejo del lote aunque sigan llegando avisos
+TRIGGER_MAX_WAIT_SECONDS = as_int(os.getenv("TRIGGER_MAX_WAIT_SECONDS", None), 60)
+TRIGGER_SAFETY_INTERVAL_MINUTES = as_int(os.getenv("TRIGGER_SAFETY_INTERVAL_MINUTES", None), 60)
+
+# Backfill por rango de StudyDate (ver backfill.py)
+BACKFILL_WORKERS = as_int(os.getenv("BACKFILL_WORKERS", None), 4)
+BACKFILL_SHARD_DAYS = as_int(os.getenv("BACKFILL_SHARD_DAYS", None), 7)
+BACKFILL_BATCH = as_int(os.getenv("BACKFILL_BATCH", None), 50)
+BACKFILL_CHECKPOINT = os.getenv("BACKFILL_CHECKPOINT", "backfill_checkpoint.json")
+
+# Modo worker con cola compartida en Mongo (ver worker.py); nodo vacio = host:pid
+WORKER_NODE = os.getenv("WORKER_NODE", "")
+WORKER_BATCH = as_int(os.getenv("WORKER_BATCH", None), 5)
+WORKER_LEASE_SECONDS = as_int(os.getenv("WORKER_LEASE_SECONDS", None), 300)
+WORKER_MAX_ATTEMPTS = as_int(os.getenv("WORKER_MAX_ATTEMPTS", None), 3)
+WORKER_POLL_SECONDS = as_int(os.getenv("WORKER_POLL_SECONDS", None), 5)
+# Fraccion de reclamos para los estudios mas antiguos (el resto, mas recientes primero; ver mongo/cola.py)
+WORKER_BACKFILL_SHARE = float(os.getenv("WORKER_BACKFILL_SHARE", 0.2))
 
 # Config dict de compatibilidad para usos existentes
 config = {
@@ -77,6 +150,22 @@ config = {
         "url": ORTHANC_URL,
         "user": ORTHANC_USER,
         "password": ORTHANC_PASS,
+        "timeout": ORTHANC_TIMEOUT,
+        "concurrency": [ORTHANC_CONCURRENCY_MIN, ORTHANC_CONCURRENCY_MAX],
+        "p95_target_ms": ORTHANC_P95_TARGET_MS,
+        "rate": ORTHANC_RATE,
+        "processes": ORTHANC_PROCESSES,
+        "retries": ORTHANC_RETRIES,
+        "memo_studies": ORTHANC_MEMO_STUDIES,
+        "find_page": ORTHANC_FIND_PAGE,
+    },
+    "source_dir": {
+        "workers": SOURCE_DIR_WORKERS,
+        "batch": SOURCE_DIR_BATCH,
+    },
+    "dicom_cache": {
+        "dir": DICOM_CACHE_DIR,
+        "max_mb": DICOM_CACHE_MAX_MB,
     },
     "mongo": {
         "host": _MONGO_HOST,
@@ -94,10 +183,44 @@ config = {
     "scheduler": {
         "interval_minutes": SCHEDULER_INTERVAL_MINUTES,
         "run_on_start": SCHEDULER_RUN_ON_START,
+        "max_studies": SCHEDULER_MAX_STUDIES,
+    },
+    "pipeline": {
+        "workers": PIPELINE_WORKERS,
+        "stages": PIPELINE_STAGES,
+        "profile": PROFILE_STAGES,
+        "profile_dir": PROFILE_DIR,
+    },
+    "trigger": {
+        "host": TRIGGER_HOST,
+        "port": TRIGGER_PORT,
+        "debounce_seconds": TRIGGER_DEBOUNCE_SECONDS,
+        "batch": TRIGGER_BATCH,
+        "max_wait_seconds": TRIGGER_MAX_WAIT_SECONDS,
+        "safety_interval_minutes": TRIGGER_SAFETY_INTERVAL_MINUTES,
+    },
+    "backfill": {
+        "workers": BACKFILL_WORKERS,
+        "shard_days": BACKFILL_SHARD_DAYS,
+        "batch": BACKFILL_BATCH,
+        "checkpoint": BACKFILL_CHECKPOINT,
+    },
+    "worker": {
+        "node": WORKER_NODE,
+        "batch": WORKER_BATCH,
+        "lease_seconds": WORKER_LEASE_SECONDS,
+        "max_attempts": WORKER_MAX_ATTEMPTS,
+        "poll_seconds": WORKER_POLL_SECONDS,
+        "backfill_share": WORKER_BACKFILL_SHARE,
     },
     "collections": {
         "ocr": COL_OCR,
         "ct": COL_CT,
         "pet": COL_PET,
+        "vtl": COL_VTL,
+        "versions": COL_VERSIONS,
+        "tombstones": COL_TOMBSTONES,
+        "runs": COL_RUNS,
+        "queue": COL_QUEUE,
     },
 }
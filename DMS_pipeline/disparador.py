@@ -0,0 +1,241 @@
+"""
+Ingesta por evento: Orthanc avisa cada estudio estable y se procesa enseguida.
+
+Un servidor HTTP local recibe `POST /stable-study` (cuerpo: el ID de Orthanc
+del estudio, en texto o como JSON {"ID": ...}) y responde 202 sin esperar.
+Los IDs se acumulan en una cola con antirrebote: el lote sale cuando pasan
+TRIGGER_DEBOUNCE_SECONDS sin avisos nuevos, al juntar TRIGGER_BATCH
+estudios o cuando el estudio mas viejo lleva TRIGGER_MAX_WAIT_SECONDS
+esperando (un goteo continuo de avisos no lo posterga para siempre), y un
+hilo trabajador lo procesa con `launcher.procesar_estudios`. Un estudio
+repetido mientras espera se cuenta una sola vez. Los lotes por evento
+tienen prioridad en el launcher: si el ciclo de respaldo esta procesando,
+el lote espera solo a que termine su tanda actual y pasa antes que la
+siguiente.
+
+Con --cola los lotes no se procesan aqui: se encolan en COL_QUEUE para los
+workers de worker.py (uno o varios hosts), con su fecha de adquisicion para
+que los workers tomen primero los mas recientes (ver mongo/cola.py). La red
+de seguridad tampoco procesa: solo encola los estudios que la cola no tiene.
+
+El ciclo de scheduler.py sigue corriendo como red de seguridad cada
+TRIGGER_SAFETY_INTERVAL_MINUTES (avisos perdidos, caidas del servicio): encola
+en COL_QUEUE los estudios que la cola no tiene y procesa a lo sumo
+SCHEDULER_MAX_STUDIES. Los lotes procesados aqui se anotan como hechos en
+la cola para que ese ciclo no los repita. El launcher serializa las corridas.
+
+En Orthanc, un script Lua (ver orthanc/disparador.lua):
+    function OnStableStudy(studyId, tags, metadata)
+        HttpPost('http://127.0.0.1:8765/stable-study', studyId)
+    end
+
+Uso:
+    python disparador.py                      # servidor + red de seguridad
+    curl -X POST --data <id> http://127.0.0.1:8765/stable-study
+"""
+
+import argparse
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from config import (
+    COL_QUEUE,
+    SCHEDULER_MAX_STUDIES,
+    TRIGGER_BATCH,
+    TRIGGER_DEBOUNCE_SECONDS,
+    TRIGGER_HOST,
+    TRIGGER_MAX_WAIT_SECONDS,
+    TRIGGER_PORT,
+    TRIGGER_SAFETY_INTERVAL_MINUTES,
+    TRIGGER_TOKEN,
+)
+from fuentes import fuente_orthanc
+from mongo import cola as cola_mongo
+from orthanc.acceso import metricas as metricas_orthanc
+import launcher
+import scheduler
+
+
+logger = logging.getLogger(__name__)
+
+# Para leer la fecha de adquisicion de los estudios que se encolan (--cola)
+FUENTE = fuente_orthanc()
+
+
+class ColaDebounce:
+    """IDs pendientes con antirrebote: cada aviso posterga la salida del lote,
+    hasta `max_espera_s` desde la llegada del pendiente mas viejo."""
+
+    def __init__(self, espera_s: float = TRIGGER_DEBOUNCE_SECONDS, max_lote: int = TRIGGER_BATCH,
+                 max_espera_s: float = TRIGGER_MAX_WAIT_SECONDS):
+        self.espera_s = espera_s
+        self.max_lote = max(1, max_lote)
+        self.max_espera_s = max(max_espera_s, espera_s)
+        self._pendientes: Dict[str, float] = {}  # ID -> primer aviso (monotonic), en orden de llegada
+        self._ultimo = 0.0
+        self._cond = threading.Condition()
+
+    def agregar(self, study_id: str) -> bool:
+        """Encola el estudio; devuelve False si ya estaba pendiente."""
+        with self._cond:
+            nuevo = study_id not in self._pendientes
+            self._ultimo = time.monotonic()
+            self._pendientes.setdefault(study_id, self._ultimo)
+            self._cond.notify()
+            return nuevo
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._pendientes)
+
+    def tomar(self, timeout: Optional[float] = None) -> List[str]:
+        """Bloquea hasta que haya un lote listo (o vence `timeout`: lista vacia)."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                ahora = time.monotonic()
+                if self._pendientes:
+                    mas_viejo = next(iter(self._pendientes.values()))
+                    listo_en = min(self._ultimo + self.espera_s, mas_viejo + self.max_espera_s)
+                    if len(self._pendientes) >= self.max_lote or ahora >= listo_en:
+                        lote = list(self._pendientes)[: self.max_lote]
+                        for study_id in lote:
+                            del self._pendientes[study_id]
+                        return lote
+                    espera = listo_en - ahora
+                else:
+                    espera = None
+                if limite is not None:
+                    if ahora >= limite:
+                        return []
+                    espera = min(espera, limite - ahora) if espera is not None else limite - ahora
+                self._cond.wait(espera)
+
+
+def _leer_study_id(cuerpo: bytes) -> str:
+    texto = cuerpo.decode("utf-8", "replace").strip()
+    if texto.startswith("{"):
+        datos = json.loads(texto)
+        texto = str(datos.get("ID") or datos.get("id") or "")
+    return texto.strip().strip('"')
+
+
+def crear_servidor(cola: ColaDebounce, host: str = TRIGGER_HOST, port: int = TRIGGER_PORT,
+                   token: str = TRIGGER_TOKEN) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def _responder(self, codigo: int, datos: dict) -> None:
+            cuerpo = json.dumps(datos).encode()
+            self.send_response(codigo)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._responder(200, {"estado": "ok", "pendientes": len(cola), "orthanc": metricas_orthanc()})
+            else:
+                self._responder(404, {"error": "ruta no encontrada"})
+
+        def do_POST(self):
+            if self.path != "/stable-study":
+                self._responder(404, {"error": "ruta no encontrada"})
+                return
+            if token and self.headers.get("X-Trigger-Token") != token:
+                self._responder(401, {"error": "token inválido"})
+                return
+            try:
+                largo = int(self.headers.get("Content-Length") or 0)
+                study_id = _leer_study_id(self.rfile.read(largo))
+            except ValueError:
+                study_id = ""
+            if not study_id:
+                self._responder(400, {"error": "falta el ID del estudio"})
+                return
+            nuevo = cola.agregar(study_id)
+            logger.info("[EVENTO] Estudio estable %s%s", study_id, "" if nuevo else " (ya pendiente)")
+            self._responder(202, {"estudio": study_id, "pendientes": len(cola)})
+
+        def log_message(self, formato, *args):
+            logger.debug("%s - %s", self.address_string(), formato % args)
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def trabajar(cola: ColaDebounce, detener: Optional[threading.Event] = None, compartida: bool = False) -> None:
+    """Procesa lotes de la cola hasta que se active `detener`. Con `compartida`
+    los encola en COL_QUEUE para los workers en vez de procesarlos."""
+    detener = detener or threading.Event()
+    while not detener.is_set():
+        lote = cola.tomar(timeout=1.0)
+        if not lote:
+            continue
+        if compartida:
+            try:
+                n = cola_mongo.encolar(launcher.db, COL_QUEUE, lote, origen="evento", fechas=FUENTE.fechas(lote))
+            except Exception:
+                logger.exception("[EVENTO] No se pudo encolar %s en '%s'", lote, COL_QUEUE)
+                continue
+            logger.info("[EVENTO] %d estudio(s) encolados en '%s'", n, COL_QUEUE)
+            continue
+        logger.info("[EVENTO] Procesando %d estudio(s)", len(lote))
+        try:
+            reporte = launcher.procesar_estudios(lote, origen="evento", prioridad=True)
+        except Exception:
+            logger.exception("[EVENTO] Falló el procesamiento de %s", lote)
+            continue
+        logger.info("[EVENTO] Lote terminado (%s) en %.1f s", reporte["estado"], reporte["wall_s"])
+        if reporte["estado"] != "ok":
+            continue  # una etapa fallo: el ciclo de respaldo los encola y se reintentan
+        hechos = [s for s in lote if s not in reporte.get("estudios_fallidos", {})]
+        try:
+            cola_mongo.registrar_hechos(launcher.db, COL_QUEUE, hechos, origen="evento")
+        except Exception:
+            logger.exception("[EVENTO] No se pudo registrar %s en '%s'", hechos, COL_QUEUE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingesta por evento de Orthanc con scan periodico de respaldo")
+    parser.add_argument("--host", default=TRIGGER_HOST)
+    parser.add_argument("--port", type=int, default=TRIGGER_PORT)
+    parser.add_argument("--sin-respaldo", action="store_true", help="no ejecutar el scan completo periodico")
+    parser.add_argument("--cola", action="store_true", help="encolar en COL_QUEUE para worker.py en vez de procesar")
+    launcher.agregar_argumentos_perfilado(parser)
+    args = parser.parse_args()
+    launcher.aplicar_argumentos_perfilado(args)
+    launcher._configure_logging()
+
+    cola = ColaDebounce()
+    servidor = crear_servidor(cola, args.host, args.port)
+    detener = threading.Event()
+    threading.Thread(target=servidor.serve_forever, name="disparador-http", daemon=True).start()
+    trabajador = threading.Thread(target=trabajar, args=(cola, detener, args.cola), name="disparador", daemon=True)
+    trabajador.start()
+    logger.info(
+        "[EVENTO] Escuchando en http://%s:%d/stable-study (antirrebote %ss, espera maxima %ss, lote %d)",
+        args.host, args.port, cola.espera_s, cola.max_espera_s, cola.max_lote,
+    )
+
+    try:
+        if args.sin_respaldo:
+            while True:
+                time.sleep(3600)
+        else:
+            # Con --cola el ciclo solo encola lo que falta: el estado lo lleva la cola, no los JSON locales
+            scheduler.start_scheduler(TRIGGER_SAFETY_INTERVAL_MINUTES, run_on_start=False,
+                                      max_estudios=0 if args.cola else SCHEDULER_MAX_STUDIES)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.shutdown()
+        detener.set()
+        trabajador.join()
+        logger.info("[EVENTO] Disparador detenido")
+
+
+if __name__ == "__main__":
+    main()
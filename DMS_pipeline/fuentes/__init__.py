@@ -0,0 +1,152 @@
+"""
+Fuentes de estudios para los extractores (OCR, headers CT y PET).
+
+Una fuente entrega pares (paciente, estudio) con la misma interfaz que los
+recursos de pyorthanc que usan los extractores: `study.id_`, `.uid`,
+`.description`, `.series`, `series.modality`, `.instances`,
+`._get_main_dicom_tag_value(...)`, `instance.tags`,
+`.get_dicom_file_content()`, etc.
+
+- `FuenteOrthanc(client)`: el PACS en vivo, con los metadatos memorizados
+  por corrida (orthanc/metadatos.py). Sin `client`, el cliente se crea
+  recien al primer uso (importar los extractores no abre conexiones).
+- `FuenteDirectorio(raiz)` (fuentes/directorio.py): un arbol de archivos DICOM
+  (exportaciones de otros centros), indexado en paralelo leyendo solo headers.
+
+    for paciente, estudio in fuente.estudios():          # todos
+    for paciente, estudio in fuente.estudios([id1, id2]):  # solo esos IDs
+
+Sin IDs, las fuentes entregan los estudios del mas reciente al mas antiguo
+(fecha de adquisicion, `fecha_adquisicion`): en un scan con mucho atraso
+los examenes del dia llegan a los dashboards primero.
+
+`fuente_orthanc()` devuelve la FuenteOrthanc compartida del proceso (un
+solo cliente y transporte): la usan los extractores, el worker y el
+backfill.
+"""
+
+import heapq
+import logging
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+import pyorthanc
+
+from config import ORTHANC_FIND_PAGE, ORTHANC_MEMO_STUDIES
+from fuentes.directorio import FuenteDirectorio
+from orthanc.acceso import crear_cliente
+from orthanc.metadatos import Estudio, Paciente, compartido, memorizar
+from telemetria import fallo_estudio
+
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["FuenteOrthanc", "FuenteDirectorio", "fecha_adquisicion", "fuente_orthanc"]
+
+
+def fecha_adquisicion(main_dicom_tags: Mapping[str, Any]) -> str:
+    """StudyDate + StudyTime como "YYYYMMDDHHMMSS" (ordenable como texto); "" si no hay fecha."""
+    fecha = str(main_dicom_tags.get("StudyDate") or "").strip()
+    if not fecha:
+        return ""
+    hora = str(main_dicom_tags.get("StudyTime") or "").strip().split(".")[0]
+    return fecha[:8] + hora[:6].ljust(6, "0")
+
+
+class FuenteOrthanc:
+    nombre = "orthanc"
+
+    def __init__(self, client: Optional[pyorthanc.Orthanc] = None):
+        self._client = client
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> pyorthanc.Orthanc:
+        with self._lock:
+            if self._client is None:
+                self._client = crear_cliente()
+            return self._client
+
+    def estudios(self, study_ids: Optional[Iterable[str]] = None) -> Iterator[Tuple[Paciente, Estudio]]:
+        """(paciente, estudio) de los IDs indicados, o de todo Orthanc (mas recientes
+        primero); los que fallan se omiten y quedan en estudios_fallidos de la etapa."""
+        if study_ids is None:
+            yield from self.por_fecha()
+            return
+        for study_id in study_ids:
+            try:
+                study = Estudio(id_=study_id, client=self.client)
+                yield Paciente(id_=study.patient_identifier, client=self.client), study
+            except Exception as exc:
+                logger.exception("No se pudo leer el estudio %s desde Orthanc", study_id)
+                fallo_estudio(study_id, exc)
+
+    def por_fecha(self) -> List[Tuple[Paciente, Estudio]]:
+        """Todos los estudios de Orthanc, del mas reciente al mas antiguo.
+
+        El listado se arma una vez por corrida y lo comparten el OCR y los
+        headers CT y PET (ver `_listar`).
+        """
+        return [
+            (Paciente(id_=paciente, client=self.client), Estudio(id_=estudio, client=self.client))
+            for _, paciente, estudio in compartido("estudios_por_fecha", self._listar)
+        ]
+
+    def _listar(self, memo: bool = True) -> List[Tuple[str, str, str]]:
+        """(fecha, paciente, estudio) de todo Orthanc, del mas reciente al mas antiguo.
+
+        /tools/find expandida en paginas de ORTHANC_FIND_PAGE estudios (cada
+        pagina pasa por el limite de concurrencia y tasa de orthanc/acceso.py)
+        en vez de recorrer los pacientes. Con `memo`, los ORTHANC_MEMO_STUDIES
+        mas recientes, los primeros en procesarse, quedan en el memo de metadatos.
+        """
+        filas: List[Tuple[str, str, str]] = []
+        recientes: List[Dict[str, Any]] = []
+        pagina = max(1, ORTHANC_FIND_PAGE)
+        desde = 0
+        while True:
+            infos = self.client.post_tools_find(
+                json={"Level": "Study", "Query": {}, "Expand": True, "Since": desde, "Limit": pagina}
+            )
+            for info in infos:
+                filas.append((fecha_adquisicion(info.get("MainDicomTags", {})), info["ParentPatient"], info["ID"]))
+            recientes = heapq.nlargest(
+                ORTHANC_MEMO_STUDIES, recientes + infos, key=lambda i: fecha_adquisicion(i.get("MainDicomTags", {})),
+            )
+            if len(infos) < pagina:
+                break
+            desde += len(infos)
+        filas.sort(reverse=True)
+        if memo:
+            memorizar(recientes[::-1])  # el mas reciente queda como el ultimo usado del memo
+        logger.info("[ORTHANC] %d estudios listados en %d pagina(s)", len(filas), desde // pagina + 1)
+        return filas
+
+    def fechas_todas(self) -> Dict[str, str]:
+        """Fecha de adquisicion de todos los estudios de Orthanc (study_id -> fecha),
+        listados en el momento: fuera de una corrida no se usa ni se llena el memo."""
+        return {estudio: fecha for fecha, _, estudio in self._listar(memo=False)}
+
+    def fechas(self, study_ids: Iterable[str]) -> Dict[str, str]:
+        """Fecha de adquisicion de cada estudio (ver `fecha_adquisicion`); los que
+        no se pueden leer se registran y se omiten."""
+        fechas = {}
+        for study_id in study_ids:
+            try:
+                fechas[study_id] = fecha_adquisicion(Estudio(id_=study_id, client=self.client).main_dicom_tags)
+            except Exception as exc:
+                logger.warning("No se pudo leer la fecha del estudio %s desde Orthanc: %s", study_id, exc)
+        return fechas
+
+
+_FUENTE: Optional[FuenteOrthanc] = None
+_FUENTE_LOCK = threading.Lock()
+
+
+def fuente_orthanc() -> FuenteOrthanc:
+    """FuenteOrthanc compartida del proceso (el cliente se crea al primer uso)."""
+    global _FUENTE
+    with _FUENTE_LOCK:
+        if _FUENTE is None:
+            _FUENTE = FuenteOrthanc()
+        return _FUENTE
@@ -0,0 +1,302 @@
+"""
+Fuente de estudios desde un directorio local de archivos DICOM.
+
+Para exportaciones masivas de otros centros que no se quieren importar al
+PACS: el arbol se recorre una vez y cada archivo se lee solo hasta antes de
+PixelData (y solo los tags de TAGS_INDICE) en SOURCE_DIR_WORKERS procesos,
+en lotes de SOURCE_DIR_BATCH rutas. Los archivos que no son DICOM (o no
+tienen los UIDs de estudio/serie/instancia) se ignoran.
+
+Los archivos se agrupan en pacientes, estudios y series con los mismos IDs
+que les asignaria Orthanc (sha1 de PatientID|StudyInstanceUID|...), asi que
+los JSON exportados (`*_{study.id_}.json`) y los documentos en Mongo son los
+mismos que si el estudio hubiera pasado por el PACS. Las clases imitan lo
+que los extractores usan de pyorthanc; los pixeles y los tags completos se
+leen del archivo recien cuando un extractor los pide.
+
+Uso (desde DMS_pipeline/):
+    python launcher.py --directorio /datos/exportacion_centro_x
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pydicom
+from pydicom.multival import MultiValue
+from pyorthanc import errors
+
+from config import SOURCE_DIR_BATCH, SOURCE_DIR_WORKERS
+
+
+logger = logging.getLogger(__name__)
+
+TAGS_INDICE = [
+    "PatientID", "PatientName",
+    "StudyInstanceUID", "StudyDescription", "StudyDate", "StudyTime", "AccessionNumber",
+    "SeriesInstanceUID", "SeriesNumber", "SeriesDescription", "Modality",
+    "SOPInstanceUID", "InstanceNumber",
+]
+_TAGS_PACIENTE = ("PatientID", "PatientName")
+_TAGS_ESTUDIO = ("StudyInstanceUID", "StudyDescription", "StudyDate", "StudyTime", "AccessionNumber")
+_TAGS_SERIE = ("SeriesInstanceUID", "SeriesNumber", "SeriesDescription", "Modality")
+_TAGS_INSTANCIA = ("SOPInstanceUID", "InstanceNumber")
+_VR_BINARIOS = {"OB", "OW", "OF", "OD", "OL", "OV", "UN"}
+
+
+def id_orthanc(*uids: str) -> str:
+    """ID de Orthanc de un recurso: sha1 de los UIDs de la jerarquia unidos por '|', en 5 grupos de 8."""
+    h = hashlib.sha1("|".join(uids).encode()).hexdigest()
+    return "-".join(h[i:i + 8] for i in range(0, 40, 8))
+
+
+def _texto(valor: Any) -> str:
+    if valor is None:
+        return ""
+    if isinstance(valor, (list, MultiValue)):
+        return "\\".join(str(v) for v in valor)
+    return str(valor).strip()
+
+
+def tags_orthanc(ds: pydicom.Dataset) -> Dict[str, Any]:
+    """Dataset pydicom -> formato de /instances/{id}/tags de Orthanc (sin PixelData)."""
+    salida: Dict[str, Any] = {}
+    for elem in ds:
+        if elem.tag == 0x7FE00010:
+            continue
+        clave = f"{elem.tag.group:04x},{elem.tag.element:04x}"
+        nombre = elem.keyword or "Unknown Tag & Data"
+        if elem.VR == "SQ":
+            salida[clave] = {"Name": nombre, "Type": "Sequence", "Value": [tags_orthanc(item) for item in elem.value]}
+        elif elem.VR in _VR_BINARIOS:
+            salida[clave] = {"Name": nombre, "Type": "Null", "Value": None}
+        else:
+            salida[clave] = {"Name": nombre, "Type": "String", "Value": _texto(elem.value)}
+    return salida
+
+
+def _leer_lote(rutas: List[str]) -> Tuple[List[Dict[str, str]], int]:
+    """Tags de indice de cada archivo (en un proceso del pool). Devuelve (filas, ignorados)."""
+    filas, ignorados = [], 0
+    for ruta in rutas:
+        try:
+            ds = pydicom.dcmread(ruta, stop_before_pixels=True, specific_tags=TAGS_INDICE, defer_size=1024)
+        except Exception:  # no es DICOM, truncado, sin permisos
+            ignorados += 1
+            continue
+        fila = {tag: _texto(ds[tag].value) for tag in TAGS_INDICE if tag in ds}
+        if not all(fila.get(t) for t in ("StudyInstanceUID", "SeriesInstanceUID", "SOPInstanceUID")):
+            ignorados += 1  # DICOMDIR, reportes sin jerarquia
+            continue
+        fila["ruta"] = ruta
+        filas.append(fila)
+    return filas, ignorados
+
+
+def _en_lotes(rutas: Iterable[str], tamano: int) -> Iterator[List[str]]:
+    lote: List[str] = []
+    for ruta in rutas:
+        lote.append(ruta)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def _recorrer(raiz: Path) -> Iterator[str]:
+    for directorio, subdirs, archivos in os.walk(raiz):
+        subdirs[:] = [d for d in subdirs if not d.startswith(".")]
+        for nombre in archivos:
+            if not nombre.startswith(".") and nombre.upper() != "DICOMDIR":
+                yield os.path.join(directorio, nombre)
+
+
+def indexar(raiz: Path, workers: int = SOURCE_DIR_WORKERS, lote: int = SOURCE_DIR_BATCH) -> Tuple[List[Dict[str, str]], int]:
+    """Lee los headers de todos los archivos bajo `raiz`. Devuelve (filas, ignorados)."""
+    lotes = _en_lotes(_recorrer(raiz), max(1, lote))
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        return _juntar(map(_leer_lote, lotes))
+    # spawn: el launcher tiene hilos vivos (scheduler, disparador) y fork los copiaria a medias
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+        return _juntar(pool.map(_leer_lote, lotes))
+
+
+def _juntar(resultados) -> Tuple[List[Dict[str, str]], int]:
+    filas: List[Dict[str, str]] = []
+    ignorados = 0
+    for parcial, n in resultados:
+        filas += parcial
+        ignorados += n
+    return filas, ignorados
+
+
+class _Recurso:
+    def __init__(self, id_: str, main_dicom_tags: Dict[str, str]):
+        self.id_ = id_
+        self.main_dicom_tags = main_dicom_tags
+
+    @property
+    def identifier(self) -> str:
+        return self.id_
+
+    def _get_main_dicom_tag_value(self, tag: str) -> Any:
+        try:
+            return self.main_dicom_tags[tag]
+        except KeyError:
+            raise errors.TagDoesNotExistError(f"{self} has no {tag} tag.")
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.id_})"
+
+
+class Instancia(_Recurso):
+    local = True  # ya esta en disco: orthanc/cache.py no la copia
+
+    def __init__(self, id_: str, main_dicom_tags: Dict[str, str], ruta: str):
+        super().__init__(id_, main_dicom_tags)
+        self.ruta = ruta
+
+    @property
+    def uid(self) -> str:
+        return self._get_main_dicom_tag_value("SOPInstanceUID")
+
+    @property
+    def tags(self) -> Dict[str, Any]:
+        return tags_orthanc(pydicom.dcmread(self.ruta, stop_before_pixels=True, force=True))
+
+    def get_dicom_file_content(self) -> bytes:
+        return Path(self.ruta).read_bytes()
+
+    def get_pydicom(self) -> pydicom.FileDataset:
+        return pydicom.dcmread(self.ruta, force=True)
+
+
+class Serie(_Recurso):
+    def __init__(self, id_: str, main_dicom_tags: Dict[str, str]):
+        super().__init__(id_, main_dicom_tags)
+        self.instances: List[Instancia] = []
+
+    @property
+    def uid(self) -> str:
+        return self._get_main_dicom_tag_value("SeriesInstanceUID")
+
+    @property
+    def modality(self) -> str:
+        return self._get_main_dicom_tag_value("Modality")
+
+    @property
+    def description(self) -> str:
+        return self._get_main_dicom_tag_value("SeriesDescription")
+
+
+class Estudio(_Recurso):
+    def __init__(self, id_: str, main_dicom_tags: Dict[str, str], patient_identifier: str):
+        super().__init__(id_, main_dicom_tags)
+        self.patient_identifier = patient_identifier
+        self.series: List[Serie] = []
+
+    @property
+    def uid(self) -> str:
+        return self._get_main_dicom_tag_value("StudyInstanceUID")
+
+    @property
+    def description(self) -> str:
+        return self._get_main_dicom_tag_value("StudyDescription")
+
+
+class Paciente(_Recurso):
+    @property
+    def name(self) -> str:
+        return self._get_main_dicom_tag_value("PatientName")
+
+    @property
+    def patient_id(self) -> str:
+        return self._get_main_dicom_tag_value("PatientID")
+
+
+def _agrupar(filas: List[Dict[str, str]]) -> Dict[str, Tuple[Paciente, Estudio]]:
+    """Arma la jerarquia paciente/estudio/serie/instancia; una instancia repetida se cuenta una vez."""
+    pacientes: Dict[str, Paciente] = {}
+    estudios: Dict[str, Estudio] = {}
+    series: Dict[str, Serie] = {}
+    vistas = set()
+    for fila in filas:
+        pid = fila.get("PatientID", "")
+        study_uid, series_uid, sop_uid = fila["StudyInstanceUID"], fila["SeriesInstanceUID"], fila["SOPInstanceUID"]
+        iid = id_orthanc(pid, study_uid, series_uid, sop_uid)
+        if iid in vistas:
+            continue
+        vistas.add(iid)
+        pac_id = id_orthanc(pid)
+        if pac_id not in pacientes:
+            pacientes[pac_id] = Paciente(pac_id, {t: fila[t] for t in _TAGS_PACIENTE if t in fila})
+        est_id = id_orthanc(pid, study_uid)
+        if est_id not in estudios:
+            estudios[est_id] = Estudio(est_id, {t: fila[t] for t in _TAGS_ESTUDIO if t in fila}, pac_id)
+        ser_id = id_orthanc(pid, study_uid, series_uid)
+        if ser_id not in series:
+            series[ser_id] = Serie(ser_id, {t: fila[t] for t in _TAGS_SERIE if t in fila})
+            estudios[est_id].series.append(series[ser_id])
+        series[ser_id].instances.append(
+            Instancia(iid, {t: fila[t] for t in _TAGS_INSTANCIA if t in fila}, fila["ruta"])
+        )
+
+    for serie in series.values():
+        serie.instances.sort(key=lambda i: (_numero(i.main_dicom_tags.get("InstanceNumber")), i.ruta))
+    # Del mas reciente al mas antiguo, como FuenteOrthanc
+    return {
+        est_id: (pacientes[estudio.patient_identifier], estudio)
+        for est_id, estudio in sorted(
+            estudios.items(),
+            key=lambda e: (e[1].main_dicom_tags.get("StudyDate", ""), e[1].main_dicom_tags.get("StudyTime", "")),
+            reverse=True,
+        )
+    }
+
+
+def _numero(valor: Optional[str]) -> float:
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return float("inf")
+
+
+class FuenteDirectorio:
+    nombre = "directorio"
+
+    def __init__(self, raiz, workers: int = SOURCE_DIR_WORKERS):
+        self.raiz = Path(raiz)
+        self.workers = workers
+        self._indice: Optional[Dict[str, Tuple[Paciente, Estudio]]] = None
+        self._lock = threading.Lock()  # los extractores corren en hilos paralelos
+
+    def indexar(self) -> Dict[str, Tuple[Paciente, Estudio]]:
+        """Indice de estudios por ID (se arma una sola vez)."""
+        with self._lock:
+            if self._indice is None:
+                if not self.raiz.is_dir():
+                    raise FileNotFoundError(f"No existe el directorio {self.raiz}")
+                inicio = time.perf_counter()
+                filas, ignorados = indexar(self.raiz, self.workers)
+                self._indice = _agrupar(filas)
+                logger.info(
+                    "[DIRECTORIO] %d archivo(s) DICOM en %.1f s (%d ignorados): %d estudio(s) en '%s'",
+                    len(filas), time.perf_counter() - inicio, ignorados, len(self._indice), self.raiz,
+                )
+            return self._indice
+
+    def estudios(self, study_ids: Optional[Iterable[str]] = None) -> Iterator[Tuple[Paciente, Estudio]]:
+        indice = self.indexar()
+        for study_id in (indice if study_ids is None else study_ids):
+            if study_id in indice:
+                yield indice[study_id]
+            else:
+                logger.warning("[DIRECTORIO] Estudio %s no encontrado en '%s'", study_id, self.raiz)
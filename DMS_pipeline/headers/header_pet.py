@@ -9,8 +9,8 @@ from typing import Optional, Dict, Any, List
 import numpy as np
 import pydicom
 from pydicom.errors import InvalidDicomError
-import pyorthanc
-from sympy import series
+from fuentes import FuenteOrthanc
+from orthanc.cache import leer_bytes
 from config import (
     STUDY_DESCRIPTION,
     QUALITY_METRICS_ENABLED,
@@ -20,146 +20,168 @@ from config import (
     QUALITY_BINS,
     SKIP_DYNAMIC_PET,
 )
+from telemetria import contar
 
 logger = logging.getLogger(__name__)
 
 
-def exportar_series_pet(client, output_dir="./header_pet"):
-    """
-    Recorre todos los pacientes en Orthanc y exporta un JSON por cada serie PET
-    (sólo la primera instancia) de los estudios cuyo StudyDescription contenga
-    'PET CUERPO COMPLETO-FD'.
+# Prioridades de descripción (0 = más alta)
+PRIORITY_MAP = {
+    "PET-EANM1": 0,
+    "PET-AC-IA": 1,
+    "PET-AC-SF_IA": 2,
+    "PET-AC": 3,
+}
 
-    Parámetros:
-        client (pyorthanc.Orthanc): cliente conectado a Orthanc
-        output_dir (str): carpeta donde guardar los JSON
-    """
-    os.makedirs(output_dir, exist_ok=True) #crear carpeta de salida si no existe
-    total_json = 0
 
+def _series_desc_exact(series):
     try:
-        patient_ids = client.get_patients() #obtener IDs de pacientes desde orthanc
-    except Exception as exc:
-        logger.exception("No se pudieron obtener pacientes desde Orthanc: %s", exc)
-        return
+        d = series._get_main_dicom_tag_value("SeriesDescription") or ""
+    except Exception:
+        d = ""
+    return d.strip()
 
-    if not patient_ids:
-        logger.warning("Orthanc no devolvió pacientes. Verifique filtros, URL o credenciales.")
-        return
 
-    logger.info("[PET] Pacientes a revisar: %d | Filtro StudyDescription: '%s'", len(patient_ids), STUDY_DESCRIPTION)
+def _priority(desc: str) -> int:
+    # Coincidencia exacta case-insensitive
+    return PRIORITY_MAP.get(desc.strip().upper(), 4)
+
 
-    target_desc_lower = (STUDY_DESCRIPTION or "").lower()
-    quality_params = {
+def _quality_params() -> Dict[str, Any]:
+    return {
         "thr": QUALITY_THR_SUV,
         "block": QUALITY_BLOCK,
         "min_valid": QUALITY_MIN_VALID,
         "bins": QUALITY_BINS,
     }
 
-    for pid in patient_ids:
-        patient = pyorthanc.Patient(id_=pid, client=client) #crear objeto paciente para consultar estudios/series
 
-        for study in patient.studies: #itera cada estudio del paciente
-            try:
-                desc = study.description or ""
-            except Exception:
-                desc = ""
+def exportar_estudio_pet(patient, study, output_dir="./header_pet", quality_params=None) -> Optional[str]:
+    """
+    Exporta el JSON de la serie PET elegida de un estudio (primera instancia +
+    métrica de calidad) si su StudyDescription contiene STUDY_DESCRIPTION.
+    Devuelve la ruta escrita, o None si se omitió.
+    """
+    try:
+        desc = study.description or ""
+    except Exception:
+        desc = ""
 
-            if target_desc_lower not in desc.lower():
-                continue
+    if (STUDY_DESCRIPTION or "").lower() not in desc.lower():
+        return None
+    contar("estudios_revisados")
 
-            pt_series = []
+    pt_series = []
 
-            for series in study.series:
-                if str(getattr(series, "modality", "")).upper() != "PT":
-                    continue
+    for series in study.series:
+        if str(getattr(series, "modality", "")).upper() != "PT":
+            continue
 
-                if not series.instances:
-                    continue
+        if not series.instances:
+            continue
 
-                pt_series.append(series)
+        pt_series.append(series)
 
-            if not pt_series:
-                logger.debug("[PET] Estudio %s sin series PT", getattr(study, 'id_', 'unknown'))
-                continue
+    contar("series_revisadas", len(pt_series))
+    if not pt_series:
+        logger.debug("[PET] Estudio %s sin series PT", getattr(study, 'id_', 'unknown'))
+        contar("estudios_omitidos")
+        return None
 
-            #series_selec = max(pt_series, key=lambda item: len(item.instances))
-            # Prioridades de descripción (0 = más alta)
-            PRIORITY_MAP = {
-                "PET-EANM1": 0,
-                "PET-AC-IA": 1,
-                "PET-AC-SF_IA": 2,
-                "PET-AC": 3,
-            }
-
-            def _series_desc_exact(series):
-                try:
-                    d = series._get_main_dicom_tag_value("SeriesDescription") or ""
-                except Exception:
-                    d = ""
-                return d.strip()
-
-            def _priority(desc: str) -> int:
-                # Coincidencia exacta case-insensitive
-                return PRIORITY_MAP.get(desc.strip().upper(), 4)
-
-            # Elegir serie por prioridad y luego por #instancias (desc)
-            series_selec = min(
-                pt_series,
-                key=lambda s: (_priority(_series_desc_exact(s)), -len(s.instances))
-            )
-
-            try:
-                modality_sel = str(series_selec.modality) if series_selec.modality else None
-            except Exception:
-                modality_sel = None
-            
-            inst = series_selec.instances[0] #toma la primera instancia de la serie seleccionada
-
-            serie_num_str = series_selec._get_main_dicom_tag_value("SeriesNumber") #lee el tag "SeriesNumber"
-            serie_num = int(serie_num_str) if (serie_num_str and serie_num_str.isdigit()) else None #convierte a entero si es posible
-            fn_series = f"{serie_num:03d}" if isinstance(serie_num, int) else "NA"
-            out_path = os.path.join(
-                output_dir,
-                f"Serie{fn_series}_PET_{patient.name}_{study.id_}.json"
-            ) 
-            if os.path.exists(out_path):  # Si el archivo ya existe, saltarlo
-                continue
+    # Elegir serie por prioridad y luego por #instancias (desc)
+    series_selec = min(
+        pt_series,
+        key=lambda s: (_priority(_series_desc_exact(s)), -len(s.instances))
+    )
+
+    try:
+        modality_sel = str(series_selec.modality) if series_selec.modality else None
+    except Exception:
+        modality_sel = None
+
+    inst = series_selec.instances[0] #toma la primera instancia de la serie seleccionada
+
+    serie_num_str = series_selec._get_main_dicom_tag_value("SeriesNumber") #lee el tag "SeriesNumber"
+    serie_num = int(serie_num_str) if (serie_num_str and serie_num_str.isdigit()) else None #convierte a entero si es posible
+    fn_series = f"{serie_num:03d}" if isinstance(serie_num, int) else "NA"
+    out_path = os.path.join(
+        output_dir,
+        f"Serie{fn_series}_PET_{patient.name}_{study.id_}.json"
+    )
+    if os.path.exists(out_path):  # Si el archivo ya existe, saltarlo
+        contar("estudios_omitidos")
+        return None
+
+    out = {
+        "patient": {
+            "patient_name": getattr(patient, "name", None)
+        },
+        "study": {
+            "study_instance_uid": getattr(study, "uid", None),
+            "study_description": desc
+        },
+        "series": {
+            "series_instance_uid": getattr(series_selec, "uid", None),
+            "modality": modality_sel,
+            "series_number": serie_num,
+        },
+        "first_instance": {
+            "sop_instance_uid": getattr(inst, "uid", None),
+            "dicom_tags": inst.tags
+        }
+    }
+
+    pet_quality = compute_pet_quality_from_orthanc_series(
+        series_selec, quality_params or _quality_params()
+    )
+    out["pet_quality"] = pet_quality
+
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(out, f, ensure_ascii=False, indent=2)
+
+    contar("estudios_procesados")
+    contar("series_procesadas")
+    return out_path
+
+
+def exportar_series_pet(client, output_dir="./header_pet", entregar=None):
+    """
+    Recorre todos los estudios en Orthanc (mas recientes primero) y exporta un JSON por cada serie PET
+    (sólo la primera instancia) de los estudios cuyo StudyDescription contenga
+    'PET CUERPO COMPLETO-FD'.
 
-            out = {
-                    "patient": {
-                        "patient_name": getattr(patient, "name", None)
-                    },
-                    "study": {
-                        "study_instance_uid": getattr(study, "uid", None),
-                        "study_description": desc
-                    },
-                    "series": {
-                        "series_instance_uid": getattr(series_selec, "uid", None),
-                        "modality": modality_sel,
-                        "series_number": serie_num,
-                    },
-                    "first_instance": {
-                        "sop_instance_uid": getattr(inst, "uid", None),
-                        "dicom_tags": inst.tags
-                    }
-                }
-
-                        # Comprobar si el archivo JSON ya existe antes de procesar
-
-            pet_quality = compute_pet_quality_from_orthanc_series(
-                series_selec, quality_params
-            )
-            out["pet_quality"] = pet_quality
- 
-            with open(out_path, "w", encoding="utf-8") as f:
-                json.dump(out, f, ensure_ascii=False, indent=2)
+    Parámetros:
+        client (pyorthanc.Orthanc): cliente conectado a Orthanc
+        output_dir (str): carpeta donde guardar los JSON
+        entregar (callable): si se indica, recibe el JSON de cada estudio apenas se escribe
+    """
+    os.makedirs(output_dir, exist_ok=True) #crear carpeta de salida si no existe
+    total_json = 0
 
+    try:
+        estudios = FuenteOrthanc(client).por_fecha() #estudios de orthanc, del mas reciente al mas antiguo
+    except Exception as exc:
+        logger.exception("No se pudieron obtener estudios desde Orthanc: %s", exc)
+        return
+
+    if not estudios:
+        logger.warning("Orthanc no devolvió estudios. Verifique filtros, URL o credenciales.")
+        return
+
+    logger.info("[PET] Estudios a revisar: %d | Filtro StudyDescription: '%s'", len(estudios), STUDY_DESCRIPTION)
+
+    quality_params = _quality_params()
+
+    for patient, study in estudios:
+        ruta = exportar_estudio_pet(patient, study, output_dir, quality_params)
+        if ruta:
             total_json += 1
+            if entregar:
+                entregar([ruta])
 
     logger.info(f"[PET] JSON exportados: {total_json} en '{output_dir}'.")
 
+
 def compute_pet_quality_from_orthanc_series(series, params: Dict[str, Any]) -> Dict[str, Any]:
     """
     Calcula la métrica de calidad (GNI) a partir de la serie PET obteniendo
@@ -261,17 +283,15 @@ def _safe_int(value, default: Optional[int] = None) -> Optional[int]:
 
 
 def _load_instance_dataset(instance) -> pydicom.Dataset:
+    # Lectura a traves de la cache local (orthanc/cache.py): una re-corrida no vuelve a descargar
     try:
-        return instance.get_pydicom()
-    except Exception:
-        try:
-            raw = instance.get_dicom_file_content()
-        except Exception as exc:
-            raise RuntimeError(f"descarga DICOM fallida: {exc}") from exc
-        try:
-            return pydicom.dcmread(BytesIO(raw), force=True)
-        except InvalidDicomError as exc:
-            raise RuntimeError(f"DICOM inválido: {exc}") from exc
+        raw = leer_bytes(instance)
+    except Exception as exc:
+        raise RuntimeError(f"descarga DICOM fallida: {exc}") from exc
+    try:
+        return pydicom.dcmread(BytesIO(raw), force=True)
+    except InvalidDicomError as exc:
+        raise RuntimeError(f"DICOM inválido: {exc}") from exc
 
 
 def dataset_to_suv_slice(ds: pydicom.Dataset, suv_factor: float) -> np.ndarray:
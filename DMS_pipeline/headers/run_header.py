@@ -1,16 +1,77 @@
-import pyorthanc
-from headers.header_pet import exportar_series_pet
-from headers.header_ct import exportar_series_ct
-from config import ORTHANC_URL, ORTHANC_USER, ORTHANC_PASS
+import logging
+import os
+from pathlib import Path
 
-# Conectar a Orthanc
-client = pyorthanc.Orthanc(ORTHANC_URL, ORTHANC_USER, ORTHANC_PASS, timeout = 60, trust_env = False)
+from fuentes import fuente_orthanc
+from headers.header_pet import exportar_estudio_pet, exportar_series_pet
+from headers.header_ct import exportar_estudio_ct, exportar_series_ct
+from telemetria import fallo_estudio
 
-# Ejecutar exportación de series CT
+# Orthanc (transporte compartido con el OCR: mismo limite de concurrencia y circuito);
+# el cliente se crea al primer uso
+FUENTE = fuente_orthanc()
+
+logger = logging.getLogger(__name__)
+
+
+def main_ct(entregar=None):
+    exportar_series_ct(FUENTE.client, output_dir="header_ct", entregar=entregar)
+
+
+def main_pet(entregar=None):
+    exportar_series_pet(FUENTE.client, output_dir="header_pet", entregar=entregar)
+
+
+def _exportados(directorio, study_id):
+    return [str(p) for p in Path(directorio).glob(f"*_{study_id}.json")]
+
+
+def _entregados(directorio, study_id, entregar):
+    rutas = _exportados(directorio, study_id)
+    if entregar and rutas:
+        entregar(rutas)
+    return rutas
+
+
+def main_estudios_ct(study_ids=None, fuente=None, entregar=None):
+    """Headers CT solo de los estudios indicados (o de toda la `fuente`). Devuelve sus JSON (nuevos o ya existentes)
+    y, con `entregar`, se los pasa estudio por estudio; los estudios que fallan quedan en estudios_fallidos
+    de la etapa (ver telemetria.py)."""
+    os.makedirs("header_ct", exist_ok=True)
+    rutas = []
+    for patient, study in (fuente or FUENTE).estudios(study_ids):
+        try:
+            exportar_estudio_ct(patient, study, output_dir="header_ct")
+        except Exception as exc:
+            logger.exception("[CT] Falló la exportación del estudio %s", study.id_)
+            fallo_estudio(study.id_, exc)
+            continue
+        rutas += _entregados("header_ct", study.id_, entregar)
+    return rutas
+
+
+def main_estudios_pet(study_ids=None, fuente=None, entregar=None):
+    """Headers PET solo de los estudios indicados (o de toda la `fuente`). Devuelve sus JSON (nuevos o ya existentes)
+    y, con `entregar`, se los pasa estudio por estudio; los estudios que fallan quedan en estudios_fallidos
+    de la etapa (ver telemetria.py)."""
+    os.makedirs("header_pet", exist_ok=True)
+    rutas = []
+    for patient, study in (fuente or FUENTE).estudios(study_ids):
+        try:
+            exportar_estudio_pet(patient, study, output_dir="header_pet")
+        except Exception as exc:
+            logger.exception("[PET] Falló la exportación del estudio %s", study.id_)
+            fallo_estudio(study.id_, exc)
+            continue
+        rutas += _entregados("header_pet", study.id_, entregar)
+    return rutas
+
+
+# Ejecutar exportación de series CT y PET
 def main():
-    exportar_series_ct(client, output_dir="header_ct")
-    exportar_series_pet(client, output_dir="header_pet")
+    main_ct()
+    main_pet()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,24 +1,157 @@
-"""Punto de entrada del pipeline de ingesta (OCR + headers + Mongo)."""
+"""Punto de entrada del pipeline de ingesta (OCR + headers + Mongo).
+
+Las etapas forman un grafo de dependencias: OCR, headers CT y headers PET
+son independientes y corren en paralelo (hasta PIPELINE_WORKERS hilos); cada
+carga a Mongo arranca junto con su extractor y sube los JSON estudio por
+estudio a medida que el extractor los entrega (Flujo), en un hilo propio
+que no ocupa lugar del pool; VTL espera a las cargas de OCR y CT. Como
+antes, el fallo de una etapa se registra y no detiene a las demas: sus
+dependientes corren igual con el resultado por defecto.
+
+Con `procesar_estudios(ids)` el mismo grafo corre solo sobre esos estudios
+de Orthanc (ingesta por evento, backfill, worker): los extractores
+devuelven los JSON de esos estudios y las cargas suben solo esos. Con
+`procesar_directorio(ruta)` (o `--directorio`) los estudios salen de una
+exportacion DICOM local en vez de Orthanc (ver fuentes/). Dos corridas del
+mismo proceso nunca se solapan (_EJECUCION); las de `prioridad` (ingesta por
+evento) pasan delante de las que esperan turno (ciclo del scheduler, worker).
+
+Con `--stages` (o PIPELINE_STAGES) se corre solo una parte del grafo:
+`ocr`, `ct`, `pet` (extractores) y `upload` (indices, cargas a Mongo y VTL);
+una carga cuyo extractor no corre sube todo su directorio. Los extractores
+se importan recien al ejecutarse, asi que una corrida solo de headers o
+solo de carga no carga easyocr/torch ni abre clientes que no usa:
+    python launcher.py --stages ct,pet,upload
+    python launcher.py --stages upload
+
+Cada corrida deja su telemetria por etapa en COL_RUNS (ver telemetria.py).
+Con PIPELINE_PROFILE o `--profile` las etapas elegidas se perfilan (ver
+perfilado.py):
+    python launcher.py --profile ocr,headers_pet --profile-dir /tmp/perfiles
+"""
+import argparse
+import importlib
 import logging
+import queue
 import sys
+import threading
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
 
-from ocr.run_ocr import main as run_ocr_main
-from headers.run_header import main as run_header_main
+from config import COL_RUNS, PIPELINE_STAGES, PIPELINE_WORKERS
 from mongo.mongo_uploader import (
     cargar_jsons_ocr,
     cargar_jsons_ct_headers,
     cargar_jsons_pet_headers,
+    asegurar_indices,
+    db,
 )
+from mongo.vtl import actualizar_vtl
+from telemetria import Corrida
+import perfilado
 
 
 logger = logging.getLogger(__name__)
 
+class Turnos:
+    """Una corrida a la vez; al liberarse, las de prioridad que esperan pasan primero."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._ocupado = False
+        self._prioritarias = 0  # en espera
+
+    @contextmanager
+    def turno(self, prioridad: bool = False):
+        with self._cond:
+            self._prioritarias += int(prioridad)
+            try:
+                while self._ocupado or (not prioridad and self._prioritarias):
+                    self._cond.wait()
+            finally:
+                self._prioritarias -= int(prioridad)
+            self._ocupado = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._ocupado = False
+                self._cond.notify_all()
+
+
+# Una sola corrida a la vez en el proceso (scheduler y disparador comparten launcher)
+_EJECUCION = Turnos()
+
+# Grupo de --stages -> etapas del grafo
+GRUPOS_ETAPAS = {
+    "ocr": ("ocr",),
+    "ct": ("headers_ct",),
+    "pet": ("headers_pet",),
+    "upload": ("indices", "carga_ocr", "carga_ct", "carga_pet", "vtl"),
+}
+
+
+def _diferida(modulo: str, funcion: str) -> Callable[..., Any]:
+    """`modulo.funcion`, importado recien en la primera llamada (OCR importa easyocr/torch)."""
+    def llamar(*args, **kwargs):
+        return getattr(importlib.import_module(modulo), funcion)(*args, **kwargs)
+    llamar.__name__ = funcion
+    return llamar
+
+
+run_ocr_main = _diferida("ocr.run_ocr", "main")
+run_ocr_estudios = _diferida("ocr.run_ocr", "main_estudios")
+run_header_ct = _diferida("headers.run_header", "main_ct")
+run_header_pet = _diferida("headers.run_header", "main_pet")
+run_header_ct_estudios = _diferida("headers.run_header", "main_estudios_ct")
+run_header_pet_estudios = _diferida("headers.run_header", "main_estudios_pet")
+
+
+class Flujo:
+    """JSON que un extractor entrega estudio por estudio a su carga.
+
+    El extractor llama a `poner(rutas)` al terminar cada estudio y el grafo
+    cierra el flujo cuando la etapa termina (bien o con error); la carga lo
+    recorre mientras tanto y recibe una lista de rutas por estudio.
+    """
+
+    _FIN = object()
+
+    def __init__(self):
+        self._cola: "queue.Queue[Any]" = queue.Queue()
+
+    def poner(self, rutas: Iterable[Any]) -> None:
+        self._cola.put(list(rutas))
+
+    def cerrar(self) -> None:
+        self._cola.put(self._FIN)
+
+    def __iter__(self):
+        while True:
+            rutas = self._cola.get()
+            if rutas is self._FIN:
+                return
+            yield rutas
+
+
+class Etapa(NamedTuple):
+    nombre: str
+    depende: Tuple[str, ...]
+    ejecutar: Callable[[Dict[str, Any]], Any]  # recibe los resultados de las etapas previas
+    inicio: str
+    ok: str
+    error: str
+    defecto: Any = None
+    # Si la etapa entrega por estudio: sus dependientes arrancan junto con ella y reciben el Flujo
+    flujo: Optional[Flujo] = None
+
 
 def _configure_logging():
     # Fuerza la configuración aunque ya existan handlers
     logging.basicConfig(
         level=logging.INFO,
-        format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
+        format="%(asctime)s - %(levelname)s - %(threadName)s - %(name)s - %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S",
         handlers=[logging.StreamHandler(sys.stdout)],
         force=True,
@@ -29,42 +162,242 @@ def _configure_logging():
     logging.getLogger("httpcore").setLevel(logging.WARNING)
 
 
-def main():
+def etapas_pipeline(estudios: Optional[Sequence[str]] = None, fuente=None) -> List[Etapa]:
+    """Grafo de etapas. Sin `estudios` ni `fuente` se recorre todo Orthanc y las
+    cargas leen los directorios completos; con `estudios` (IDs de Orthanc) solo
+    esos; con `fuente` (ver fuentes/) los estudios salen de ahi."""
+    # Las funciones se resuelven al ejecutar (no al definir) para poder envolverlas
+    flujos = {nombre: Flujo() for nombre in ("ocr", "headers_ct", "headers_pet")}
+    completa = estudios is None and fuente is None
+    if completa:
+        ocr = lambda r: run_ocr_main(entregar=flujos["ocr"].poner)
+        headers_ct = lambda r: run_header_ct(entregar=flujos["headers_ct"].poner)
+        headers_pet = lambda r: run_header_pet(entregar=flujos["headers_pet"].poner)
+        vacio = None  # los extractores completos no devuelven archivos: la carga lee todo el directorio
+    else:
+        ocr = lambda r: run_ocr_estudios(estudios, fuente, entregar=flujos["ocr"].poner)
+        headers_ct = lambda r: run_header_ct_estudios(estudios, fuente, entregar=flujos["headers_ct"].poner)
+        headers_pet = lambda r: run_header_pet_estudios(estudios, fuente, entregar=flujos["headers_pet"].poner)
+        vacio = []
+    return [
+        Etapa("indices", (), lambda r: asegurar_indices(),
+              "Asegurando índices en MongoDB…", "Índices en MongoDB verificados",
+              "No se pudieron asegurar los índices en MongoDB"),
+        Etapa("ocr", (), ocr,
+              "Iniciando OCR de reportes de dosis…", "OCR finalizó correctamente",
+              "OCR finalizó con errores", defecto=vacio, flujo=flujos["ocr"]),
+        Etapa("headers_ct", (), headers_ct,
+              "Ejecutando extracción de headers DICOM CT…", "Extracción de headers CT finalizó correctamente",
+              "Extracción de headers CT finalizó con errores", defecto=vacio, flujo=flujos["headers_ct"]),
+        Etapa("headers_pet", (), headers_pet,
+              "Ejecutando extracción de headers DICOM PET…", "Extracción de headers PET finalizó correctamente",
+              "Extracción de headers PET finalizó con errores", defecto=vacio, flujo=flujos["headers_pet"]),
+        Etapa("carga_ocr", ("indices", "ocr"), lambda r: _cargar(cargar_jsons_ocr, "ocr_output", r.get("ocr"), completa),
+              "Subiendo resultados OCR a MongoDB…", "Carga OCR a MongoDB finalizada",
+              "Carga de resultados OCR en MongoDB falló", defecto=[]),
+        Etapa("carga_ct", ("indices", "headers_ct"),
+              lambda r: _cargar(cargar_jsons_ct_headers, "header_ct", r.get("headers_ct"), completa),
+              "Subiendo headers CT a MongoDB…", "Carga de headers CT a MongoDB finalizada",
+              "Carga de headers CT en MongoDB falló", defecto=[]),
+        Etapa("carga_pet", ("indices", "headers_pet"),
+              lambda r: _cargar(cargar_jsons_pet_headers, "header_pet", r.get("headers_pet"), completa),
+              "Subiendo headers PET a MongoDB…", "Carga de headers PET a MongoDB finalizada",
+              "Carga de headers PET en MongoDB falló"),
+        # Cruce OCR x CT por serie (solo lo que cambió en esta corrida)
+        Etapa("vtl", ("carga_ocr", "carga_ct"),
+              lambda r: actualizar_vtl(exam_nos=r.get("carga_ocr"), study_uids=r.get("carga_ct")),
+              "Actualizando colección VTL (OCR x CT)…", "Actualización de colección VTL finalizada",
+              "Actualización de colección VTL falló"),
+    ]
+
+
+def _cargar(cargar: Callable[..., Any], directorio: str, entrada: Any, completa: bool) -> Any:
+    """Sube los JSON de `entrada`: una lista de rutas, None (todo el directorio)
+    o el Flujo de un extractor que sigue corriendo, estudio por estudio.
+    En una corrida completa el Flujo solo trae lo recien exportado: al cerrarse
+    se recorre ademas el directorio, por los JSON de corridas previas que no
+    llegaron a subirse (los documentos sin cambios no se reescriben)."""
+    if not isinstance(entrada, Flujo):
+        return cargar(directorio, entrada)
+    cambiados: List[Any] = []
+    for rutas in entrada:
+        cambiados += cargar(directorio, rutas) or []
+    if completa:
+        cambiados += cargar(directorio, None) or []
+    return cambiados
+
+
+def seleccionar_etapas(etapas: List[Etapa], grupos: Optional[Iterable[str]] = None) -> List[Etapa]:
+    """Solo las etapas de los `grupos` (ver GRUPOS_ETAPAS; None o vacio = todas).
+    Las dependencias en etapas descartadas se quitan: la etapa recibe el resultado
+    por defecto (p. ej. la carga sin extractor sube todo el directorio)."""
+    if isinstance(grupos, str):
+        grupos = grupos.split(",")
+    grupos = [g.strip().lower() for g in grupos or () if g.strip()]
+    if not grupos:
+        return etapas
+    desconocidos = sorted(set(grupos) - set(GRUPOS_ETAPAS))
+    if desconocidos:
+        raise ValueError(f"Etapas desconocidas: {', '.join(desconocidos)} (validas: {', '.join(GRUPOS_ETAPAS)})")
+    nombres = {nombre for g in grupos for nombre in GRUPOS_ETAPAS[g]}
+    return [
+        e._replace(depende=tuple(d for d in e.depende if d in nombres))
+        for e in etapas if e.nombre in nombres
+    ]
+
+
+def _correr_etapa(etapa: Etapa, previos: Dict[str, Any], corrida: Corrida) -> Any:
+    prefijo = corrida.inicio.strftime("%Y%m%dT%H%M%S")
+    with corrida.etapa(etapa.nombre) as medicion, perfilado.perfilar(etapa.nombre, prefijo):
+        logger.info(etapa.inicio)
+        try:
+            resultado = etapa.ejecutar(previos)
+        except Exception:
+            medicion.estado = "error"
+            logger.exception(etapa.error)
+            return etapa.defecto
+        finally:
+            if etapa.flujo is not None:
+                etapa.flujo.cerrar()
+        logger.info(etapa.ok)
+        return etapa.defecto if resultado is None else resultado
+
+
+def ejecutar_grafo(
+    etapas: List[Etapa], max_workers: int = PIPELINE_WORKERS, corrida: Optional[Corrida] = None,
+) -> Dict[str, Any]:
+    """Lanza cada etapa cuando terminaron sus dependencias. Devuelve los resultados por nombre.
+
+    Una dependencia con `flujo` cuenta apenas arranca: la etapa recibe su Flujo
+    en vez del resultado y corre en un hilo aparte (pasa la mayor parte del
+    tiempo esperando al extractor, no debe quitarle lugar a otra etapa)."""
+    corrida = corrida or Corrida()
+    resultados: Dict[str, Any] = {}
+    flujos: Dict[str, Flujo] = {}  # etapas con flujo que arrancaron y no terminaron
+    pendientes = {e.nombre: e for e in etapas}
+    en_curso = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="etapa") as pool, \
+            ThreadPoolExecutor(max_workers=max(1, sum(e.flujo is not None for e in etapas)),
+                               thread_name_prefix="flujo") as consumidores:
+        while pendientes or en_curso:
+            listas = True
+            while listas:  # lanzar una etapa con flujo puede habilitar a las que lo consumen
+                listas = [e for e in pendientes.values() if all(d in resultados or d in flujos for d in e.depende)]
+                for etapa in listas:
+                    del pendientes[etapa.nombre]
+                    en_flujo = {d: flujos[d] for d in etapa.depende if d not in resultados}
+                    ejecutor = consumidores if en_flujo else pool
+                    en_curso[ejecutor.submit(_correr_etapa, etapa, {**resultados, **en_flujo}, corrida)] = etapa
+                    if etapa.flujo is not None:
+                        flujos[etapa.nombre] = etapa.flujo
+            if not en_curso:
+                logger.error("Etapas con dependencias inexistentes o cíclicas: %s", sorted(pendientes))
+                break
+            hechos, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+            for futuro in hechos:
+                nombre = en_curso.pop(futuro).nombre
+                resultados[nombre] = futuro.result()
+                flujos.pop(nombre, None)
+    return resultados
+
+
+def _reiniciar_metadatos() -> None:
+    # Si orthanc/metadatos.py todavia no se importo no hay nada memorizado
+    metadatos = sys.modules.get("orthanc.metadatos")
+    if metadatos is not None:
+        metadatos.reiniciar()
+
+
+def _metricas_orthanc() -> Optional[Dict[str, Any]]:
+    """Metricas del acceso a Orthanc mas las requests que se ahorro el memo de
+    metadatos; None si la corrida no uso Orthanc (p. ej. --stages upload)."""
+    acceso, metadatos = sys.modules.get("orthanc.acceso"), sys.modules.get("orthanc.metadatos")
+    if acceso is None:
+        return None
+    return {**acceso.metricas(), "metadatos": metadatos.estadisticas() if metadatos else {}}
+
+
+def _estadisticas_cache() -> Optional[Dict[str, Any]]:
+    cache = sys.modules.get("orthanc.cache")
+    return cache.estadisticas() if cache is not None else None
+
+
+def main(origen: str = "manual", etapas: Optional[Iterable[str]] = PIPELINE_STAGES):
     _configure_logging()
+    with _EJECUCION.turno():
+        corrida = Corrida(origen)
+        _reiniciar_metadatos()
+        ejecutar_grafo(seleccionar_etapas(etapas_pipeline(), etapas), corrida=corrida)
+        corrida.orthanc = _metricas_orthanc()
+        corrida.cache_dicom = _estadisticas_cache()
+        corrida.guardar(db, COL_RUNS)
 
-    # 1) OCR
-    try:
-        logger.info("Iniciando OCR de reportes de dosis…")
-        run_ocr_main()
-        logger.info("OCR finalizó correctamente")
-    except Exception:
-        logger.exception("OCR finalizó con errores")
 
-    # 2) Subir OCR a Mongo
-    try:
-        logger.info("Subiendo resultados OCR a MongoDB…")
-        cargar_jsons_ocr("ocr_output")
-        logger.info("Carga OCR a MongoDB finalizada")
-    except Exception:
-        logger.exception("Carga de resultados OCR en MongoDB falló")
+def procesar_estudios(
+    study_ids: Iterable[str], origen: str = "evento", etapas: Optional[Iterable[str]] = PIPELINE_STAGES,
+    prioridad: bool = False,
+) -> Dict[str, Any]:
+    """Corre el pipeline solo para los estudios de Orthanc indicados. Devuelve el reporte de la corrida.
+    Con `prioridad` la corrida pasa delante de las que esperan turno (ver Turnos)."""
+    estudios = list(dict.fromkeys(study_ids))  # sin repetidos, en orden de llegada
+    with _EJECUCION.turno(prioridad):
+        corrida = Corrida(origen, estudios=estudios)
+        _reiniciar_metadatos()
+        ejecutar_grafo(seleccionar_etapas(etapas_pipeline(estudios), etapas), corrida=corrida)
+        corrida.orthanc = _metricas_orthanc()
+        corrida.cache_dicom = _estadisticas_cache()
+        return corrida.guardar(db, COL_RUNS)
 
-    # 3) Headers DICOM (CT + PET)
-    try:
-        logger.info("Ejecutando extracción de headers DICOM…")
-        run_header_main()
-        logger.info("Extracción de headers DICOM finalizó correctamente")
-    except Exception:
-        logger.exception("Extracción de headers DICOM finalizó con errores")
 
-    # 4) Subir headers a Mongo
-    try:
-        logger.info("Subiendo headers DICOM a MongoDB…")
-        cargar_jsons_ct_headers("header_ct")
-        cargar_jsons_pet_headers("header_pet")
-        logger.info("Carga de headers a MongoDB finalizada")
-    except Exception:
-        logger.exception("Carga de headers en MongoDB falló")
+def procesar_directorio(
+    raiz: str, origen: Optional[str] = None, etapas: Optional[Iterable[str]] = PIPELINE_STAGES,
+) -> Dict[str, Any]:
+    """Corre el pipeline sobre una exportacion DICOM local, sin pasar por Orthanc."""
+    from fuentes import FuenteDirectorio
+
+    fuente = FuenteDirectorio(raiz)
+    with _EJECUCION.turno():
+        corrida = Corrida(origen or f"directorio:{raiz}")
+        # El indice se arma antes del grafo: los tres extractores lo comparten
+        with corrida.etapa("indexar_directorio") as medicion:
+            try:
+                indice = fuente.indexar()
+            except Exception:
+                medicion.estado = "error"
+                logger.exception("No se pudo indexar el directorio %s", raiz)
+                indice = {}
+        if indice:
+            ejecutar_grafo(seleccionar_etapas(etapas_pipeline(list(indice), fuente), etapas), corrida=corrida)
+        corrida.cache_dicom = _estadisticas_cache()
+        return corrida.guardar(db, COL_RUNS)
+
+
+def agregar_argumentos_perfilado(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--profile", help="etapas a perfilar separadas por coma, o 'all' (ver perfilado.py)")
+    parser.add_argument("--profile-dir", help="directorio de los perfiles")
+
+
+def aplicar_argumentos_perfilado(args: argparse.Namespace) -> None:
+    if args.profile is not None or args.profile_dir:
+        perfilado.configurar(args.profile, args.profile_dir)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Ejecuta una corrida del pipeline de ingesta")
+    parser.add_argument("--directorio", help="procesar una exportacion DICOM local en vez de Orthanc")
+    parser.add_argument(
+        "--stages", default=PIPELINE_STAGES,
+        help=f"etapas a correr separadas por coma: {','.join(GRUPOS_ETAPAS)} (por defecto todas)",
+    )
+    agregar_argumentos_perfilado(parser)
+    args = parser.parse_args()
+    aplicar_argumentos_perfilado(args)
+    try:
+        seleccionar_etapas([], args.stages)
+    except ValueError as exc:
+        parser.error(str(exc))
+    if args.directorio:
+        _configure_logging()
+        procesar_directorio(args.directorio, etapas=args.stages)
+    else:
+        main(etapas=args.stages)
@@ -0,0 +1,237 @@
+"""
+Cola de trabajo compartida por estudio, con leases en MongoDB.
+
+Varios procesos del pipeline (en uno o varios hosts, ver worker.py) toman
+estudios de la misma coleccion. Un documento por estudio de Orthanc:
+    {"_id": <ID Orthanc>, "estado": "pendiente" | "en_proceso" | "hecho" | "fallido",
+     "fecha_estudio": "20240131093000", "intentos": 2, "token": 7, "nodo": "host-a:4312",
+     "lease_hasta": ISODate(...), "encolado": ISODate(...), "actualizado": ISODate(...), "error": "..."}
+
+- `reclamar` toma un estudio con find_one_and_update atomico: pendiente, o
+  en_proceso con el lease vencido (el nodo que lo tenia murio). Cada reclamo
+  incrementa `intentos` y `token`.
+- La cola es por prioridad: se reclama primero el estudio con la fecha de
+  adquisicion (`fecha_estudio`) mas reciente, asi los examenes del dia no
+  esperan detras de un backfill de anos. Para que el atraso igual avance,
+  `CuotaBackfill` reserva una fraccion de los reclamos (WORKER_BACKFILL_SHARE)
+  para el estudio mas antiguo; los encolados sin fecha cuentan como antiguos.
+- El nodo renueva sus leases (`renovar`) mientras procesa; `completar` y
+  `liberar` solo tienen efecto si el `token` sigue siendo el del reclamo
+  (fencing): si el lease vencio y otro nodo lo reclamo, la respuesta tardia
+  del primero se descarta.
+- Un estudio que agota WORKER_MAX_ATTEMPTS queda "fallido" con el ultimo error.
+- La cola es tambien el registro de lo ya visto: el scan de respaldo
+  (scheduler.py) encola solo los estudios de Orthanc que `faltantes` no
+  encuentra en ningun estado, y lo procesado por evento fuera de la cola se
+  anota con `registrar_hechos`.
+
+Cada estudio queda "hecho" una sola vez por encolado. Si el lease de un nodo
+vence a mitad de camino, el estudio puede procesarse de nuevo en otro nodo;
+las cargas a Mongo son idempotentes (hash de contenido en mongo_uploader),
+asi que una repeticion no duplica documentos.
+
+Como indexes.py y versiones.py, solo depende de pymongo.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+
+logger = logging.getLogger(__name__)
+
+PENDIENTE = "pendiente"
+EN_PROCESO = "en_proceso"
+HECHO = "hecho"
+FALLIDO = "fallido"
+
+# Sin fecha_estudio (null) queda ultimo en la prioridad y primero en el backfill.
+# Uno es el inverso del otro: ambos usan el indice estado_fecha (mongo/indexes.py)
+_ORDEN_PRIORIDAD = [("fecha_estudio", DESCENDING), ("encolado", ASCENDING)]
+_ORDEN_BACKFILL = [("fecha_estudio", ASCENDING), ("encolado", DESCENDING)]
+
+
+class CuotaBackfill:
+    """Reparte los reclamos de un nodo: de cada 1/cuota, uno va al estudio mas
+    antiguo (credito acumulado, sin azar: con 0.2 es el 5to, 10mo, ...)."""
+
+    def __init__(self, cuota: float):
+        self.cuota = min(max(cuota, 0.0), 1.0)
+        self._credito = 0.0
+
+    def toca_backfill(self) -> bool:
+        self._credito += self.cuota
+        if self._credito >= 1.0 - 1e-9:
+            self._credito -= 1.0
+            return True
+        return False
+
+
+def encolar(
+    db, coleccion: str, study_ids: Iterable[str], origen: str = "manual", fechas: Optional[Dict[str, str]] = None,
+) -> int:
+    """Agrega estudios a la cola. Los ya terminados vuelven a pendiente (p. ej.
+    el estudio recibio instancias nuevas); los que estan en proceso se marcan
+    para repetirse al terminar. `fechas` (study_id -> "YYYYMMDDHHMMSS", ver
+    fuentes.fecha_adquisicion) fija la prioridad. Devuelve cuantos quedaron
+    pendientes de nuevo o por primera vez."""
+    ahora = datetime.utcnow()
+    ids = list(dict.fromkeys(study_ids))
+    if not ids:
+        return 0
+    fechas = fechas or {}
+    operaciones = [
+        UpdateOne(
+            {"_id": study_id, "estado": {"$ne": EN_PROCESO}},
+            {
+                "$set": {"estado": PENDIENTE, "intentos": 0, "origen": origen, "actualizado": ahora,
+                         **({"fecha_estudio": fechas[study_id]} if fechas.get(study_id) else {})},
+                "$min": {"encolado": ahora},  # un aviso repetido no lo manda al final de la cola
+                "$unset": {"error": "", "lease_hasta": "", "nodo": ""},
+                "$setOnInsert": {"token": 0},
+            },
+            upsert=True,
+        )
+        for study_id in ids
+    ]
+    try:
+        resultado = db[coleccion].bulk_write(operaciones, ordered=False)
+        return resultado.upserted_count + resultado.modified_count
+    except BulkWriteError as exc:
+        # E11000: el estudio esta en proceso (el filtro no coincide y el upsert choca con su _id)
+        en_proceso = [ids[e["index"]] for e in exc.details.get("writeErrors", []) if e.get("code") == 11000]
+        if len(en_proceso) < len(exc.details.get("writeErrors", [])):
+            raise
+        db[coleccion].update_many({"_id": {"$in": en_proceso}, "estado": EN_PROCESO},
+                                  {"$set": {"repetir": True, "actualizado": ahora}})
+        return exc.details.get("nUpserted", 0) + exc.details.get("nModified", 0)
+
+
+def faltantes(db, coleccion: str, study_ids: Iterable[str], tanda: int = 1000) -> List[str]:
+    """Los `study_ids` que la cola no tiene (en ningun estado), en el orden recibido."""
+    ids = list(dict.fromkeys(study_ids))
+    conocidos = set()
+    for i in range(0, len(ids), tanda):
+        conocidos.update(d["_id"] for d in db[coleccion].find({"_id": {"$in": ids[i:i + tanda]}}, {"_id": 1}))
+    return [study_id for study_id in ids if study_id not in conocidos]
+
+
+def registrar_hechos(
+    db, coleccion: str, study_ids: Iterable[str], origen: str, fechas: Optional[Dict[str, str]] = None,
+) -> None:
+    """Anota como hechos estudios procesados fuera de la cola (ingesta por evento),
+    para que el scan de respaldo no los vuelva a encolar. Los que estan en proceso
+    en algun worker no se tocan."""
+    ahora = datetime.utcnow()
+    fechas = fechas or {}
+    operaciones = [
+        UpdateOne(
+            {"_id": study_id, "estado": {"$ne": EN_PROCESO}},
+            {
+                "$set": {"estado": HECHO, "origen": origen, "actualizado": ahora, "terminado": ahora,
+                         **({"fecha_estudio": fechas[study_id]} if fechas.get(study_id) else {})},
+                "$min": {"encolado": ahora},
+                "$unset": {"error": "", "lease_hasta": "", "nodo": ""},
+                "$setOnInsert": {"token": 0, "intentos": 0},
+            },
+            upsert=True,
+        )
+        for study_id in dict.fromkeys(study_ids)
+    ]
+    if not operaciones:
+        return
+    try:
+        db[coleccion].bulk_write(operaciones, ordered=False)
+    except BulkWriteError as exc:
+        # E11000: en proceso en un worker (el filtro no coincide y el upsert choca con su _id)
+        if any(e.get("code") != 11000 for e in exc.details.get("writeErrors", [])):
+            raise
+
+
+def reclamar(
+    db, coleccion: str, nodo: str, lease_s: float, max_intentos: int, backfill: bool = False,
+) -> Optional[Dict[str, Any]]:
+    """Toma un estudio de la cola: el de fecha de adquisicion mas reciente (a igual
+    fecha, el encolado hace mas tiempo), o con `backfill` el mas antiguo. None si no hay."""
+    ahora = datetime.utcnow()
+    return db[coleccion].find_one_and_update(
+        {
+            "$or": [
+                {"estado": PENDIENTE},
+                {"estado": EN_PROCESO, "lease_hasta": {"$lt": ahora}},
+            ],
+            "intentos": {"$lt": max_intentos},
+        },
+        {
+            "$set": {"estado": EN_PROCESO, "nodo": nodo, "lease_hasta": ahora + timedelta(seconds=lease_s),
+                     "actualizado": ahora},
+            "$inc": {"intentos": 1, "token": 1},
+        },
+        sort=_ORDEN_BACKFILL if backfill else _ORDEN_PRIORIDAD,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def renovar(db, coleccion: str, study_id: str, token: int, lease_s: float) -> bool:
+    """Extiende el lease. False si el nodo ya no lo tiene (vencio y otro lo reclamo)."""
+    resultado = db[coleccion].update_one(
+        {"_id": study_id, "token": token, "estado": EN_PROCESO},
+        {"$set": {"lease_hasta": datetime.utcnow() + timedelta(seconds=lease_s)}},
+    )
+    return resultado.matched_count == 1
+
+
+def completar(db, coleccion: str, study_id: str, token: int) -> bool:
+    """Marca el estudio como hecho (o pendiente otra vez si se re-encolo mientras corria)."""
+    ahora = datetime.utcnow()
+    col = db[coleccion]
+    filtro = {"_id": study_id, "token": token, "estado": EN_PROCESO}
+    resultado = col.update_one(
+        {**filtro, "repetir": {"$ne": True}},
+        {"$set": {"estado": HECHO, "actualizado": ahora, "terminado": ahora},
+         "$unset": {"lease_hasta": "", "error": ""}},
+    )
+    if resultado.matched_count == 1:
+        return True
+    resultado = col.update_one(
+        {**filtro, "repetir": True},
+        {"$set": {"estado": PENDIENTE, "intentos": 0, "encolado": ahora, "actualizado": ahora},
+         "$unset": {"lease_hasta": "", "repetir": "", "error": ""}},
+    )
+    return resultado.matched_count == 1
+
+
+def liberar(db, coleccion: str, study_id: str, token: int, error: str, max_intentos: int) -> bool:
+    """Devuelve el estudio a la cola tras un fallo, o lo marca fallido si agoto los intentos."""
+    col = db[coleccion]
+    filtro = {"_id": study_id, "token": token, "estado": EN_PROCESO}
+    ahora = datetime.utcnow()
+    cambios = {"$unset": {"lease_hasta": ""}}
+    resultado = col.update_one(
+        {**filtro, "intentos": {"$gte": max_intentos}},
+        {"$set": {"estado": FALLIDO, "error": error, "actualizado": ahora}, **cambios},
+    )
+    if resultado.matched_count == 0:
+        resultado = col.update_one(filtro, {"$set": {"estado": PENDIENTE, "error": error, "actualizado": ahora}, **cambios})
+    return resultado.matched_count == 1
+
+
+def marcar_agotados(db, coleccion: str, max_intentos: int) -> int:
+    """Pasa a fallido los leases vencidos que ya no pueden reclamarse (el nodo murio en el ultimo intento)."""
+    resultado = db[coleccion].update_many(
+        {"estado": EN_PROCESO, "lease_hasta": {"$lt": datetime.utcnow()}, "intentos": {"$gte": max_intentos}},
+        {"$set": {"estado": FALLIDO, "error": "lease vencido en el ultimo intento", "actualizado": datetime.utcnow()},
+         "$unset": {"lease_hasta": ""}},
+    )
+    return resultado.modified_count
+
+
+def resumen(db, coleccion: str) -> Dict[str, int]:
+    """Cantidad de estudios por estado."""
+    conteo = {PENDIENTE: 0, EN_PROCESO: 0, HECHO: 0, FALLIDO: 0}
+    for fila in db[coleccion].aggregate([{"$group": {"_id": "$estado", "n": {"$sum": 1}}}]):
+        conteo[fila["_id"]] = fila["n"]
+    return conteo
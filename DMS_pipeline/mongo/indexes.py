@@ -0,0 +1,238 @@
+"""
+Declaracion y creacion de indices para las colecciones de dosis, CT y PET.
+
+Este modulo solo depende de pymongo para poder usarse tanto desde el
+pipeline (pymongo sincrono) como desde la API (Motor, asincrono).
+Las colecciones se identifican por su rol logico ("ocr", "ct", "pet", "vtl",
+"bajas", "runs", "cola") y el
+nombre real de cada coleccion lo entrega quien llama.
+
+- Indices unicos: claves de deduplicacion usadas por mongo_uploader.
+- Indices secundarios: fecha de estudio, paciente y protocolo.
+- Secuencia de ingesta (_ingest.seq) para la sincronizacion incremental.
+"""
+
+import logging
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+
+logger = logging.getLogger(__name__)
+
+# Rutas a los tags DICOM (formato /instances/{id}/tags de Orthanc) en cada coleccion
+TAGS_OCR = "dicom_header"
+TAGS_SERIES = "first_instance.dicom_tags"
+
+TAG_STUDY_DATE = "0008,0020"
+TAG_STUDY_UID = "0020,000d"
+TAG_PROTOCOL = "0018,1030"
+
+# Solo se indexan documentos con la clave presente (el uploader descarta los que no la tienen)
+_SOLO_STRING = {"$type": "string"}
+
+# Las bajas se conservan este tiempo; un cliente con un cursor mas antiguo debe recargar todo
+BAJAS_TTL_DIAS = 30
+
+_INDICE_INGESTA = IndexModel([("_ingest.seq", ASCENDING)], name="ingest_seq")
+
+
+def normalizar_texto(texto: Optional[str]) -> str:
+    """Mayusculas sin tildes ni espacios extremos: valor de los campos *_norm de la
+    coleccion VTL (los escribe mongo/vtl.py y los filtra la API con la misma funcion)."""
+    sin_tildes = unicodedata.normalize("NFD", str(texto or ""))
+    sin_tildes = "".join(c for c in sin_tildes if unicodedata.category(c) != "Mn")
+    return sin_tildes.strip().upper()
+
+
+def _tag(base: str, tag: str) -> str:
+    return f"{base}.{tag}.Value"
+
+
+def _indices_series(tags: str) -> List[IndexModel]:
+    """Indices comunes a las colecciones de series (CT y PET)."""
+    return [
+        IndexModel(
+            [("series.series_instance_uid", ASCENDING)],
+            name="uniq_series_uid",
+            unique=True,
+            partialFilterExpression={"series.series_instance_uid": _SOLO_STRING},
+        ),
+        IndexModel([("study.study_instance_uid", ASCENDING)], name="study_uid"),
+        IndexModel([(_tag(tags, TAG_STUDY_DATE), DESCENDING)], name="study_date"),
+        IndexModel([("patient.patient_name", ASCENDING)], name="patient"),
+        IndexModel([(_tag(tags, TAG_PROTOCOL), ASCENDING)], name="protocol"),
+        _INDICE_INGESTA,
+    ]
+
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "ocr": [
+        IndexModel(
+            [("encabezado.Exam no", ASCENDING)],
+            name="uniq_exam_no",
+            unique=True,
+            partialFilterExpression={"encabezado.Exam no": _SOLO_STRING},
+        ),
+        IndexModel([(_tag(TAGS_OCR, TAG_STUDY_DATE), DESCENDING)], name="study_date"),
+        IndexModel([(_tag(TAGS_OCR, TAG_STUDY_UID), ASCENDING)], name="study_uid"),
+        IndexModel([("encabezado.Patient Name", ASCENDING)], name="patient"),
+        IndexModel([("encabezado.Exam Description", ASCENDING)], name="protocol"),
+        _INDICE_INGESTA,
+    ],
+    "ct": _indices_series(TAGS_SERIES),
+    "pet": _indices_series(TAGS_SERIES),
+    # Coleccion unida OCR x CT (mongo/vtl.py); campos tipados
+    "vtl": [
+        IndexModel([("clave", ASCENDING)], name="uniq_clave", unique=True),
+        IndexModel([("exam_no", ASCENDING)], name="exam_no"),
+        IndexModel(
+            [("protocol_norm", ASCENDING), ("patient_weight_kg", ASCENDING)],
+            name="protocol_weight",
+        ),
+        IndexModel([("study_ts", DESCENDING)], name="study_ts"),
+        _INDICE_INGESTA,
+    ],
+    # Bajas de documentos (mongo/versiones.py)
+    "bajas": [
+        IndexModel([("rol", ASCENDING), ("_ingest.seq", ASCENDING)], name="rol_seq"),
+        IndexModel([("_ingest.ts", ASCENDING)], name="ttl", expireAfterSeconds=BAJAS_TTL_DIAS * 86400),
+    ],
+    # Telemetria de corridas del pipeline (telemetria.py)
+    "runs": [
+        IndexModel([("inicio", DESCENDING)], name="inicio"),
+    ],
+    # Cola de estudios del modo worker (mongo/cola.py)
+    "cola": [
+        # reclamar: mas recientes primero, o su orden inverso para la cuota de backfill
+        IndexModel([("estado", ASCENDING), ("fecha_estudio", DESCENDING), ("encolado", ASCENDING)],
+                   name="estado_fecha"),
+        IndexModel([("estado", ASCENDING), ("lease_hasta", ASCENDING)], name="estado_lease"),
+    ],
+}
+
+# Consultas representativas (filtro, orden) para revisar planes de ejecucion.
+# Los valores son ficticios: solo interesa la forma de la consulta.
+QUERIES: Dict[str, List[Dict[str, Any]]] = {
+    "ocr": [
+        {"nombre": "upsert_exam_no", "filtro": {"encabezado.Exam no": ""}},
+        {"nombre": "ultimos_estudios", "filtro": {}, "orden": [(_tag(TAGS_OCR, TAG_STUDY_DATE), DESCENDING)]},
+    ],
+    "ct": [
+        {"nombre": "upsert_series_uid", "filtro": {"series.series_instance_uid": ""}},
+        {"nombre": "upsert_study_uid", "filtro": {"study.study_instance_uid": ""}},
+        {"nombre": "ultimos_estudios", "filtro": {}, "orden": [(_tag(TAGS_SERIES, TAG_STUDY_DATE), DESCENDING)]},
+    ],
+    "pet": [
+        {"nombre": "upsert_series_uid", "filtro": {"series.series_instance_uid": ""}},
+        {"nombre": "upsert_study_uid", "filtro": {"study.study_instance_uid": ""}},
+        {"nombre": "ultimos_estudios", "filtro": {}, "orden": [(_tag(TAGS_SERIES, TAG_STUDY_DATE), DESCENDING)]},
+    ],
+    "vtl": [
+        {"nombre": "upsert_clave", "filtro": {"clave": ""}},
+        {"nombre": "protocolo_peso", "filtro": {"protocol_norm": "", "patient_weight_kg": {"$gte": 60, "$lte": 80}}},
+    ],
+    "cola": [
+        {"nombre": "reclamar_pendiente", "filtro": {"estado": "pendiente"},
+         "orden": [("fecha_estudio", DESCENDING), ("encolado", ASCENDING)]},
+        {"nombre": "reclamar_backfill", "filtro": {"estado": "pendiente"},
+         "orden": [("fecha_estudio", ASCENDING), ("encolado", DESCENDING)]},
+        {"nombre": "leases_vencidos", "filtro": {"estado": "en_proceso", "lease_hasta": {"$lt": 0}}},
+    ],
+}
+
+
+def _log_error_indice(nombre_col: str, modelo: IndexModel, exc: Exception) -> None:
+    logger.error(
+        "[INDEX] No se pudo crear '%s' en '%s': %s",
+        modelo.document.get("name"), nombre_col, exc,
+    )
+
+
+def ensure_indexes(db, collections: Dict[str, str]) -> Dict[str, List[str]]:
+    """Crea (idempotente) los indices declarados usando pymongo.
+
+    `collections` mapea rol logico -> nombre real de la coleccion.
+    Cada indice se crea por separado para que un conflicto (p. ej. duplicados
+    previos que impiden un indice unico) no impida crear los demas.
+    Devuelve los nombres de indices creados o ya existentes por coleccion.
+    """
+    creados: Dict[str, List[str]] = {}
+    for rol, nombre_col in collections.items():
+        col = db[nombre_col]
+        creados[nombre_col] = []
+        for modelo in INDEXES.get(rol, []):
+            try:
+                creados[nombre_col].extend(col.create_indexes([modelo]))
+            except OperationFailure as exc:
+                _log_error_indice(nombre_col, modelo, exc)
+    return creados
+
+
+async def ensure_indexes_async(db, collections: Dict[str, str]) -> Dict[str, List[str]]:
+    """Variante de `ensure_indexes` para una base de datos Motor."""
+    creados: Dict[str, List[str]] = {}
+    for rol, nombre_col in collections.items():
+        col = db[nombre_col]
+        creados[nombre_col] = []
+        for modelo in INDEXES.get(rol, []):
+            try:
+                creados[nombre_col].extend(await col.create_indexes([modelo]))
+            except OperationFailure as exc:
+                _log_error_indice(nombre_col, modelo, exc)
+    return creados
+
+
+def _plan_stages(plan: Optional[Dict[str, Any]]) -> List[str]:
+    """Lista las etapas de un plan de ejecucion (recorre inputStage/inputStages)."""
+    if not plan:
+        return []
+    etapas = [plan.get("stage", "?")]
+    hijos = list(plan.get("inputStages") or [])
+    if plan.get("inputStage"):
+        hijos.append(plan["inputStage"])
+    for hijo in hijos:
+        etapas.extend(_plan_stages(hijo))
+    return etapas
+
+
+def check_indexes(db, collections: Dict[str, str], slow_ms: int = 100) -> Dict[str, Dict[str, Any]]:
+    """Revisa indices faltantes y planes de las consultas representativas.
+
+    Por coleccion devuelve:
+        faltantes: indices declarados que no existen (por clave)
+        planes: etapas del plan ganador, docs examinados y si la consulta es
+                un COLLSCAN o supera `slow_ms` milisegundos.
+    """
+    reporte: Dict[str, Dict[str, Any]] = {}
+    for rol, nombre_col in collections.items():
+        col = db[nombre_col]
+        existentes = {tuple(info["key"]) for info in col.index_information().values()}
+        faltantes = [
+            modelo.document["name"]
+            for modelo in INDEXES.get(rol, [])
+            if tuple(modelo.document["key"].items()) not in existentes
+        ]
+
+        planes = []
+        for consulta in QUERIES.get(rol, []):
+            cursor = col.find(consulta["filtro"]).limit(1)
+            if consulta.get("orden"):
+                cursor = cursor.sort(consulta["orden"])
+            explain = cursor.explain()
+            etapas = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan"))
+            stats = explain.get("executionStats", {})
+            ms = stats.get("executionTimeMillis", 0)
+            planes.append({
+                "consulta": consulta["nombre"],
+                "etapas": etapas,
+                "docs_examinados": stats.get("totalDocsExamined"),
+                "ms": ms,
+                "collscan": "COLLSCAN" in etapas,
+                "lenta": ms >= slow_ms,
+            })
+
+        reporte[nombre_col] = {"faltantes": faltantes, "planes": planes}
+    return reporte
@@ -4,100 +4,223 @@ en MongoDB usando upsert para evitar duplicados.
 
 OCR se deduplica por encabezado.Exam no.
 CT headers se deduplican por series.orthanc_series_id 
+
+Cada documento guarda en `_ingest` el hash de su contenido, la secuencia
+y la fecha de ingesta: un JSON identico al ya cargado no se vuelve a
+escribir, y los nuevos o modificados reciben una secuencia nueva (la API
+la usa para ?since=). Los JSON se cargan por tandas (ver guardar_lote).
+Cada funcion devuelve las claves de los documentos nuevos o modificados,
+para que los pasos posteriores (p. ej. la coleccion VTL) procesen solo lo
+que cambio. Si hubo cambios se incrementa la version del rol para
+invalidar el cache de la API (mongo/versiones.py).
+
+Con `archivos` se cargan solo esos JSON (ingesta por evento, ver
+disparador.py); sin el, todo el directorio.
 """
 
 import json
 import logging
+from collections import defaultdict
 from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
 
 import pymongo
+from pymongo import ReplaceOne
 
-from config import MONGO_URI, DB_NAME, COL_OCR, COL_CT, COL_PET
+from config import MONGO_URI, DB_NAME, COL_OCR, COL_CT, COL_PET, COL_VTL, COL_VERSIONS, COL_TOMBSTONES, COL_RUNS, COL_QUEUE
+from mongo.indexes import ensure_indexes, check_indexes
+from mongo.versiones import huella, incrementar_version, marca_ingesta, secuencias
+from telemetria import contar
 
 
 # Logger y cliente reutilizable
 logger = logging.getLogger(__name__)
 
-# Reusable client/DB
-client = pymongo.MongoClient(MONGO_URI)
+# Reusable client/DB (connect=False: conecta en la primera operacion, no al importar)
+client = pymongo.MongoClient(MONGO_URI, connect=False)
 db = client[DB_NAME]
 
-
-def cargar_jsons_ocr(directorio: str):
-    """Insertar/actualizar documentos OCR en COL_OCR, garantizando unicidad por encabezado.Exam no."""
-    col = db[COL_OCR]  # Colección de OCR
-    archivos = list(Path(directorio).glob("*.json"))
+# Rol logico -> coleccion real (ver mongo/indexes.py)
+COLECCIONES = {
+    "ocr": COL_OCR, "ct": COL_CT, "pet": COL_PET, "vtl": COL_VTL, "bajas": COL_TOMBSTONES, "runs": COL_RUNS,
+    "cola": COL_QUEUE,
+}
+_indices_asegurados = False
+
+# JSON por tanda de carga: un find de hashes, una reserva de secuencias y un bulk_write
+TAMANO_LOTE = 500
+
+
+def asegurar_indices(forzar: bool = False):
+    """Crea los indices declarados una vez por proceso (idempotente en Mongo)."""
+    global _indices_asegurados
+    if _indices_asegurados and not forzar:
+        return
+    creados = ensure_indexes(db, COLECCIONES)
+    for nombre_col, indices in creados.items():
+        logger.info("[INDEX] '%s': %s", nombre_col, ", ".join(indices) or "-")
+    _indices_asegurados = True
+
+
+def verificar_indices(slow_ms: int = 100) -> bool:
+    """Registra indices faltantes y consultas con COLLSCAN o lentas. Devuelve True si todo esta bien."""
+    reporte = check_indexes(db, COLECCIONES, slow_ms=slow_ms)
+    ok = True
+    for nombre_col, info in reporte.items():
+        if info["faltantes"]:
+            ok = False
+            logger.warning("[INDEX] '%s' sin indices: %s", nombre_col, ", ".join(info["faltantes"]))
+        for plan in info["planes"]:
+            if plan["collscan"] or plan["lenta"]:
+                ok = False
+                logger.warning(
+                    "[INDEX] '%s' consulta %s: etapas=%s docs_examinados=%s ms=%s",
+                    nombre_col, plan["consulta"], "/".join(plan["etapas"]),
+                    plan["docs_examinados"], plan["ms"],
+                )
+    if ok:
+        logger.info("[INDEX] Indices y planes de consulta OK")
+    return ok
+
+
+def _valor(doc: dict, ruta: str):
+    """Valor de un campo con notacion de puntos ("series.series_instance_uid")."""
+    for parte in ruta.split("."):
+        doc = doc.get(parte) if isinstance(doc, dict) else None
+    return doc
+
+
+def guardar_lote(col, rol: str, items: List[Tuple[dict, dict]]) -> List[int]:
+    """Reemplaza (upsert) los documentos de `items` (pares filtro, data) cuyo contenido cambio.
+
+    Los filtros son de un solo campo. Toda la tanda cuesta un find de los hashes
+    previos, una reserva de secuencias y un bulk_write. Si dos items comparten
+    clave gana el ultimo (como al escribirlos en orden). Devuelve los indices
+    de los items escritos.
+    """
+    ultimo = {}
+    for i, (filtro, _) in enumerate(items):
+        (campo, valor), = filtro.items()
+        ultimo[(campo, valor)] = i
+    if not ultimo:
+        return []
+
+    valores_por_campo = defaultdict(list)
+    for campo, valor in ultimo:
+        valores_por_campo[campo].append(valor)
+    previos = {}
+    proyeccion = {"_ingest.hash": 1, **{campo: 1 for campo in valores_por_campo}}
+    condiciones = [{campo: {"$in": valores}} for campo, valores in valores_por_campo.items()]
+    for doc in col.find({"$or": condiciones}, proyeccion):
+        for campo in valores_por_campo:
+            clave = (campo, _valor(doc, campo))
+            if clave in ultimo:
+                previos[clave] = (doc.get("_ingest") or {}).get("hash")
+
+    cambiados = []
+    for clave, i in ultimo.items():
+        hash_ = huella(items[i][1])
+        if previos.get(clave) != hash_:
+            cambiados.append((i, hash_))
+    contar("docs_sin_cambios", len(ultimo) - len(cambiados))
+    if not cambiados:
+        return []
+
+    with secuencias(db, COL_VERSIONS, rol, len(cambiados)) as inicio:
+        col.bulk_write([
+            ReplaceOne(items[i][0], {**items[i][1], "_ingest": marca_ingesta(inicio + k, hash_)}, upsert=True)
+            for k, (i, hash_) in enumerate(cambiados)
+        ], ordered=False)
+    contar("docs_escritos", len(cambiados))
+    return sorted(i for i, _ in cambiados)
+
+
+def marcar_cambios(rol: str, cambiados) -> None:
+    """Incrementa la version del rol si la carga modifico documentos."""
+    if cambiados:
+        incrementar_version(db, COL_VERSIONS, rol)
+
+
+def _archivos_json(directorio: str, archivos: Optional[Iterable] = None) -> List[Path]:
+    """Los JSON indicados (p. ej. los recien exportados) o, si no se indican, todos los del directorio."""
+    if archivos is None:
+        return list(Path(directorio).glob("*.json"))
+    return [Path(a) for a in archivos]
+
+
+def _clave_ocr(data: dict, archivo: Path):
+    """(filtro, valor devuelto) de un JSON de OCR: por encabezado.Exam no."""
+    exam_no = data.get("encabezado", {}).get("Exam no")
+    if not exam_no:
+        logger.warning("[SKIP] Sin Exam no en %s", archivo.name)
+        return None
+    return {"encabezado.Exam no": exam_no}, exam_no
+
+
+def _clave_header(data: dict, archivo: Path):
+    """(filtro, valor devuelto) de un JSON de headers: por serie o, si falta, por estudio."""
+    series_id = data.get("series", {}).get("series_instance_uid")
+    study_id = data.get("study", {}).get("study_instance_uid")
+    if series_id:
+        return {"series.series_instance_uid": series_id}, study_id
+    if study_id:
+        return {"study.study_instance_uid": study_id}, study_id
+    logger.warning("[SKIP] Sin series_id/study_id en %s", archivo.name)
+    return None
+
+
+def _cargar_jsons(rol: str, nombre_col: str, clave, directorio: str, archivos: Optional[Iterable] = None):
+    """Carga los JSON por tandas de TAMANO_LOTE (ver guardar_lote). Devuelve los valores de `clave` de los cambiados."""
+    col = db[nombre_col]
+    archivos = _archivos_json(directorio, archivos)
     total_insertados = 0
+    cambiados = []
+
+    for desde in range(0, len(archivos), TAMANO_LOTE):
+        items, valores = [], []
+        for archivo in archivos[desde:desde + TAMANO_LOTE]:
+            with open(archivo, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            par = clave(data, archivo)
+            if par is None:
+                continue
+            items.append((par[0], data))
+            valores.append(par[1])
+        total_insertados += len(items)
+        cambiados.extend(valores[i] for i in guardar_lote(col, rol, items))
 
-    for archivo in archivos:
-        with open(archivo, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        exam_no = data.get("encabezado", {}).get("Exam no")
-        if not exam_no:
-            logger.warning("[SKIP] Sin Exam no en %s", archivo.name)
-            continue
+    logger.info("[OK] Insertados/actualizados %d documentos en '%s' (%d con cambios)", total_insertados, nombre_col, len(cambiados))
+    marcar_cambios(rol, cambiados)
+    return cambiados
 
-        # Upsert by exam number
-        col.replace_one({"encabezado.Exam no": exam_no}, data, upsert=True)
-        total_insertados += 1
 
-    logger.info("[OK] Insertados/actualizados %d documentos en '%s'", total_insertados, COL_OCR)
+def cargar_jsons_ocr(directorio: str, archivos: Optional[Iterable] = None):
+    """Insertar/actualizar documentos OCR en COL_OCR, garantizando unicidad por encabezado.Exam no.
+    Devuelve los Exam no nuevos o modificados.
+    """
+    return _cargar_jsons("ocr", COL_OCR, _clave_ocr, directorio, archivos)
 
 
-def cargar_jsons_ct_headers(directorio: str):
+def cargar_jsons_ct_headers(directorio: str, archivos: Optional[Iterable] = None):
     """Insertar/actualizar documentos CT headers en COL_CT, 
     garantizando unicidad por series.orthanc_series_id 
     (si falta, por study.orthanc_study_id).
+    Devuelve los StudyInstanceUID de las series nuevas o modificadas.
     """
-    col = db[COL_CT]
-    archivos = list(Path(directorio).glob("*.json"))
-    total_insertados = 0
-
-    for archivo in archivos:
-        with open(archivo, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        series_id = data.get("series", {}).get("series_instance_uid")
-        if not series_id:
-            study_id = data.get("study", {}).get("study_instance_uid")
-            if not study_id:
-                logger.warning("[SKIP] Sin series_id/study_id en %s", archivo.name)
-                continue
-            filtro = {"study.study_instance_uid": study_id}
-        else:
-            filtro = {"series.series_instance_uid": series_id}
-
-        col.replace_one(filtro, data, upsert=True)
-        total_insertados += 1
-
-    logger.info("[OK] Insertados/actualizados %d documentos en '%s'", total_insertados, COL_CT)
+    return _cargar_jsons("ct", COL_CT, _clave_header, directorio, archivos)
 
 
-def cargar_jsons_pet_headers(directorio: str):
+def cargar_jsons_pet_headers(directorio: str, archivos: Optional[Iterable] = None):
     """Insertar/actualizar documentos PET headers en COL_PET, 
     garantizando unicidad por series.orthanc_series_id 
     (si falta, por study.orthanc_study_id).
+    Devuelve los StudyInstanceUID de las series nuevas o modificadas.
     """
-    col = db[COL_PET]
-    archivos = list(Path(directorio).glob("*.json"))
-    total_insertados = 0
-
-    for archivo in archivos:
-        with open(archivo, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        series_id = data.get("series", {}).get("series_instance_uid")
-        if not series_id:
-            study_id = data.get("study", {}).get("study_instance_uid")
-            if not study_id:
-                logger.warning("[SKIP] Sin series_id/study_id en %s", archivo.name)
-                continue
-            filtro = {"study.study_instance_uid": study_id}
-        else:
-            filtro = {"series.series_instance_uid": series_id}
+    return _cargar_jsons("pet", COL_PET, _clave_header, directorio, archivos)
 
-        col.replace_one(filtro, data, upsert=True)
-        total_insertados += 1
 
-    logger.info("[OK] Insertados/actualizados %d documentos en '%s'", total_insertados, COL_PET)
+if __name__ == "__main__":
+    # python -m mongo.mongo_uploader  -> crea indices y revisa planes
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    asegurar_indices()
+    raise SystemExit(0 if verificar_indices() else 1)
@@ -0,0 +1,127 @@
+"""
+Tokens de version, secuencias de ingesta y bajas por coleccion.
+
+El pipeline incrementa la version de un rol ("ocr", "ct", "pet", "vtl")
+cada vez que una carga modifica documentos; la API lee estas versiones y
+las usa como parte de la clave de cache y del ETag de cada respuesta.
+
+Para la sincronizacion incremental (?since= en la API) cada documento
+nuevo o modificado lleva `_ingest: {seq, ts, hash}`, con `seq` tomado de
+un contador por rol, y cada documento eliminado deja una baja en la
+coleccion de bajas con una `seq` del mismo contador.
+
+Varios escritores del mismo rol (workers, procesos de backfill) reservan y
+escriben en paralelo, asi que la seq N+1 puede quedar escrita antes que la
+N. Por eso las secuencias se toman con `secuencias(...)`: mientras el
+escritor escribe, el documento del rol guarda una marca en `en_curso` con
+una cota inferior de lo reservado, y `leer_confirmada_async` devuelve la
+marca de agua: la seq mas alta tal que todas las anteriores ya estan
+escritas (o no se usaran). La API nunca adelanta el cursor de ?since= mas
+alla de ella. Una marca de mas de RESERVA_MAX_S segundos es de un escritor
+que murio y se ignora.
+
+Como indexes.py, solo depende de pymongo para usarse desde el pipeline y
+desde la API. Un documento por rol:
+    {"_id": "ct", "version": 12, "seq": 5310, "actualizado": ISODate(...),
+     "en_curso": [{"id": "9f0c...", "minimo": 5309, "ts": ISODate(...)}]}
+"""
+
+import hashlib
+import json
+import logging
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List
+
+from pymongo import ReturnDocument
+
+
+logger = logging.getLogger(__name__)
+
+RESERVA_MAX_S = 600  # una escritura en curso mas vieja que esto es de un escritor que murio
+
+
+def incrementar_version(db, col_versiones: str, rol: str) -> int:
+    """Marca que los datos del rol cambiaron. Devuelve la nueva version."""
+    doc = db[col_versiones].find_one_and_update(
+        {"_id": rol},
+        {"$inc": {"version": 1}, "$currentDate": {"actualizado": True}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    logger.info("[VERSION] '%s' -> %s", rol, doc["version"])
+    return doc["version"]
+
+
+def _vencimiento() -> datetime:
+    return datetime.utcnow() - timedelta(seconds=RESERVA_MAX_S)
+
+
+@contextmanager
+def secuencias(db, col_versiones: str, rol: str, cantidad: int = 1) -> Iterator[int]:
+    """Reserva `cantidad` secuencias consecutivas del rol y entrega la primera.
+
+    Los documentos con esas secuencias se escriben dentro del bloque: hasta
+    que termina, la marca en `en_curso` retiene la marca de agua del rol.
+    """
+    col = db[col_versiones]
+    previo = col.find_one({"_id": rol}, {"seq": 1, "en_curso.ts": 1}) or {}
+    vence = _vencimiento()
+    if any(m["ts"] < vence for m in previo.get("en_curso", ())):
+        col.update_one({"_id": rol}, {"$pull": {"en_curso": {"ts": {"$lt": vence}}}})
+    # La seq solo crece: lo que se reserve despues de leerla es > previo["seq"]
+    marca = {"id": uuid.uuid4().hex, "minimo": previo.get("seq", 0) + 1, "ts": datetime.utcnow()}
+    doc = col.find_one_and_update(
+        {"_id": rol},
+        {"$inc": {"seq": cantidad}, "$push": {"en_curso": marca}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    try:
+        yield doc["seq"] - cantidad + 1
+    finally:
+        col.update_one({"_id": rol}, {"$pull": {"en_curso": {"id": marca["id"]}}})
+
+
+def huella(data: Dict[str, Any]) -> str:
+    """Hash estable del contenido de un documento (sin _id ni _ingest)."""
+    contenido = {k: v for k, v in data.items() if k not in ("_id", "_ingest")}
+    texto = json.dumps(contenido, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+
+def marca_ingesta(seq: int, hash_: str) -> Dict[str, Any]:
+    return {"seq": seq, "ts": datetime.utcnow(), "hash": hash_}
+
+
+def registrar_bajas(db, col_versiones: str, col_bajas: str, rol: str, docs: Iterable[Dict[str, Any]]) -> int:
+    """Guarda una baja por cada documento eliminado (`_id` y, si existe, `clave`)."""
+    docs = list(docs)
+    if not docs:
+        return 0
+    with secuencias(db, col_versiones, rol, len(docs)) as inicio:
+        bajas: List[Dict[str, Any]] = []
+        for i, doc in enumerate(docs):
+            baja = {"rol": rol, "doc_id": doc["_id"], "_ingest": marca_ingesta(inicio + i, "")}
+            if doc.get("clave") is not None:
+                baja["clave"] = doc["clave"]
+            bajas.append(baja)
+        db[col_bajas].insert_many(bajas)
+    return len(bajas)
+
+
+async def leer_versiones_async(db, col_versiones: str) -> Dict[str, int]:
+    """Version actual de cada rol (Motor). Los roles nunca marcados no aparecen."""
+    versiones: Dict[str, int] = {}
+    async for doc in db[col_versiones].find({}, {"version": 1}):
+        versiones[doc["_id"]] = doc.get("version", 0)
+    return versiones
+
+
+async def leer_confirmada_async(db, col_versiones: str, rol: str) -> int:
+    """Marca de agua del rol (Motor): toda seq <= esta ya esta escrita o no se usara."""
+    doc = await db[col_versiones].find_one({"_id": rol}, {"seq": 1, "en_curso": 1}) or {}
+    vence = _vencimiento()
+    en_curso = [m["minimo"] - 1 for m in doc.get("en_curso", ()) if m["ts"] >= vence]
+    return min([doc.get("seq", 0), *en_curso])
@@ -0,0 +1,313 @@
+"""
+Coleccion de dosis por serie (VTL) que une el reporte OCR con los headers CT.
+
+Replica en la ingesta el cruce que antes hacian los dashboards vtl_*.html:
+cada fila de la tabla dosimetrica OCR (sin scouts) se une con la serie CT
+del mismo estudio y numero de serie; si el OCR no trae StudyInstanceUID se
+usa el nombre de paciente normalizado + numero de serie. Los documentos
+resultantes tienen campos tipados (peso, CTDIvol, DLP, rango, fecha) para
+que la API filtre directamente con indices.
+
+Se recalcula solo lo afectado por cada carga:
+- reportes OCR nuevos o modificados (por Exam no)
+- estudios con series CT nuevas o modificadas (por StudyInstanceUID)
+
+Como en mongo_uploader, solo se escriben las filas cuyo contenido cambio
+(`_ingest.hash`) y las filas que desaparecen de un reporte dejan una baja.
+"""
+
+import logging
+import re
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+
+from config import COL_OCR, COL_CT, COL_VTL, COL_VERSIONS, COL_TOMBSTONES
+from mongo.indexes import TAGS_OCR, TAGS_SERIES, TAG_STUDY_UID, normalizar_texto
+from mongo.mongo_uploader import db, marcar_cambios
+from mongo.versiones import huella, marca_ingesta, registrar_bajas, secuencias
+from telemetria import contar
+
+
+logger = logging.getLogger(__name__)
+
+_SCOUT_RE = re.compile(r"scout|localizer|topogram|survey", re.IGNORECASE)
+
+# Campos de CT necesarios para el cruce (evita traer todos los tags)
+_PROYECCION_CT = {
+    "patient.patient_name": 1,
+    "study.study_instance_uid": 1,
+    "series.series_instance_uid": 1,
+    "series.series_number": 1,
+    **{
+        f"{TAGS_SERIES}.{tag}": 1
+        for tag in (
+            "0008,0018", "0008,0020", "0008,0021", "0008,0023", "0008,0030",
+            "0008,0031", "0008,0033", "0008,103e", "0010,0010", "0010,1030",
+            "0018,1030", "0020,0011",
+        )
+    },
+}
+
+
+def normalizar_nombre(nombre: Optional[str]) -> str:
+    """Igual que normalizeName() de los dashboards: '^' y espacios -> un espacio, mayusculas."""
+    return re.sub(r"[\s^]+", " ", nombre or "").strip().upper()
+
+
+def a_numero(valor: Any) -> Optional[float]:
+    """Convierte textos OCR ('12,5', '1.234,5', '-') a float, como toNumber() del front."""
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return float(valor)
+    if valor is None:
+        return None
+    texto = str(valor).strip()
+    if texto in ("", "-"):
+        return None
+    limpio = re.sub(r"[^\d,.\-]", "", texto)
+    if "," in limpio and "." not in limpio:
+        limpio = limpio.replace(",", ".", 1)
+    elif "," in limpio and "." in limpio:
+        limpio = limpio.replace(",", "")
+    try:
+        return float(limpio)
+    except ValueError:
+        return None
+
+
+def _valor_tag(tags: Optional[Dict[str, Any]], tag: str) -> Any:
+    """Valor de un tag en formato Orthanc ({'Value': ...}), tolerando mayusculas."""
+    if not tags:
+        return None
+    for clave in (tag, tag.lower(), tag.upper()):
+        if clave in tags:
+            valor = tags[clave]
+            if isinstance(valor, dict):
+                valor = valor.get("Value")
+            if isinstance(valor, list):
+                valor = next((v for v in valor if v not in (None, "")), None)
+            if valor not in (None, ""):
+                return valor
+    return None
+
+
+def _fecha_hora(fecha: Any, hora: Any) -> Optional[datetime]:
+    if not isinstance(fecha, str) or len(fecha) < 8:
+        return None
+    hora = hora if isinstance(hora, str) else ""
+    try:
+        return datetime(
+            int(fecha[0:4]), int(fecha[4:6]), int(fecha[6:8]),
+            int(hora[0:2] or 0), int(hora[2:4] or 0), int(hora[4:6] or 0),
+        )
+    except ValueError:
+        return None
+
+
+def _longitud_rango(scan_range: Optional[str]) -> Optional[float]:
+    """'120-520' -> 400.0 (mm)."""
+    if not scan_range or "-" not in scan_range:
+        return None
+    partes = scan_range.split("-")
+    if len(partes) != 2:
+        return None
+    ini, fin = a_numero(partes[0]), a_numero(partes[1])
+    if ini is None or fin is None:
+        return None
+    return abs(fin - ini)
+
+
+def filas_ocr(doc: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Filas de la tabla dosimetrica de un reporte OCR, sin scouts."""
+    encabezado = doc.get("encabezado") or {}
+    nombre = str(encabezado.get("Patient Name") or "").strip()
+    study_uid = _valor_tag(doc.get(TAGS_OCR), TAG_STUDY_UID)
+    filas = []
+    for serie in doc.get("series") or []:
+        if _SCOUT_RE.search(str(serie.get("Type") or "")):
+            continue
+        numero = a_numero(serie.get("Serie"))
+        scan_range = serie.get("ScanRange")
+        scan_range = scan_range if scan_range and scan_range != "-" else ""
+        filas.append({
+            "exam_no": encabezado.get("Exam no"),
+            "patient_name": nombre,
+            "study_instance_uid": study_uid,
+            "series_number": int(numero) if numero is not None else None,
+            "ctdivol": a_numero(serie.get("CTDIvol")),
+            "dlp": a_numero(serie.get("DLP")),
+            "scan_range_mm": scan_range,
+            "scan_length_mm": _longitud_rango(scan_range),
+        })
+    return filas
+
+
+def info_ct(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Campos tipados de una serie CT (fecha preferida: serie -> estudio -> contenido)."""
+    tags = (doc.get("first_instance") or {}).get("dicom_tags") or {}
+    numero = a_numero(_valor_tag(tags, "0020,0011"))
+    if numero is None:
+        numero = a_numero((doc.get("series") or {}).get("series_number"))
+    nombre = _valor_tag(tags, "0010,0010") or (doc.get("patient") or {}).get("patient_name") or ""
+    fecha = (
+        _fecha_hora(_valor_tag(tags, "0008,0021"), _valor_tag(tags, "0008,0031"))
+        or _fecha_hora(_valor_tag(tags, "0008,0020"), _valor_tag(tags, "0008,0030"))
+        or _fecha_hora(_valor_tag(tags, "0008,0023"), _valor_tag(tags, "0008,0033"))
+    )
+    descripcion = str(_valor_tag(tags, "0008,103e") or "")
+    protocolo = str(_valor_tag(tags, "0018,1030") or "")
+    return {
+        "patient_name": str(nombre),
+        "study_instance_uid": (doc.get("study") or {}).get("study_instance_uid"),
+        "series_instance_uid": (doc.get("series") or {}).get("series_instance_uid"),
+        "sop_instance_uid": _valor_tag(tags, "0008,0018"),
+        "series_number": int(numero) if numero is not None else None,
+        "patient_weight_kg": a_numero(_valor_tag(tags, "0010,1030")),
+        "series_description": descripcion,
+        "protocol_name": protocolo,
+        "study_ts": fecha,
+    }
+
+
+def construir_filas_vtl(doc_ocr: Dict[str, Any], cts: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Une las filas OCR de un reporte con las series CT candidatas."""
+    por_estudio: Dict[Any, Dict[str, Any]] = {}
+    por_nombre: Dict[Any, Dict[str, Any]] = {}
+    for ct in map(info_ct, cts):
+        if ct["series_number"] is None:
+            continue
+        por_estudio.setdefault((ct["study_instance_uid"], ct["series_number"]), ct)
+        por_nombre.setdefault((normalizar_nombre(ct["patient_name"]), ct["series_number"]), ct)
+
+    salida: Dict[str, Dict[str, Any]] = {}
+    for fila in filas_ocr(doc_ocr):
+        clave = f"{fila['exam_no']}|{fila['series_number']}|{fila['scan_range_mm']}"
+        if clave in salida:
+            continue
+        nombre_norm = normalizar_nombre(fila["patient_name"])
+        ct = None
+        if fila["study_instance_uid"]:
+            ct = por_estudio.get((fila["study_instance_uid"], fila["series_number"]))
+        if ct is None:
+            ct = por_nombre.get((nombre_norm, fila["series_number"]))
+        ct = ct or {}
+
+        fecha = ct.get("study_ts")
+        salida[clave] = {
+            "clave": clave,
+            "exam_no": fila["exam_no"],
+            "patient_name": ct.get("patient_name") or fila["patient_name"],
+            "patient_norm": normalizar_nombre(ct.get("patient_name") or fila["patient_name"]),
+            "study_instance_uid": ct.get("study_instance_uid") or fila["study_instance_uid"],
+            "series_instance_uid": ct.get("series_instance_uid"),
+            "sop_instance_uid": ct.get("sop_instance_uid"),
+            "series_number": fila["series_number"],
+            "series_description": ct.get("series_description", ""),
+            "series_description_norm": normalizar_texto(ct.get("series_description")),
+            "protocol_name": ct.get("protocol_name", ""),
+            "protocol_norm": normalizar_texto(ct.get("protocol_name")),
+            "patient_weight_kg": ct.get("patient_weight_kg"),
+            "ctdivol": fila["ctdivol"],
+            "dlp": fila["dlp"],
+            "scan_range_mm": fila["scan_range_mm"],
+            "scan_length_mm": fila["scan_length_mm"],
+            "study_ts": fecha,
+            "study_date": fecha.strftime("%Y-%m-%d") if fecha else "",
+            "joined": bool(ct),
+        }
+    return list(salida.values())
+
+
+def _regex_nombre(nombre_norm: str) -> Dict[str, Any]:
+    """Regex anclada que tolera '^' o espacios entre las partes del nombre."""
+    partes = [re.escape(p) for p in nombre_norm.split(" ") if p]
+    return {"$regex": "^\\s*" + "[\\s^]+".join(partes) + "\\s*$", "$options": "i"}
+
+
+def _cts_candidatos(doc_ocr: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Series CT del mismo estudio o, si no hay UID, del mismo paciente."""
+    col_ct = db[COL_CT]
+    study_uid = _valor_tag(doc_ocr.get(TAGS_OCR), TAG_STUDY_UID)
+    if study_uid:
+        cts = list(col_ct.find({"study.study_instance_uid": study_uid}, _PROYECCION_CT))
+        if cts:
+            return cts
+    nombre_norm = normalizar_nombre((doc_ocr.get("encabezado") or {}).get("Patient Name"))
+    if not nombre_norm:
+        return []
+    return list(col_ct.find({"patient.patient_name": _regex_nombre(nombre_norm)}, _PROYECCION_CT))
+
+
+def actualizar_vtl(exam_nos: Optional[Iterable[str]] = None, study_uids: Optional[Iterable[str]] = None) -> int:
+    """Recalcula las filas VTL de los reportes afectados.
+
+    exam_nos: reportes OCR cargados/modificados.
+    study_uids: estudios con series CT cargadas/modificadas.
+    Si ambos son None se recalcula toda la coleccion.
+    Devuelve la cantidad de filas escritas.
+    """
+    col_ocr = db[COL_OCR]
+    col_vtl = db[COL_VTL]
+
+    if exam_nos is None and study_uids is None:
+        filtro: Dict[str, Any] = {"encabezado.Exam no": {"$type": "string"}}
+    else:
+        condiciones: List[Dict[str, Any]] = []
+        exam_nos = sorted(set(exam_nos or []))
+        study_uids = sorted(set(study_uids or []))
+        if exam_nos:
+            condiciones.append({"encabezado.Exam no": {"$in": exam_nos}})
+        if study_uids:
+            condiciones.append({f"{TAGS_OCR}.{TAG_STUDY_UID}.Value": {"$in": study_uids}})
+        if not condiciones:
+            return 0
+        filtro = {"$or": condiciones}
+
+    proyeccion = {"encabezado": 1, "series": 1, f"{TAGS_OCR}.{TAG_STUDY_UID}": 1}
+    escritas = 0
+    hubo_cambios = False
+    for doc_ocr in col_ocr.find(filtro, proyeccion):
+        exam_no = (doc_ocr.get("encabezado") or {}).get("Exam no")
+        if not exam_no:
+            continue
+        filas = construir_filas_vtl(doc_ocr, _cts_candidatos(doc_ocr))
+        previas = {
+            d["clave"]: d
+            for d in col_vtl.find({"exam_no": exam_no}, {"clave": 1, "_ingest.hash": 1})
+        }
+        cambiadas = []
+        for fila in filas:
+            hash_ = huella(fila)
+            if (previas.get(fila["clave"], {}).get("_ingest") or {}).get("hash") != hash_:
+                cambiadas.append((fila, hash_))
+        if cambiadas:
+            with secuencias(db, COL_VERSIONS, "vtl", len(cambiadas)) as inicio:
+                col_vtl.bulk_write([
+                    UpdateOne(
+                        {"clave": fila["clave"]},
+                        {"$set": {**fila, "_ingest": marca_ingesta(inicio + i, hash_)}},
+                        upsert=True,
+                    )
+                    for i, (fila, hash_) in enumerate(cambiadas)
+                ], ordered=False)
+        # Filas del reporte que ya no existen (p. ej. OCR corregido)
+        claves = {f["clave"] for f in filas}
+        bajas = [d for clave, d in previas.items() if clave not in claves]
+        if bajas:
+            registrar_bajas(db, COL_VERSIONS, COL_TOMBSTONES, "vtl", bajas)
+            col_vtl.delete_many({"_id": {"$in": [d["_id"] for d in bajas]}})
+        hubo_cambios = hubo_cambios or bool(cambiadas or bajas)
+        escritas += len(cambiadas)
+        contar("docs_escritos", len(cambiadas))
+        contar("docs_sin_cambios", len(filas) - len(cambiadas))
+
+    logger.info("[OK] Filas VTL actualizadas: %d en '%s'", escritas, COL_VTL)
+    marcar_cambios("vtl", hubo_cambios)
+    return escritas
+
+
+if __name__ == "__main__":
+    # python -m mongo.vtl  -> reconstruye toda la coleccion (p. ej. tras cargar historicos)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    actualizar_vtl()
@@ -1,7 +1,6 @@
 import re
 import json
 import logging
-import pandas as pd
 
 logger = logging.getLogger(__name__)
 
@@ -81,6 +80,8 @@ def extraer_tabla_dosimetrica(lines, paciente=None):
                     "DLP": dlp,
                     "Phantom": phantom
                 })
+    import pandas as pd  # diferido: ~0.6 s de import que solo necesita el OCR
+
     return pd.DataFrame(series_rows)
 
 
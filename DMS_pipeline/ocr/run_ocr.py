@@ -1,7 +1,5 @@
-import pyorthanc
+import threading
 import numpy as np
-import easyocr
-import cv2
 from pathlib import Path
 from PIL import Image, ImageOps
 import logging
@@ -13,140 +11,194 @@ from ocr.ocr_utils import (
 )
 from config import (
     ORTHANC_URL,
-    ORTHANC_USER,
-    ORTHANC_PASS,
     STUDY_DESCRIPTION,
     DOSE_SERIES_NUMBER,
 )
+from fuentes import fuente_orthanc
+from orthanc.cache import leer_dataset
+from telemetria import contar, cronometrar, fallo_estudio
 OUTPUT_DIR = Path("ocr_output")
 OUTPUT_DIR.mkdir(exist_ok=True)
 
-# Inicializar cliente y OCR
-client = pyorthanc.Orthanc(ORTHANC_URL, ORTHANC_USER, ORTHANC_PASS, timeout=60, trust_env=False)
-reader = easyocr.Reader(['en'], gpu=False)
+# Cliente de Orthanc y lector OCR se crean al primer uso: importar este modulo
+# (p. ej. desde el launcher para una corrida solo de headers) no carga torch
+FUENTE = fuente_orthanc()
 logger = logging.getLogger(__name__)
+_reader = None
+_reader_lock = threading.Lock()
 
-def main():
+
+def _lector():
+    """easyocr.Reader compartido (cargar el modelo tarda segundos)."""
+    global _reader
+    with _reader_lock:
+        if _reader is None:
+            import easyocr
+
+            _reader = easyocr.Reader(['en'], gpu=False)
+        return _reader
+
+
+def procesar_estudio(patient, study):
+    """OCR del reporte de dosis de un estudio.
+
+    Devuelve (coincide, ruta): `coincide` indica si el estudio pasa el filtro
+    de StudyDescription y `ruta` es el JSON exportado (None si ya existía o
+    el estudio no tiene la serie de dosis).
+    """
+    try:
+        desc = study.description or ""
+    except Exception:
+        desc = ""
+
+    if (STUDY_DESCRIPTION or "").lower() not in desc.lower():
+        return False, None
+    contar("estudios_revisados")
+
+    # Si el estudio ya fue procesado previamente, omitir para no repetir OCR
+    ruta_json = OUTPUT_DIR / f"{patient.name}_{study.id_}.json"
+    if ruta_json.exists():
+        logger.debug("[SKIP] OCR existente: %s", ruta_json.name)
+        contar("estudios_omitidos")
+        return True, None
+
+    available_series_numbers = []
+    for series in study.series:
+        serie_numero_str = series._get_main_dicom_tag_value("SeriesNumber")
+        if not (serie_numero_str and serie_numero_str.isdigit()):
+            continue
+
+        serie_num = int(serie_numero_str)
+        available_series_numbers.append(serie_num)
+        if int(serie_num) != int(DOSE_SERIES_NUMBER):
+            continue
+
+        if not series.instances:
+            logger.debug("[SKIP] Serie sin instancias en estudio %s", getattr(study, 'id_', 'unknown'))
+            continue
+
+        ins = series.instances[0]
+        try:
+            ds = leer_dataset(ins)
+        except Exception as exc:
+            logger.warning("[SKIP] No se pudo leer pydicom de la instancia %s: %s", getattr(ins, 'id_', 'unknown'), exc)
+            fallo_estudio(study.id_, exc)  # Orthanc caido o sin reintentos: el worker lo reintenta
+            continue
+        if 'PixelData' not in ds:
+            logger.debug("[SKIP] Instancia sin PixelData para %s", ruta_json.name)
+            continue
+
+        # Preprocesamiento de la imagen
+        imagen = ds.pixel_array
+        if imagen.dtype != np.uint8:
+            imagen = (255 * (imagen - np.min(imagen)) / np.ptp(imagen)).astype(np.uint8)
+        import cv2
+
+        imagen_grande = cv2.resize(imagen, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+
+        #Preprocesamiento de la imagen (tabla invertida)
+        imagen_header = imagen_grande
+        img_pil = Image.fromarray(imagen_grande).convert("L")
+        img_inv_pil = ImageOps.invert(img_pil)
+        imagen_tabla = np.array(img_inv_pil)
+
+        reader = _lector()
+        with cronometrar("ocr_inferencia_s"):
+            # OCR para encabezado
+            header_result = reader.readtext(
+                imagen_header,
+                width_ths=1.75,
+                ycenter_ths=0.7
+            )
+            # OCR para tabla dosimétrica
+            table_result = reader.readtext(
+                imagen_tabla,
+                width_ths=10,
+                ycenter_ths=0.8
+            )
+        header_lines = [d[1].strip() for d in header_result if d[1].strip()]
+        table_lines = [d[1].strip() for d in table_result if d[1].strip()]
+
+        # Procesamiento
+        encabezado = extraer_encabezado_desde_lineas(header_lines)
+        df_tabla = extraer_tabla_dosimetrica(table_lines)
+
+        dicom_header = ins.tags
+
+        # Guardar JSON en subcarpeta
+        guardar_json_completo(
+            encabezado,
+            df_tabla.to_dict(orient="records"),
+            ruta_json,
+            dicom_header=dicom_header,
+        )
+        logger.info("[OK] OCR guardado: %s", ruta_json.name)
+        contar("estudios_procesados")
+        return True, ruta_json  # Procesar solo la primera serie que coincide
+
+    logger.debug(
+        "[SKIP] Estudio %s del paciente %s no coincidió con DOSE_SERIES_NUMBER=%s. Disponibles: %s",
+        getattr(study, 'id_', 'unknown'), getattr(patient, 'name', ''), DOSE_SERIES_NUMBER, sorted(set(available_series_numbers))
+    )
+    return True, None
+
+
+def main_estudios(study_ids=None, fuente=None, entregar=None):
+    """OCR solo de los estudios indicados (IDs de Orthanc), o de todos los de
+    `fuente` (por defecto Orthanc; ver fuentes/) si `study_ids` es None.
+
+    Devuelve los JSON de esos estudios, recien exportados o ya existentes:
+    si una corrida previa exporto pero no llego a cargar, se vuelven a cargar
+    (la carga omite los documentos sin cambios). Con `entregar` tambien se le
+    pasan los JSON de cada estudio apenas termina (el launcher los sube
+    mientras sigue el OCR). Los estudios que fallan quedan en
+    estudios_fallidos de la etapa (ver telemetria.py).
+    """
+    rutas = []
+    for patient, study in (fuente or FUENTE).estudios(study_ids):
+        try:
+            procesar_estudio(patient, study)
+        except Exception as exc:
+            logger.exception("[OCR] No se pudo procesar el estudio %s", study.id_)
+            fallo_estudio(study.id_, exc)
+            continue
+        del_estudio = list(OUTPUT_DIR.glob(f"*_{study.id_}.json"))
+        if entregar and del_estudio:
+            entregar(del_estudio)
+        rutas += del_estudio
+    return rutas
+
+
+def main(entregar=None):
+    """OCR de todo Orthanc; con `entregar`, cada JSON nuevo se le pasa apenas se exporta."""
     logger.info("Iniciando OCR de reportes de dosis (Orthanc: %s)", ORTHANC_URL)
-    # Obtener lista de pacientes
+    # Estudios de Orthanc, del mas reciente al mas antiguo
     try:
-        patient_ids = client.get_patients()
+        estudios = FUENTE.por_fecha()
     except Exception as exc:
-        logger.exception("No se pudo obtener pacientes desde Orthanc: %s", exc)
+        logger.exception("No se pudo obtener estudios desde Orthanc: %s", exc)
         return
 
-    if not patient_ids:
-        logger.warning("Orthanc no devolvió pacientes. Verifique filtros, URL o credenciales.")
+    if not estudios:
+        logger.warning("Orthanc no devolvió estudios. Verifique filtros, URL o credenciales.")
         return
 
-    target_desc_lower = (STUDY_DESCRIPTION or "").lower()
     total_json = 0
     estudios_filtrados = 0
-    estudios_procesados = 0
-    logger.info("Pacientes a revisar: %d | Filtro StudyDescription: '%s'", len(patient_ids), STUDY_DESCRIPTION)
-
-    for pid in patient_ids:
-        patient = pyorthanc.Patient(id_=pid, client=client)
-
-        for study in patient.studies:
-            try:
-                desc = study.description or ""
-            except Exception:
-                desc = ""
-
-            if target_desc_lower not in desc.lower():
-                continue
-            estudios_filtrados += 1
-            procesado_estudio = False
-            
-            # Si el estudio ya fue procesado previamente, omitir para no repetir OCR
-            ruta_json = OUTPUT_DIR / f"{patient.name}_{study.id_}.json"
-            if ruta_json.exists():
-                logger.debug("[SKIP] OCR existente: %s", ruta_json.name)
-                continue  # Procesar solo la primera serie que coincide
-
-            available_series_numbers = []
-            for series in study.series:
-                serie_numero_str = series._get_main_dicom_tag_value("SeriesNumber")
-                if not (serie_numero_str and serie_numero_str.isdigit()):
-                    continue
-
-                serie_num = int(serie_numero_str)
-                available_series_numbers.append(serie_num)
-                if int(serie_num) != int(DOSE_SERIES_NUMBER):
-                    continue
-
-                if not series.instances:
-                    logger.debug("[SKIP] Serie sin instancias en estudio %s", getattr(study, 'id_', 'unknown'))
-                    continue
-
-                ins = series.instances[0]
-                try:
-                    ds = ins.get_pydicom()
-                except Exception as exc:
-                    logger.warning("[SKIP] No se pudo leer pydicom de la instancia %s: %s", getattr(ins, 'id_', 'unknown'), exc)
-                    continue
-                if 'PixelData' not in ds:
-                    logger.debug("[SKIP] Instancia sin PixelData para %s", ruta_json.name)
-                    continue
-
-                # Preprocesamiento de la imagen
-                imagen = ds.pixel_array
-                if imagen.dtype != np.uint8:
-                    imagen = (255 * (imagen - np.min(imagen)) / np.ptp(imagen)).astype(np.uint8)
-                imagen_grande = cv2.resize(imagen, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
-
-                #Preprocesamiento de la imagen (tabla invertida)
-                imagen_header = imagen_grande
-                img_pil = Image.fromarray(imagen_grande).convert("L")
-                img_inv_pil = ImageOps.invert(img_pil)
-                imagen_tabla = np.array(img_inv_pil)
-
-                # OCR para encabezado
-                header_result = reader.readtext(
-                    imagen_header,
-                    width_ths=1.75,
-                    ycenter_ths=0.7
-                )
-                header_lines = [d[1].strip() for d in header_result if d[1].strip()]
-
-                # OCR para tabla dosimétrica
-                table_result = reader.readtext(
-                    imagen_tabla,
-                    width_ths=10,
-                    ycenter_ths=0.8
-                )
-                table_lines = [d[1].strip() for d in table_result if d[1].strip()]
-
-                # Procesamiento
-                encabezado = extraer_encabezado_desde_lineas(header_lines)
-                df_tabla = extraer_tabla_dosimetrica(table_lines)
-
-                dicom_header = ins.tags
-
-                # Guardar JSON en subcarpeta
-                #ruta_json = OUTPUT_DIR / f"paciente_{study.id_}.json"
-                guardar_json_completo(
-                    encabezado,
-                    df_tabla.to_dict(orient="records"),
-                    ruta_json,
-                    dicom_header=dicom_header,
-                )
-                logger.info("[OK] OCR guardado: %s", ruta_json.name)
-                total_json += 1
-                estudios_procesados += 1
-                procesado_estudio = True
-                break
-
-            if not procesado_estudio:
-                logger.debug(
-                    "[SKIP] Estudio %s del paciente %s no coincidió con DOSE_SERIES_NUMBER=%s. Disponibles: %s",
-                    getattr(study, 'id_', 'unknown'), getattr(patient, 'name', ''), DOSE_SERIES_NUMBER, sorted(set(available_series_numbers))
-                )
+    procesados = 0
+    logger.info("Estudios a revisar: %d | Filtro StudyDescription: '%s'", len(estudios), STUDY_DESCRIPTION)
+
+    for patient, study in estudios:
+        coincide, ruta = procesar_estudio(patient, study)
+        estudios_filtrados += int(coincide)
+        procesados += 1
+        total_json += int(ruta is not None)
+        if entregar and ruta is not None:
+            entregar([ruta])
 
     logger.info(
-        "[OCR] Estudios filtrados por descripcion: %d | Procesados: %d | JSON exportados: %d en '%s'",
-        estudios_filtrados, estudios_procesados, total_json, str(OUTPUT_DIR)
+        "[OCR] Estudios procesados: %d | Filtrados por descripcion: %d | JSON exportados: %d en '%s'",
+        procesados, estudios_filtrados, total_json, str(OUTPUT_DIR)
     )
             
 if __name__ == "__main__":
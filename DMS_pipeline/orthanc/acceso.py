@@ -0,0 +1,354 @@
+"""
+Acceso compartido a Orthanc: concurrencia adaptativa, limite de tasa,
+reintentos y circuit breaker.
+
+Orthanc es tambien el PACS clinico: el pipeline debe ir tan rapido como el
+servidor lo permita y no mas. Todos los clientes del proceso (OCR, headers)
+se crean con `crear_cliente()` y comparten un mismo transporte httpx que:
+
+- limita las requests en vuelo con AIMD sobre el p95 de latencia: cada
+  ORTHANC_AIMD_WINDOW respuestas, si el p95 supera ORTHANC_P95_TARGET_MS (o
+  hubo 429/503/timeouts) el limite se multiplica por 0.7; si no, sube en 1,
+  entre ORTHANC_CONCURRENCY_MIN y ORTHANC_CONCURRENCY_MAX. La latencia se
+  mide hasta recibir los headers (una instancia grande no parece un Orthanc
+  cargado), pero el cupo se libera al terminar de leer el cuerpo;
+- aplica un token bucket (ORTHANC_RATE requests/s, rafagas de
+  ORTHANC_BURST; 0 = sin limite);
+- reintenta GET (y POST /tools/find, que solo consulta) ante errores de
+  conexion, timeouts y 429/502/503/504, con backoff exponencial con jitter
+  completo (respeta Retry-After);
+- abre el circuito tras ORTHANC_BREAKER_FAILURES fallas seguidas: durante
+  ORTHANC_BREAKER_COOLDOWN_S las requests fallan enseguida con
+  `OrthancNoDisponible`; despues pasa una sola de prueba (semiabierto).
+
+Los limites son por proceso. Con varios procesos contra el mismo Orthanc
+(workers en varios hosts, backfill) ORTHANC_PROCESSES indica cuantos son y
+cada uno usa 1/N de ORTHANC_CONCURRENCY_MAX, ORTHANC_RATE y ORTHANC_BURST;
+el backfill lo ajusta solo para sus procesos.
+
+`metricas()` devuelve el estado (limite, en vuelo, p50/p95, circuito) y los
+totales; ademas cada etapa suma orthanc_reintentos y orthanc_espera_s en
+su telemetria.
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+import httpx
+import pyorthanc
+
+from config import (
+    ORTHANC_AIMD_WINDOW,
+    ORTHANC_BACKOFF_BASE_MS,
+    ORTHANC_BACKOFF_MAX_S,
+    ORTHANC_BREAKER_COOLDOWN_S,
+    ORTHANC_BREAKER_FAILURES,
+    ORTHANC_BURST,
+    ORTHANC_CONCURRENCY_MAX,
+    ORTHANC_CONCURRENCY_MIN,
+    ORTHANC_P95_TARGET_MS,
+    ORTHANC_PASS,
+    ORTHANC_PROCESSES,
+    ORTHANC_RATE,
+    ORTHANC_RETRIES,
+    ORTHANC_TIMEOUT,
+    ORTHANC_URL,
+    ORTHANC_USER,
+)
+from telemetria import HOOKS_HTTPX, contar
+
+
+logger = logging.getLogger(__name__)
+
+ESTADOS_REINTENTABLES = {429, 502, 503, 504}
+ESTADOS_SOBRECARGA = {429, 503}
+
+
+class OrthancNoDisponible(httpx.TransportError):
+    """Circuito abierto: Orthanc fallo repetidamente y no se le envian requests."""
+
+
+def _percentil(valores, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p * len(ordenados)))]
+
+
+class LimiteAIMD:
+    """Semaforo cuyo tamaño sube de a 1 y baja multiplicando segun la latencia."""
+
+    def __init__(self, minimo: int, maximo: int, objetivo_s: float, ventana: int, inicial: Optional[int] = None):
+        self.minimo = max(1, minimo)
+        self.maximo = max(self.minimo, maximo)
+        self.objetivo_s = objetivo_s
+        self.ventana = max(1, ventana)
+        self.limite = float(inicial or self.minimo)
+        self.en_vuelo = 0
+        self._muestras: Deque[float] = deque(maxlen=self.ventana)
+        self._recientes: Deque[float] = deque(maxlen=500)  # solo para metricas
+        self._sobrecarga = False
+        self._cond = threading.Condition()
+
+    def adquirir(self) -> float:
+        """Bloquea hasta tener cupo. Devuelve los segundos esperados."""
+        inicio = time.perf_counter()
+        with self._cond:
+            while self.en_vuelo >= int(self.limite):
+                self._cond.wait()
+            self.en_vuelo += 1
+        return time.perf_counter() - inicio
+
+    def liberar(self, duracion_s: Optional[float], sobrecarga: bool = False) -> None:
+        """Devuelve el cupo y registra la latencia (None si la request fallo sin respuesta).
+
+        El ajuste es uno por ventana: varias sobrecargas seguidas recortan una sola vez."""
+        with self._cond:
+            self.en_vuelo -= 1
+            self._sobrecarga |= sobrecarga
+            if duracion_s is not None:
+                self._recientes.append(duracion_s)
+            # un fallo sin respuesta tambien ocupa un lugar en la ventana
+            self._muestras.append(self.objetivo_s if duracion_s is None else duracion_s)
+            if len(self._muestras) >= self.ventana:
+                self._ajustar()
+            self._cond.notify_all()
+
+    def _ajustar(self) -> None:
+        p95 = _percentil(self._muestras, 0.95)
+        anterior = self.limite
+        if self._sobrecarga or p95 > self.objetivo_s:
+            self.limite = max(self.minimo, self.limite * 0.7)
+        else:
+            self.limite = min(self.maximo, self.limite + 1)
+        if int(anterior) != int(self.limite):
+            logger.info("[ORTHANC] Concurrencia %d -> %d (p95 %.0f ms%s)", int(anterior), int(self.limite),
+                        p95 * 1000, ", sobrecarga" if self._sobrecarga else "")
+        self._muestras.clear()
+        self._sobrecarga = False
+
+    def percentiles(self) -> Dict[str, float]:
+        with self._cond:
+            recientes = list(self._recientes)
+        return {"p50_ms": round(_percentil(recientes, 0.5) * 1000, 1),
+                "p95_ms": round(_percentil(recientes, 0.95) * 1000, 1)}
+
+
+class TokenBucket:
+    def __init__(self, tasa: float, rafaga: int):
+        self.tasa = tasa
+        self.capacidad = max(1, rafaga)
+        self._tokens = float(self.capacidad)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def tomar(self) -> float:
+        """Consume un token esperando lo necesario. Devuelve los segundos esperados."""
+        if self.tasa <= 0:
+            return 0.0
+        with self._lock:
+            ahora = time.monotonic()
+            self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+            self._ultimo = ahora
+            self._tokens -= 1  # puede quedar negativo: la espera reserva el turno
+            espera = -self._tokens / self.tasa if self._tokens < 0 else 0.0
+        if espera:
+            time.sleep(espera)
+        return espera
+
+
+class CircuitBreaker:
+    CERRADO, ABIERTO, SEMIABIERTO = "cerrado", "abierto", "semiabierto"
+
+    def __init__(self, umbral: int, enfriamiento_s: float):
+        self.umbral = max(1, umbral)
+        self.enfriamiento_s = enfriamiento_s
+        self.estado = self.CERRADO
+        self.fallas = 0
+        self._abierto_en = 0.0
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+
+    def permitir(self) -> bool:
+        with self._lock:
+            if self.estado == self.CERRADO:
+                return True
+            if self.estado == self.ABIERTO and time.monotonic() - self._abierto_en >= self.enfriamiento_s:
+                self.estado = self.SEMIABIERTO
+                self._prueba_en_curso = False
+            if self.estado == self.SEMIABIERTO and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                return True
+            return False
+
+    def exito(self) -> None:
+        with self._lock:
+            if self.estado != self.CERRADO:
+                logger.info("[ORTHANC] Circuito cerrado: Orthanc responde de nuevo")
+            self.estado = self.CERRADO
+            self.fallas = 0
+            self._prueba_en_curso = False
+
+    def falla(self) -> None:
+        with self._lock:
+            self.fallas += 1
+            self._prueba_en_curso = False
+            if self.estado == self.SEMIABIERTO or (self.estado == self.CERRADO and self.fallas >= self.umbral):
+                if self.estado == self.CERRADO:
+                    logger.warning("[ORTHANC] Circuito abierto tras %d fallas seguidas; pausa de %.0f s",
+                                   self.fallas, self.enfriamiento_s)
+                self.estado = self.ABIERTO
+                self._abierto_en = time.monotonic()
+
+
+class _CuerpoConCupo(httpx.SyncByteStream):
+    """Mantiene el cupo de concurrencia hasta que se termina de leer el cuerpo."""
+
+    def __init__(self, stream: httpx.SyncByteStream, al_cerrar):
+        self._stream = stream
+        self._al_cerrar = al_cerrar
+        self._cerrado = False
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self) -> None:
+        if self._cerrado:
+            return
+        self._cerrado = True
+        try:
+            self._stream.close()
+        finally:
+            self._al_cerrar()
+
+
+class TransporteAdaptativo(httpx.BaseTransport):
+    def __init__(self, transporte: Optional[httpx.BaseTransport] = None, procesos: int = ORTHANC_PROCESSES):
+        # La parte de este proceso del presupuesto total para Orthanc
+        procesos = max(1, procesos)
+        maximo = max(1, ORTHANC_CONCURRENCY_MAX // procesos)
+        minimo = min(ORTHANC_CONCURRENCY_MIN, maximo)
+        self._transporte = transporte or httpx.HTTPTransport(
+            limits=httpx.Limits(max_connections=maximo, max_keepalive_connections=maximo),
+        )
+        self.limite = LimiteAIMD(minimo, maximo, ORTHANC_P95_TARGET_MS / 1000.0, ORTHANC_AIMD_WINDOW,
+                                 inicial=(minimo + maximo) // 2)
+        self.bucket = TokenBucket(ORTHANC_RATE / procesos, max(1, ORTHANC_BURST // procesos))
+        self.circuito = CircuitBreaker(ORTHANC_BREAKER_FAILURES, ORTHANC_BREAKER_COOLDOWN_S)
+        self._totales = {"requests": 0, "reintentos": 0, "errores": 0, "rechazadas_circuito": 0, "espera_s": 0.0}
+        self._lock = threading.Lock()
+
+    def _sumar(self, campo: str, valor: float = 1) -> None:
+        with self._lock:
+            self._totales[campo] += valor
+
+    @staticmethod
+    def _reintentable(request: httpx.Request) -> bool:
+        return request.method in ("GET", "HEAD") or (
+            request.method == "POST" and request.url.path.rstrip("/").endswith("/tools/find")
+        )
+
+    @staticmethod
+    def _espera_reintento(intento: int, respuesta: Optional[httpx.Response]) -> float:
+        if respuesta is not None:
+            try:
+                return min(float(respuesta.headers["retry-after"]), ORTHANC_BACKOFF_MAX_S)
+            except (KeyError, ValueError):
+                pass
+        # Backoff exponencial con jitter completo
+        return random.uniform(0, min(ORTHANC_BACKOFF_MAX_S, ORTHANC_BACKOFF_BASE_MS / 1000.0 * 2 ** intento))
+
+    def _enviar(self, request: httpx.Request) -> httpx.Response:
+        """Un intento: circuito, tasa y cupo; el cupo queda tomado hasta cerrar la respuesta."""
+        if not self.circuito.permitir():
+            self._sumar("rechazadas_circuito")
+            raise OrthancNoDisponible("Circuito abierto: Orthanc no disponible", request=request)
+        espera = self.bucket.tomar() + self.limite.adquirir()
+        self._sumar("espera_s", espera)
+        contar("orthanc_espera_s", espera)
+        inicio = time.perf_counter()
+        try:
+            respuesta = self._transporte.handle_request(request)
+        except httpx.TransportError as exc:
+            self.limite.liberar(None, sobrecarga=isinstance(exc, httpx.TimeoutException))
+            self.circuito.falla()
+            raise
+        # Hasta los headers: la descarga del cuerpo depende del tamaño, no de la carga de Orthanc
+        latencia = time.perf_counter() - inicio
+        sobrecarga = respuesta.status_code in ESTADOS_SOBRECARGA
+        if respuesta.status_code >= 500 or sobrecarga:
+            self.circuito.falla()
+        else:
+            self.circuito.exito()
+        respuesta.stream = _CuerpoConCupo(respuesta.stream, lambda: self.limite.liberar(latencia, sobrecarga))
+        return respuesta
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self._sumar("requests")
+        intentos = ORTHANC_RETRIES + 1 if self._reintentable(request) else 1
+        for intento in range(intentos):
+            ultimo = intento == intentos - 1
+            try:
+                respuesta = self._enviar(request)
+            except OrthancNoDisponible:
+                self._sumar("errores")
+                raise
+            except httpx.TransportError as exc:
+                if ultimo:
+                    self._sumar("errores")
+                    raise
+                espera = self._espera_reintento(intento, None)
+                logger.warning("[ORTHANC] %s %s: %s; reintento en %.1f s", request.method, request.url.path,
+                               type(exc).__name__, espera)
+            else:
+                if respuesta.status_code not in ESTADOS_REINTENTABLES or ultimo:
+                    if respuesta.status_code >= 500:
+                        self._sumar("errores")
+                    return respuesta
+                espera = self._espera_reintento(intento, respuesta)
+                respuesta.read()
+                respuesta.close()
+                logger.warning("[ORTHANC] %s %s: HTTP %d; reintento en %.1f s", request.method, request.url.path,
+                               respuesta.status_code, espera)
+            self._sumar("reintentos")
+            contar("orthanc_reintentos")
+            time.sleep(espera)
+        raise AssertionError("inalcanzable")
+
+    def close(self) -> None:
+        self._transporte.close()
+
+    def metricas(self) -> Dict[str, Any]:
+        with self._lock:
+            totales = dict(self._totales)
+        totales["espera_s"] = round(totales["espera_s"], 3)
+        return {
+            "limite": int(self.limite.limite),
+            "en_vuelo": self.limite.en_vuelo,
+            **self.limite.percentiles(),
+            "circuito": self.circuito.estado,
+            **totales,
+        }
+
+
+# Un transporte por proceso: el limite y el circuito valen para todos los clientes
+TRANSPORTE = TransporteAdaptativo()
+
+
+def crear_cliente() -> pyorthanc.Orthanc:
+    """Cliente pyorthanc sobre el transporte compartido (admite requests desde varios hilos)."""
+    return pyorthanc.Orthanc(
+        ORTHANC_URL, ORTHANC_USER, ORTHANC_PASS,
+        timeout=httpx.Timeout(ORTHANC_TIMEOUT, connect=min(10.0, ORTHANC_TIMEOUT)),
+        trust_env=False,  # con proxies de entorno httpx montaria otros transportes y saltaria este
+        event_hooks=HOOKS_HTTPX,
+        transport=TRANSPORTE,
+    )
+
+
+def metricas() -> Dict[str, Any]:
+    return TRANSPORTE.metricas()
@@ -0,0 +1,246 @@
+"""
+Cache local de instancias DICOM, direccionada por SOPInstanceUID.
+
+El OCR, los headers CT y la calidad PET descargan instancias completas de
+Orthanc; tras una caida o un cambio de parametros, una corrida nueva las
+volvia a bajar todas. Con DICOM_CACHE_MAX_MB > 0 cada instancia descargada
+queda en disco y las siguientes lecturas (de cualquier etapa, proceso o
+worker que comparta DICOM_CACHE_DIR) salen de ahi.
+
+Layout: <DICOM_CACHE_DIR>/<ab>/<sha1(uid)>.<sha256(contenido)>.dcm
+- el nombre lleva el hash del contenido: al leer se recalcula y un archivo
+  truncado o corrupto se borra y cuenta como fallo;
+- las escrituras van a un temporal del mismo directorio y se publican con
+  os.replace (atomico): dos workers que bajan la misma instancia escriben
+  el mismo archivo y un lector nunca ve uno a medio escribir;
+- el mtime marca el ultimo uso (se actualiza en cada acierto) y al pasar el
+  presupuesto se borran los menos usados hasta quedar en el 90%, mirando el
+  directorio real (otros procesos tambien escriben).
+
+`leer_dataset(instance)` es el punto de lectura de las etapas (las instancias
+de una fuente local se leen directo de su archivo); cuenta
+cache_aciertos/cache_fallos/cache_mb_leidos en la telemetria de la etapa y
+`estadisticas()` da los totales del proceso.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import pydicom
+
+from config import DICOM_CACHE_DIR, DICOM_CACHE_MAX_MB
+from telemetria import contar
+
+
+logger = logging.getLogger(__name__)
+
+_MB = 1024 * 1024
+
+
+class CacheDicom:
+    def __init__(self, directorio: str, max_bytes: int):
+        self.directorio = Path(directorio)
+        self.max_bytes = max_bytes
+        self._indice: Dict[str, Tuple[Path, int]] = {}  # sha1(uid) -> (ruta, bytes)
+        self._total = 0
+        self._escaneado = False
+        self._stats = {"aciertos": 0, "fallos": 0, "corruptos": 0, "escritos": 0,
+                       "bytes_leidos": 0, "bytes_escritos": 0, "desalojados": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def activa(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def _clave(uid: str) -> str:
+        return hashlib.sha1(uid.strip().encode()).hexdigest()
+
+    def _sumar(self, campo: str, valor: int = 1) -> None:
+        with self._lock:
+            self._stats[campo] += valor
+
+    def _archivos(self):
+        """(ruta, bytes, mtime) de cada instancia en disco."""
+        if not self.directorio.is_dir():
+            return
+        for sub in os.scandir(self.directorio):
+            if not sub.is_dir():
+                continue
+            for entrada in os.scandir(sub.path):
+                if not entrada.name.endswith(".dcm"):
+                    continue
+                try:
+                    st = entrada.stat()
+                except FileNotFoundError:  # desalojado por otro proceso
+                    continue
+                yield Path(entrada.path), st.st_size, st.st_mtime
+
+    def _escanear(self) -> None:
+        """Indice en memoria del directorio (una vez por proceso, en el primer uso)."""
+        with self._lock:
+            if self._escaneado:
+                return
+            self._indice.clear()
+            for ruta, tam, _ in self._archivos():
+                self._indice[ruta.name.split(".", 1)[0]] = (ruta, tam)
+            self._total = sum(tam for _, tam in self._indice.values())
+            self._escaneado = True
+        logger.info("[CACHE] %d instancia(s), %.1f MB en '%s' (presupuesto %.0f MB)",
+                    len(self._indice), self._total / _MB, self.directorio, self.max_bytes / _MB)
+
+    def _buscar(self, clave: str) -> Optional[Path]:
+        with self._lock:
+            encontrado = self._indice.get(clave)
+        if encontrado and encontrado[0].exists():
+            return encontrado[0]
+        # otro proceso pudo haberla escrito despues del escaneo
+        sub = self.directorio / clave[:2]
+        for ruta in sub.glob(f"{clave}.*.dcm") if sub.is_dir() else ():
+            return ruta
+        return None
+
+    def _olvidar(self, clave: str) -> None:
+        with self._lock:
+            quitado = self._indice.pop(clave, None)
+            if quitado:
+                self._total -= quitado[1]
+
+    def obtener(self, uid: str) -> Optional[bytes]:
+        """Contenido de la instancia si esta en cache y su hash coincide."""
+        self._escanear()
+        clave = self._clave(uid)
+        datos = self._leer(clave)
+        if datos is None:
+            self._sumar("fallos")
+            contar("cache_fallos")
+            return None
+        self._sumar("aciertos")
+        self._sumar("bytes_leidos", len(datos))
+        contar("cache_aciertos")
+        contar("cache_mb_leidos", len(datos) / _MB)
+        return datos
+
+    def _leer(self, clave: str) -> Optional[bytes]:
+        ruta = self._buscar(clave)
+        if ruta is None:
+            return None
+        try:
+            datos = ruta.read_bytes()
+        except FileNotFoundError:
+            self._olvidar(clave)
+            return None
+        if hashlib.sha256(datos).hexdigest() != ruta.name.split(".")[1]:
+            logger.warning("[CACHE] Archivo corrupto descartado: %s", ruta.name)
+            self._sumar("corruptos")
+            self._olvidar(clave)
+            ruta.unlink(missing_ok=True)
+            return None
+        try:
+            os.utime(ruta)  # ultimo uso, para el LRU
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            if clave not in self._indice:
+                self._indice[clave] = (ruta, len(datos))
+                self._total += len(datos)
+        return datos
+
+    def guardar(self, uid: str, datos: bytes) -> None:
+        """Escribe la instancia (atomico) y desaloja si se paso del presupuesto."""
+        if len(datos) > self.max_bytes:
+            return
+        self._escanear()
+        clave = self._clave(uid)
+        sub = self.directorio / clave[:2]
+        sub.mkdir(parents=True, exist_ok=True)
+        ruta = sub / f"{clave}.{hashlib.sha256(datos).hexdigest()}.dcm"
+        fd, tmp = tempfile.mkstemp(dir=sub, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(datos)
+            os.replace(tmp, ruta)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        with self._lock:
+            anterior = self._indice.get(clave)
+            self._indice[clave] = (ruta, len(datos))
+            self._total += len(datos) - (anterior[1] if anterior else 0)
+            self._stats["escritos"] += 1
+            self._stats["bytes_escritos"] += len(datos)
+            excedido = self._total > self.max_bytes
+        if anterior and anterior[0] != ruta:
+            anterior[0].unlink(missing_ok=True)
+        if excedido:
+            self.desalojar()
+
+    def desalojar(self) -> int:
+        """Borra las instancias usadas hace mas tiempo hasta quedar en el 90% del presupuesto."""
+        archivos = sorted(self._archivos(), key=lambda a: a[2])
+        total = sum(tam for _, tam, _ in archivos)
+        objetivo = int(self.max_bytes * 0.9)
+        borrados = 0
+        for ruta, tam, _ in archivos:
+            if total <= objetivo:
+                break
+            ruta.unlink(missing_ok=True)
+            total -= tam
+            borrados += 1
+            self._olvidar(ruta.name.split(".", 1)[0])
+        with self._lock:
+            self._total = total
+            self._stats["desalojados"] += borrados
+        if borrados:
+            logger.info("[CACHE] %d instancia(s) desalojadas; quedan %.1f MB", borrados, total / _MB)
+        return borrados
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            total, n = self._total, len(self._indice)
+        consultas = stats["aciertos"] + stats["fallos"]
+        return {
+            "activa": self.activa,
+            "instancias": n,
+            "mb": round(total / _MB, 1),
+            "max_mb": round(self.max_bytes / _MB, 1),
+            "tasa_aciertos": round(stats["aciertos"] / consultas, 3) if consultas else None,
+            **stats,
+        }
+
+
+CACHE = CacheDicom(DICOM_CACHE_DIR, DICOM_CACHE_MAX_MB * _MB)
+
+
+def leer_bytes(instance) -> bytes:
+    """Archivo DICOM de una instancia pyorthanc: de la cache o descargado (y guardado)."""
+    if not CACHE.activa or getattr(instance, "local", False):  # fuentes/directorio.py: ya esta en disco
+        return instance.get_dicom_file_content()
+    try:
+        uid = instance.uid
+    except Exception:  # sin SOPInstanceUID en los MainDicomTags: el ID de Orthanc tambien es unico
+        uid = f"orthanc:{instance.id_}"
+    datos = CACHE.obtener(uid)
+    if datos is not None:
+        return datos
+    datos = instance.get_dicom_file_content()
+    try:
+        CACHE.guardar(uid, datos)
+    except OSError as exc:  # disco lleno, permisos: se sigue sin cache
+        logger.warning("[CACHE] No se pudo guardar %s: %s", uid, exc)
+    return datos
+
+
+def leer_dataset(instance) -> pydicom.Dataset:
+    return pydicom.dcmread(BytesIO(leer_bytes(instance)), force=True)
+
+
+def estadisticas() -> Dict[str, Any]:
+    return CACHE.estadisticas()
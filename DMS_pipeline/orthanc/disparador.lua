@@ -0,0 +1,19 @@
+-- Aviso de estudios estables al disparador del pipeline (DMS_pipeline/disparador.py).
+-- Agregar en orthanc.json:  "LuaScripts" : [ "/ruta/a/disparador.lua" ]
+-- Si se define TRIGGER_TOKEN, poner el mismo valor en TOKEN.
+
+local URL = 'http://127.0.0.1:8765/stable-study'
+local TOKEN = ''
+
+function OnStableStudy(studyId, tags, metadata)
+   local headers = {}
+   if TOKEN ~= '' then
+      headers['X-Trigger-Token'] = TOKEN
+   end
+   -- pcall: si el disparador no esta corriendo, Orthanc sigue normalmente
+   -- y el scan periodico de respaldo recoge el estudio
+   local ok, err = pcall(HttpPost, URL, studyId, headers)
+   if not ok then
+      print('Disparador DMS no disponible: ' .. tostring(err))
+   end
+end
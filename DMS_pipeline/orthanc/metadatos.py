@@ -0,0 +1,244 @@
+"""
+Metadatos de Orthanc memorizados durante una corrida.
+
+Con los recursos de pyorthanc cada acceso perezoso es una request:
+`series.instances` pide /series/{id} de nuevo cada vez, cada Instance nueva
+pide /instances/{id} para su uid, y el OCR, los headers CT y los headers PET
+recorren los mismos estudios por separado. Aqui las clases `Paciente`,
+`Estudio`, `Serie` e `Instancia` son los mismos recursos de pyorthanc pero
+su `get_main_information()` (de donde salen MainDicomTags, Series,
+Instances, ParentPatient...) y `tags` pasan por un memo compartido:
+
+- la primera vez que se necesita una serie o instancia de un estudio se
+  traen todas juntas con /studies/{id}/series?expand y
+  /studies/{id}/instances?expand (una request por nivel y estudio);
+- cada respuesta queda memorizada hasta el fin de la corrida (el launcher
+  llama a `reiniciar()` al empezar cada una), para todas las etapas;
+- solo se conservan los recursos de los ORTHANC_MEMO_STUDIES estudios usados
+  mas recientemente, para acotar la memoria en un scan completo; los que no
+  cuelgan de un estudio conocido (pacientes) tienen su propio LRU del mismo
+  tamaño;
+- `compartido(clave, calcular)` guarda un resultado que varias etapas
+  necesitan (p. ej. el listado de todos los estudios de un scan completo):
+  la primera etapa lo calcula y las demas esperan y lo reutilizan.
+
+Cada respuesta servida desde el memo es una request que no se hizo: se
+suma a orthanc_memo_ahorradas de la etapa y `estadisticas()` da los totales.
+"""
+
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+import pyorthanc
+
+from config import ORTHANC_MEMO_STUDIES
+from telemetria import contar
+
+
+logger = logging.getLogger(__name__)
+
+
+class Memo:
+    def __init__(self, max_estudios: int = ORTHANC_MEMO_STUDIES):
+        self.max_estudios = max(1, max_estudios)
+        self._info: Dict[str, Dict[str, Any]] = {}  # ID de Orthanc -> informacion (cualquier nivel)
+        self._tags: Dict[str, Dict[str, Any]] = {}
+        self._estudio_de: Dict[str, str] = {}  # serie/instancia -> estudio
+        self._expandidos: "OrderedDict[str, Set[str]]" = OrderedDict()  # estudio -> IDs memorizados (LRU)
+        self._sueltos: "OrderedDict[str, None]" = OrderedDict()  # IDs sin estudio, p. ej. pacientes (LRU)
+        self._niveles_hechos = set()  # (estudio, "series" | "instances")
+        # Fuera del desalojo: si otro hilo esta expandiendo el estudio, quien llega
+        # despues debe esperar en el mismo lock (uno por estudio y corrida)
+        self._locks_estudio: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+        self._compartidos: Dict[str, Any] = {}
+        self._locks_compartidos: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self.requests = 0
+        self.ahorradas = 0
+
+    def _ahorro(self, id_: str) -> None:
+        with self._lock:
+            self.ahorradas += 1
+            # Un acierto cuenta como uso: el estudio pasa al final del LRU
+            estudio = id_ if id_ in self._expandidos else self._estudio_de.get(id_)
+            if estudio in self._expandidos:
+                self._expandidos.move_to_end(estudio)
+            elif id_ in self._sueltos:
+                self._sueltos.move_to_end(id_)
+        contar("orthanc_memo_ahorradas")
+
+    def _pedir(self, llamada: Callable[[], Any]) -> Any:
+        resultado = llamada()
+        with self._lock:
+            self.requests += 1
+        return resultado
+
+    def _guardar(self, infos: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            for info in infos:
+                self._info[info["ID"]] = info
+                if info.get("Type") == "Study":
+                    estudio = info["ID"]
+                    for serie in info.get("Series", ()):
+                        self._estudio_de[serie] = estudio
+                elif info.get("Type") == "Series":
+                    estudio = info.get("ParentStudy")
+                    for instancia in info.get("Instances", ()):
+                        self._estudio_de[instancia] = estudio
+                else:
+                    estudio = self._estudio_de.get(info["ID"])
+                self._registrar(info["ID"], estudio)
+            self._desalojar()
+
+    def _registrar(self, id_: str, estudio: Optional[str]) -> None:
+        # con self._lock tomado
+        if estudio is not None:
+            self._expandidos.setdefault(estudio, set()).add(id_)
+            self._expandidos.move_to_end(estudio)
+        else:
+            self._sueltos[id_] = None
+            self._sueltos.move_to_end(id_)
+
+    def _desalojar(self) -> None:
+        # con self._lock tomado
+        while len(self._expandidos) > self.max_estudios:
+            self._olvidar(*self._expandidos.popitem(last=False))
+        while len(self._sueltos) > self.max_estudios:
+            id_, _ = self._sueltos.popitem(last=False)
+            self._info.pop(id_, None)
+            self._tags.pop(id_, None)
+
+    def _expandir(self, client: pyorthanc.Orthanc, estudio: str, nivel: str) -> None:
+        """Trae de una vez todas las series o instancias del estudio."""
+        with self._lock:
+            lock_estudio = self._locks_estudio[estudio]
+        with lock_estudio:
+            if (estudio, nivel) in self._niveles_hechos:
+                return
+            llamada = client.get_studies_id_series if nivel == "series" else client.get_studies_id_instances
+            self._guardar(self._pedir(lambda: llamada(estudio, params={"expand": "true"})))
+            with self._lock:
+                self._niveles_hechos.add((estudio, nivel))
+
+    def _olvidar(self, estudio: str, ids: Iterable[str]) -> None:
+        # con self._lock tomado
+        for id_ in ids:
+            info = self._info.pop(id_, None) or {}
+            for hijo in info.get("Series", ()) if info.get("Type") == "Study" else info.get("Instances", ()):
+                self._estudio_de.pop(hijo, None)
+            self._tags.pop(id_, None)
+            self._estudio_de.pop(id_, None)
+        self._niveles_hechos.discard((estudio, "series"))
+        self._niveles_hechos.discard((estudio, "instances"))
+
+    def info(self, client: pyorthanc.Orthanc, nivel: str, id_: str) -> Dict[str, Any]:
+        """Informacion de /{nivel}/{id} (patients, studies, series, instances)."""
+        with self._lock:
+            info = self._info.get(id_)
+            estudio = self._estudio_de.get(id_)
+        if info is not None:
+            self._ahorro(id_)
+            return info
+        if estudio is not None and nivel in ("series", "instances"):
+            self._expandir(client, estudio, nivel)
+            with self._lock:
+                info = self._info.get(id_)
+            if info is not None:
+                return info
+        info = self._pedir(lambda: getattr(client, f"get_{nivel}_id")(id_))
+        self._guardar([info])
+        return info
+
+    def tags(self, client: pyorthanc.Orthanc, id_: str) -> Dict[str, Any]:
+        with self._lock:
+            tags = self._tags.get(id_)
+        if tags is not None:
+            self._ahorro(id_)
+            return tags
+        tags = dict(self._pedir(lambda: client.get_instances_id_tags(id_)))
+        with self._lock:
+            self._tags[id_] = tags
+            self._registrar(id_, self._estudio_de.get(id_))
+            self._desalojar()
+        return tags
+
+    def compartido(self, clave: str, calcular: Callable[[], Any]) -> Any:
+        with self._lock:
+            lock_clave = self._locks_compartidos[clave]
+        with lock_clave:
+            if clave in self._compartidos:
+                self._ahorro(clave)
+                return self._compartidos[clave]
+            valor = calcular()
+            self._compartidos[clave] = valor
+            return valor
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "ahorradas": self.ahorradas,
+                "recursos": len(self._info),
+                "estudios_expandidos": len(self._expandidos),
+            }
+
+
+_MEMO = Memo()
+
+
+def reiniciar() -> None:
+    """Descarta lo memorizado: cada corrida ve el estado actual de Orthanc."""
+    global _MEMO
+    _MEMO = Memo()
+
+
+def estadisticas() -> Dict[str, Any]:
+    return _MEMO.estadisticas()
+
+
+def compartido(clave: str, calcular: Callable[[], Any]) -> Any:
+    """`calcular()` una sola vez por corrida; las demas llamadas (de cualquier etapa) reciben el mismo valor."""
+    return _MEMO.compartido(clave, calcular)
+
+
+def memorizar(infos: List[Dict[str, Any]]) -> None:
+    """Agrega respuestas ya obtenidas por otra via (p. ej. /tools/find expandida)."""
+    _MEMO._guardar(infos)
+
+
+class Instancia(pyorthanc.Instance):
+    def get_main_information(self) -> Dict:
+        return _MEMO.info(self.client, "instances", self.id_)
+
+    @property
+    def tags(self) -> Dict:
+        return _MEMO.tags(self.client, self.id_)
+
+
+class Serie(pyorthanc.Series):
+    def get_main_information(self) -> Dict:
+        return _MEMO.info(self.client, "series", self.id_)
+
+    @property
+    def instances(self) -> List[Instancia]:
+        return [Instancia(i, self.client) for i in self.get_main_information()["Instances"]]
+
+
+class Estudio(pyorthanc.Study):
+    def get_main_information(self) -> Dict:
+        return _MEMO.info(self.client, "studies", self.id_)
+
+    @property
+    def series(self) -> List[Serie]:
+        return [Serie(i, self.client) for i in self.get_main_information()["Series"]]
+
+
+class Paciente(pyorthanc.Patient):
+    def get_main_information(self) -> Dict:
+        return _MEMO.info(self.client, "patients", self.id_)
+
+    @property
+    def studies(self) -> List[Estudio]:
+        return [Estudio(i, self.client) for i in self.get_main_information()["Studies"]]
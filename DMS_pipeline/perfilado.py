@@ -0,0 +1,192 @@
+"""
+Perfilado opcional de etapas del pipeline (CPU por muestreo + tracemalloc).
+
+Se activa con PIPELINE_PROFILE (lista de etapas separadas por coma o
+"all") o con `--profile` en launcher.py / scheduler.py. Desactivado, cada
+etapa solo paga una busqueda en un set: no se crean hilos ni se activa
+tracemalloc.
+
+Por cada etapa perfilada se escriben en PIPELINE_PROFILE_DIR:
+- `<corrida>_<etapa>.folded`: pilas colapsadas ("a;b;c N"), para
+  flamegraph.pl o speedscope.
+- `<corrida>_<etapa>.txt`: resumen con las N funciones con mas muestras
+  (propias y acumuladas) y las N lineas con mas memoria neta asignada.
+
+El muestreo lee la pila del hilo de la etapa con sys._current_frames cada
+PIPELINE_PROFILE_INTERVAL_MS. tracemalloc es global al proceso: con etapas
+en paralelo, la memoria de una etapa incluye lo que asignen las demas en
+el mismo intervalo (usar PIPELINE_WORKERS=1 para aislarlas). tracemalloc
+puede duplicar el tiempo de etapas que asignan mucho; se desactiva con
+PIPELINE_PROFILE_MEMORY=false.
+"""
+
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Optional, Set, Tuple
+
+from config import (
+    PROFILE_DIR,
+    PROFILE_INTERVAL_MS,
+    PROFILE_MEMORY,
+    PROFILE_STAGES,
+    PROFILE_TOP,
+)
+
+
+logger = logging.getLogger(__name__)
+
+_etapas: Set[str] = set()
+_directorio = Path(PROFILE_DIR)
+_lock = threading.Lock()
+_activos_memoria = 0
+
+Marco = Tuple[str, int, str]  # (archivo, primera linea, funcion)
+
+
+def configurar(etapas: Optional[Iterable[str]] = None, directorio: Optional[str] = None) -> None:
+    """Define que etapas se perfilan ("all" = todas) y donde se escriben los archivos."""
+    global _etapas, _directorio
+    if etapas is not None:
+        if isinstance(etapas, str):
+            etapas = etapas.split(",")
+        _etapas = {e.strip() for e in etapas if e.strip()}
+    if directorio:
+        _directorio = Path(directorio)
+
+
+def activo(etapa: str) -> bool:
+    return bool(_etapas) and ("all" in _etapas or etapa in _etapas)
+
+
+class _Muestreador(threading.Thread):
+    def __init__(self, hilo_id: int, intervalo_s: float):
+        super().__init__(name="perfilado", daemon=True)
+        self.hilo_id = hilo_id
+        self.intervalo_s = intervalo_s
+        self.pilas: Counter = Counter()
+        self.lineas: Counter = Counter()  # hoja (archivo, linea, funcion): tiempo propio
+        self.muestras = 0
+        self._fin = threading.Event()
+
+    def run(self):
+        while not self._fin.wait(self.intervalo_s):
+            marco = sys._current_frames().get(self.hilo_id)
+            if marco is None:
+                continue
+            self.lineas[(marco.f_code.co_filename, marco.f_lineno, marco.f_code.co_name)] += 1
+            pila = []
+            while marco is not None:
+                codigo = marco.f_code
+                pila.append((codigo.co_filename, codigo.co_firstlineno, codigo.co_name))
+                marco = marco.f_back
+            self.pilas[tuple(reversed(pila))] += 1
+            self.muestras += 1
+
+    def detener(self):
+        self._fin.set()
+        self.join()
+
+
+def _nombre(marco: Marco) -> str:
+    archivo, linea, funcion = marco
+    return f"{funcion} ({Path(archivo).name}:{linea})"
+
+
+def _porcentaje(n: int, total: int) -> str:
+    return f"{100.0 * n / total:5.1f}%" if total else "  -  "
+
+
+def _resumen(etapa: str, duracion: float, muestreador: _Muestreador, memoria) -> str:
+    total = muestreador.muestras
+    lineas = [
+        f"Etapa: {etapa}",
+        f"Duracion: {duracion:.2f} s | muestras: {total} (cada {PROFILE_INTERVAL_MS} ms)",
+        "",
+        f"Top {PROFILE_TOP} por tiempo propio (linea en ejecucion):",
+    ]
+    for marco, n in muestreador.lineas.most_common(PROFILE_TOP):
+        lineas.append(f"  {_porcentaje(n, total)} {n:>7}  {_nombre(marco)}")
+
+    acumulado: Counter = Counter()
+    for pila, n in muestreador.pilas.items():
+        for marco in set(pila):  # recursion: una vez por muestra
+            acumulado[marco] += n
+    lineas += ["", f"Top {PROFILE_TOP} por tiempo acumulado (funcion en la pila):"]
+    for marco, n in acumulado.most_common(PROFILE_TOP):
+        lineas.append(f"  {_porcentaje(n, total)} {n:>7}  {_nombre(marco)}")
+
+    if memoria is not None:
+        pico, diferencias = memoria
+        lineas += ["", f"Memoria (tracemalloc): pico {pico / 1e6:.1f} MB", f"Top {PROFILE_TOP} asignaciones netas:"]
+        for stat in diferencias[:PROFILE_TOP]:
+            origen = stat.traceback[0]
+            lineas.append(
+                f"  {stat.size_diff / 1e6:+9.2f} MB {stat.count_diff:+9d} bloques  "
+                f"{Path(origen.filename).name}:{origen.lineno}"
+            )
+    return "\n".join(lineas) + "\n"
+
+
+def _iniciar_memoria():
+    global _activos_memoria
+    with _lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _activos_memoria += 1
+        tracemalloc.reset_peak()
+    return tracemalloc.take_snapshot()
+
+
+def _terminar_memoria(inicial):
+    global _activos_memoria
+    final = tracemalloc.take_snapshot()
+    _, pico = tracemalloc.get_traced_memory()
+    with _lock:
+        _activos_memoria -= 1
+        if _activos_memoria == 0:
+            tracemalloc.stop()
+    filtros = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    diferencias = final.filter_traces(filtros).compare_to(inicial.filter_traces(filtros), "lineno")
+    return pico, diferencias
+
+
+@contextmanager
+def perfilar(etapa: str, prefijo: str = ""):
+    """Perfila el bloque si la etapa esta activada; si no, no hace nada."""
+    if not activo(etapa):
+        yield
+        return
+
+    muestreador = _Muestreador(threading.get_ident(), PROFILE_INTERVAL_MS / 1000.0)
+    inicial = _iniciar_memoria() if PROFILE_MEMORY else None
+    muestreador.start()
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        muestreador.detener()
+        memoria = _terminar_memoria(inicial) if inicial is not None else None
+        try:
+            _guardar(etapa, prefijo, duracion, muestreador, memoria)
+        except Exception:
+            logger.exception("[PROFILE] No se pudo guardar el perfil de '%s'", etapa)
+
+
+def _guardar(etapa: str, prefijo: str, duracion: float, muestreador: _Muestreador, memoria) -> None:
+    _directorio.mkdir(parents=True, exist_ok=True)
+    base = _directorio / (f"{prefijo}_{etapa}" if prefijo else etapa)
+    with open(base.with_suffix(".folded"), "w", encoding="utf-8") as f:
+        for pila, n in muestreador.pilas.most_common():
+            f.write(";".join(_nombre(m).replace(";", ",") for m in pila) + f" {n}\n")
+    base.with_suffix(".txt").write_text(_resumen(etapa, duracion, muestreador, memoria), encoding="utf-8")
+    logger.info("[PROFILE] '%s': %d muestras en %.1f s -> %s.{txt,folded}", etapa, muestreador.muestras, duracion, base)
+
+
+configurar(PROFILE_STAGES)
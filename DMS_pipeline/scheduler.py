@@ -1,35 +1,65 @@
-"""Programador simple que ejecuta el pipeline de ingesta de datos periodicamente."""
+"""Programador simple que ejecuta el pipeline de ingesta de datos periodicamente.
+
+Cada ciclo pasa por la cola de estudios en Mongo (mongo/cola.py): encola los
+estudios de Orthanc que la cola todavia no tiene y procesa a lo sumo
+SCHEDULER_MAX_STUDIES, los mas recientes primero con la cuota de backfill
+(WORKER_BACKFILL_SHARE), en lotes de WORKER_BATCH como un worker mas. Un
+ciclo nunca es un scan completo: los examenes del dia no esperan detras del
+atraso y, entre lote y lote, la ingesta por evento toma el launcher. Con
+max_estudios=0 el ciclo solo encola (disparador.py --cola: procesan los
+workers de worker.py).
+"""
+import argparse
 import logging
+import os
+import socket
 import time #controlar el tiempo de espera
 
 import schedule
 
-from launcher import main as run_launcher 
-from config import config
+from launcher import agregar_argumentos_perfilado, aplicar_argumentos_perfilado
+from config import SCHEDULER_MAX_STUDIES, WORKER_BATCH, config
+import worker
 
 logger = logging.getLogger(__name__)
 
-def _run_launcher_job():
-    """Envoltor o Wrapper que ejecuta el launcher y registra el resultado."""
+def _run_launcher_job(max_estudios: int = SCHEDULER_MAX_STUDIES):
+    """Envoltor o Wrapper que encola lo que falta, procesa hasta `max_estudios` de la cola y registra el resultado."""
+    if max_estudios <= 0:
+        try:
+            logger.info("%d estudio(s) nuevos encolados", worker.encolar_faltantes(origen="scheduler"))
+        except Exception:
+            logger.exception("No se pudieron encolar los estudios faltantes")
+        return
     logger.info("Ejecutando launcher...")
     try:
-        run_launcher() 
+        encolados = worker.encolar_faltantes(origen="scheduler")
+        if encolados:
+            logger.info("%d estudio(s) nuevos encolados", encolados)
+        nodo = f"scheduler:{socket.gethostname()}:{os.getpid()}"
+        procesados = 0
+        while procesados < max_estudios:
+            reclamos = worker.reclamar_lote(nodo, min(WORKER_BATCH, max_estudios - procesados))
+            if not reclamos:
+                break
+            worker.procesar_lote(nodo, reclamos, origen="scheduler")
+            procesados += len(reclamos)
     except Exception: 
         logger.exception("Launcher finalizó con errores")
     else:
-        logger.info("Launcher finalizó correctamente")
+        logger.info("Launcher finalizó correctamente (%d estudio(s) de la cola)", procesados)
 
 
-def start_scheduler(interval_minutes: int, run_on_start: bool = True):
-    """Programa el trabajo del launcher para que se ejecute cada x minutos."""
+def start_scheduler(interval_minutes: int, run_on_start: bool = True, max_estudios: int = SCHEDULER_MAX_STUDIES):
+    """Programa el trabajo del launcher para que se ejecute cada x minutos (max_estudios=0: solo encolar)."""
     if interval_minutes <= 0:
         raise ValueError("El intervalo debe ser mayor que cero")
 
     if run_on_start:
-        _run_launcher_job()
+        _run_launcher_job(max_estudios)
 
     """Crea un job que se ejecuta cada x minutos. Indica que ejecutar"""
-    schedule.every(interval_minutes).minutes.do(_run_launcher_job) 
+    schedule.every(interval_minutes).minutes.do(_run_launcher_job, max_estudios) 
     logger.info(
         "Scheduler iniciado. El launcher se ejecutará cada %s minutos",
         interval_minutes,
@@ -44,6 +74,10 @@ def start_scheduler(interval_minutes: int, run_on_start: bool = True):
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Ejecuta el pipeline de ingesta periodicamente")
+    agregar_argumentos_perfilado(parser)
+    aplicar_argumentos_perfilado(parser.parse_args())
+
     logging.basicConfig(
         level=logging.INFO,
         format="%(asctime)s - %(levelname)s - %(message)s",
@@ -0,0 +1,244 @@
+"""
+Telemetria de cada corrida del pipeline, por etapa.
+
+El launcher abre una `Corrida` y ejecuta cada etapa dentro de
+`corrida.etapa(nombre)`. La etapa en curso vive en un ContextVar (una por
+hilo del pool), asi que el codigo de las etapas solo llama a `contar(...)`
+sin recibir nada: fuera de una corrida (p. ej. `python -m headers.run_header`)
+esas llamadas no hacen nada.
+
+Por etapa se registra:
+- wall_s y cpu_s (CPU del hilo de la etapa; los hilos internos de torch en
+  el OCR no se cuentan aqui, si en el cpu_s total de la corrida),
+- estudios/series revisados, procesados y omitidos,
+- requests y bytes a Orthanc (event hooks de httpx en el cliente pyorthanc),
+  reintentos y segundos de espera por el limite de concurrencia/tasa
+  (orthanc/acceso.py),
+- aciertos, fallos y MB leidos de la cache local de DICOM (orthanc/cache.py),
+- tiempo de inferencia OCR, documentos escritos y sin cambios en Mongo,
+- rss_pico_mb: RSS maxima del proceso mientras corria la etapa, muestreada
+  cada INTERVALO_RSS_S (las etapas en paralelo comparten el proceso: cada
+  una ve el pico de todo lo que corria a la vez); sin /proc, el pico
+  historico del proceso (ru_maxrss),
+- estudios_fallidos: los estudios que el extractor no pudo procesar
+  (`fallo_estudio`); la etapa sigue con el resto y queda "ok", asi que el
+  worker y el backfill miran este campo para reintentarlos.
+
+El reporte se guarda en la coleccion COL_RUNS (un documento por corrida)
+y se escribe en el log como una linea JSON.
+"""
+
+import json
+import logging
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from threading import Lock
+from typing import Any, Dict, List, Optional, Set
+
+
+logger = logging.getLogger(__name__)
+
+CONTADORES = (
+    "estudios_revisados",
+    "estudios_procesados",
+    "estudios_omitidos",
+    "series_revisadas",
+    "series_procesadas",
+    "series_omitidas",
+    "orthanc_requests",
+    "orthanc_bytes",
+    "orthanc_reintentos",
+    "orthanc_espera_s",
+    "orthanc_memo_ahorradas",
+    "cache_aciertos",
+    "cache_fallos",
+    "cache_mb_leidos",
+    "ocr_inferencia_s",
+    "docs_escritos",
+    "docs_sin_cambios",
+)
+
+INTERVALO_RSS_S = 0.5
+
+
+class MedicionEtapa:
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self.estado = "ok"
+        self.contadores: Dict[str, float] = dict.fromkeys(CONTADORES, 0)
+        self.fallidos: Dict[str, str] = {}  # study_id -> error
+        self.rss_pico_mb: Optional[float] = None
+        self._lock = Lock()  # los hooks de httpx pueden llegar desde otro hilo del mismo cliente
+
+    def sumar(self, campo: str, valor: float = 1) -> None:
+        with self._lock:
+            self.contadores[campo] = self.contadores.get(campo, 0) + valor
+
+    def fallo(self, study_id: str, error: str) -> None:
+        with self._lock:
+            self.fallidos.setdefault(study_id, error)
+
+    def rss(self, mb: Optional[float]) -> None:
+        if mb is None:
+            return
+        with self._lock:
+            if self.rss_pico_mb is None or mb > self.rss_pico_mb:
+                self.rss_pico_mb = mb
+
+
+_ETAPA: ContextVar[Optional[MedicionEtapa]] = ContextVar("etapa_pipeline", default=None)
+
+
+def contar(campo: str, valor: float = 1) -> None:
+    """Suma `valor` al contador de la etapa en curso (si hay una)."""
+    etapa = _ETAPA.get()
+    if etapa is not None:
+        etapa.sumar(campo, valor)
+
+
+def fallo_estudio(study_id: str, error: Any) -> None:
+    """Registra que `study_id` fallo en la etapa en curso (si hay una)."""
+    etapa = _ETAPA.get()
+    if etapa is not None:
+        etapa.fallo(study_id, repr(error) if isinstance(error, BaseException) else str(error))
+
+
+@contextmanager
+def cronometrar(campo: str):
+    """Suma la duracion del bloque (segundos) al contador `campo`."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        contar(campo, time.perf_counter() - inicio)
+
+
+def _respuesta_orthanc(response) -> None:
+    contar("orthanc_requests")
+    contar("orthanc_bytes", int(response.headers.get("content-length") or 0))
+
+
+# Para pyorthanc.Orthanc(..., event_hooks=HOOKS_HTTPX)
+HOOKS_HTTPX = {"response": [_respuesta_orthanc]}
+
+
+def _rss_pico_mb() -> float:
+    # ru_maxrss viene en KB en Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _rss_mb() -> Optional[float]:
+    """RSS actual del proceso (Linux, /proc); None si no se puede leer."""
+    try:
+        with open("/proc/self/statm") as f:
+            paginas = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(paginas * resource.getpagesize() / 2**20, 1)
+
+
+class Corrida:
+    def __init__(self, origen: str = "manual", estudios: Optional[List[str]] = None):
+        self.origen = origen
+        self.estudios = estudios  # IDs de Orthanc si la corrida no fue completa
+        self.orthanc: Optional[Dict[str, Any]] = None  # metricas del acceso a Orthanc al terminar
+        self.cache_dicom: Optional[Dict[str, Any]] = None  # estadisticas de la cache local de DICOM
+        self.inicio = datetime.utcnow()
+        self._t0 = time.perf_counter()
+        self._cpu0 = time.process_time()
+        self.etapas: List[Dict[str, Any]] = []
+        self._lock = Lock()
+        self._activas: Set[MedicionEtapa] = set()
+        self._muestreo: Optional[threading.Thread] = None
+
+    def _muestrear(self) -> None:
+        """Hilo que suma la RSS al pico de las etapas activas; termina cuando no queda ninguna."""
+        while True:
+            time.sleep(INTERVALO_RSS_S)
+            mb = _rss_mb()
+            with self._lock:
+                if not self._activas:
+                    self._muestreo = None
+                    return
+                for medicion in self._activas:
+                    medicion.rss(mb)
+
+    @contextmanager
+    def etapa(self, nombre: str):
+        """Mide la etapa; quien la ejecuta marca `medicion.estado = "error"` si falla."""
+        medicion = MedicionEtapa(nombre)
+        medicion.rss(_rss_mb())
+        with self._lock:
+            self._activas.add(medicion)
+            if self._muestreo is None:
+                self._muestreo = threading.Thread(target=self._muestrear, name="telemetria-rss", daemon=True)
+                self._muestreo.start()
+        token = _ETAPA.set(medicion)
+        inicio = datetime.utcnow()
+        t0 = time.perf_counter()
+        cpu0 = time.thread_time()
+        try:
+            yield medicion
+        except BaseException:
+            medicion.estado = "error"
+            raise
+        finally:
+            _ETAPA.reset(token)
+            medicion.rss(_rss_mb())
+            with self._lock:
+                self._activas.discard(medicion)
+            reporte = {
+                "nombre": nombre,
+                "estado": medicion.estado,
+                "inicio": inicio,
+                "wall_s": round(time.perf_counter() - t0, 3),
+                "cpu_s": round(time.thread_time() - cpu0, 3),
+                "rss_pico_mb": medicion.rss_pico_mb if medicion.rss_pico_mb is not None else _rss_pico_mb(),
+            }
+            for campo, valor in medicion.contadores.items():
+                reporte[campo] = round(valor, 3) if isinstance(valor, float) else valor
+            if medicion.fallidos:
+                reporte["estudios_fallidos"] = dict(medicion.fallidos)
+            with self._lock:
+                self.etapas.append(reporte)
+
+    def reporte(self) -> Dict[str, Any]:
+        errores = [e["nombre"] for e in self.etapas if e["estado"] != "ok"]
+        picos = [e["rss_pico_mb"] for e in self.etapas]
+        fallidos: Dict[str, str] = {}
+        for etapa in sorted(self.etapas, key=lambda e: e["inicio"]):
+            for study_id, error in etapa.get("estudios_fallidos", {}).items():
+                fallidos.setdefault(study_id, f"{etapa['nombre']}: {error}")
+        reporte = {
+            "origen": self.origen,
+            "inicio": self.inicio,
+            "fin": datetime.utcnow(),
+            "estado": "con_errores" if errores else "ok",
+            "etapas_con_error": errores,
+            "estudios_fallidos": fallidos,  # study_id -> "etapa: error"
+            "wall_s": round(time.perf_counter() - self._t0, 3),
+            "cpu_s": round(time.process_time() - self._cpu0, 3),
+            "rss_pico_mb": max(picos) if picos else _rss_pico_mb(),
+            "etapas": sorted(self.etapas, key=lambda e: e["inicio"]),
+        }
+        if self.estudios is not None:
+            reporte["estudios"] = self.estudios
+        if self.orthanc is not None:
+            reporte["orthanc"] = self.orthanc
+        if self.cache_dicom is not None:
+            reporte["cache_dicom"] = self.cache_dicom
+        return reporte
+
+    def guardar(self, db, coleccion: str) -> Dict[str, Any]:
+        """Registra el reporte en el log y en Mongo (un fallo al guardar no interrumpe nada)."""
+        reporte = self.reporte()
+        logger.info("[RUN] %s", json.dumps(reporte, default=str, ensure_ascii=False))
+        try:
+            db[coleccion].insert_one(dict(reporte))
+        except Exception:
+            logger.exception("No se pudo guardar la telemetría de la corrida en '%s'", coleccion)
+        return reporte
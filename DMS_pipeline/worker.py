@@ -0,0 +1,206 @@
+"""
+Modo worker: varios procesos (en uno o varios hosts) comparten el trabajo.
+
+Los estudios a procesar viven en la cola COL_QUEUE de MongoDB (ver
+mongo/cola.py). Cada worker reclama hasta WORKER_BATCH estudios con un lease
+de WORKER_LEASE_SECONDS (los de fecha de adquisicion mas reciente primero,
+con una fraccion WORKER_BACKFILL_SHARE para los mas antiguos), los procesa
+con `launcher.procesar_estudios`, renueva los leases cada tercio del plazo
+mientras tanto y al terminar los marca hechos, o los devuelve a la cola con
+el error (hasta WORKER_MAX_ATTEMPTS intentos): todo el lote si fallo una
+etapa, o solo los estudios que un extractor no pudo procesar
+(estudios_fallidos del reporte, p. ej. Orthanc caido o con el circuito
+abierto). Si un worker muere, sus estudios se reclaman al vencer el lease.
+
+Sumar un host es lanzar otro worker contra el mismo Orthanc y Mongo: los
+reclamos son atomicos, asi que ningun estudio se reparte dos veces. Los
+limites de Orthanc son por proceso: ORTHANC_PROCESSES debe ser la cantidad
+total de workers (ver orthanc/acceso.py).
+
+Uso (desde DMS_pipeline/):
+    python worker.py                                   # procesar la cola
+    python worker.py encolar <study_id> [<study_id> ...]
+    python worker.py encolar --desde 2024-01-01 --hasta 2024-01-31
+    python worker.py estado
+Los avisos de Orthanc se encolan con `python disparador.py --cola`.
+"""
+
+import argparse
+import logging
+import os
+import socket
+import threading
+from typing import Dict, List, Optional, Set
+
+from config import (
+    COL_QUEUE,
+    WORKER_BACKFILL_SHARE,
+    WORKER_BATCH,
+    WORKER_LEASE_SECONDS,
+    WORKER_MAX_ATTEMPTS,
+    WORKER_NODE,
+    WORKER_POLL_SECONDS,
+)
+from mongo import cola
+from mongo.mongo_uploader import db
+
+
+logger = logging.getLogger(__name__)
+
+CUOTA = cola.CuotaBackfill(WORKER_BACKFILL_SHARE)
+
+
+class _Latido(threading.Thread):
+    """Renueva los leases de los estudios en proceso hasta que se detiene."""
+
+    def __init__(self, reclamos: Dict[str, int], lease_s: float):
+        super().__init__(name="latido", daemon=True)
+        self.reclamos = dict(reclamos)  # study_id -> token
+        self.lease_s = lease_s
+        self.perdidos: Set[str] = set()
+        self._fin = threading.Event()
+
+    def run(self):
+        while not self._fin.wait(self.lease_s / 3):
+            for study_id, token in list(self.reclamos.items()):
+                try:
+                    vigente = cola.renovar(db, COL_QUEUE, study_id, token, self.lease_s)
+                except Exception:
+                    logger.exception("[WORKER] No se pudo renovar el lease de %s", study_id)
+                    continue
+                if not vigente:
+                    logger.warning("[WORKER] Lease perdido: %s (lo tomó otro nodo)", study_id)
+                    del self.reclamos[study_id]
+                    self.perdidos.add(study_id)
+
+    def detener(self):
+        self._fin.set()
+        self.join()
+
+
+def reclamar_lote(nodo: str, maximo: int = WORKER_BATCH) -> Dict[str, int]:
+    """Reclama hasta `maximo` estudios. Devuelve study_id -> token del reclamo."""
+    reclamos: Dict[str, int] = {}
+    while len(reclamos) < maximo:
+        doc = cola.reclamar(db, COL_QUEUE, nodo, WORKER_LEASE_SECONDS, WORKER_MAX_ATTEMPTS,
+                            backfill=CUOTA.toca_backfill())
+        if doc is None:
+            break
+        reclamos[doc["_id"]] = doc["token"]
+        if doc["intentos"] > 1:
+            logger.info("[WORKER] Reintento %d de %s", doc["intentos"], doc["_id"])
+    return reclamos
+
+
+def procesar_lote(nodo: str, reclamos: Dict[str, int], origen: Optional[str] = None) -> None:
+    import launcher  # diferido: `encolar` y `estado` no cargan el pipeline
+
+    latido = _Latido(reclamos, WORKER_LEASE_SECONDS)
+    latido.start()
+    error = None
+    fallidos: Dict[str, str] = {}
+    try:
+        reporte = launcher.procesar_estudios(list(reclamos), origen=origen or f"worker:{nodo}")
+        if reporte["estado"] != "ok":
+            error = f"etapas con error: {', '.join(reporte['etapas_con_error'])}"
+        # Los extractores siguen ante el fallo de un estudio: esos vuelven a la cola
+        fallidos = reporte.get("estudios_fallidos", {})
+    except Exception as exc:
+        logger.exception("[WORKER] Falló el lote %s", list(reclamos))
+        error = repr(exc)
+    finally:
+        latido.detener()
+    if fallidos:
+        logger.warning("[WORKER] %d estudio(s) con error vuelven a la cola: %s", len(fallidos), sorted(fallidos))
+
+    for study_id, token in reclamos.items():
+        if study_id in latido.perdidos:
+            continue
+        motivo = error or fallidos.get(study_id)
+        if motivo is None:
+            vigente = cola.completar(db, COL_QUEUE, study_id, token)
+        else:
+            vigente = cola.liberar(db, COL_QUEUE, study_id, token, motivo, WORKER_MAX_ATTEMPTS)
+        if not vigente:
+            logger.warning("[WORKER] %s ya no pertenece a este nodo: resultado descartado", study_id)
+
+
+def trabajar(nodo: str, detener: Optional[threading.Event] = None) -> None:
+    detener = detener or threading.Event()
+    logger.info("[WORKER] Nodo %s: lote %d, lease %ss", nodo, WORKER_BATCH, WORKER_LEASE_SECONDS)
+    while not detener.is_set():
+        agotados = cola.marcar_agotados(db, COL_QUEUE, WORKER_MAX_ATTEMPTS)
+        if agotados:
+            logger.warning("[WORKER] %d estudio(s) sin intentos restantes marcados como fallidos", agotados)
+        reclamos = reclamar_lote(nodo)
+        if not reclamos:
+            detener.wait(WORKER_POLL_SECONDS)
+            continue
+        logger.info("[WORKER] Procesando %d estudio(s)", len(reclamos))
+        procesar_lote(nodo, reclamos)
+
+
+def encolar_faltantes(origen: str = "respaldo") -> int:
+    """Encola los estudios de Orthanc que la cola no tiene en ningun estado (avisos
+    perdidos, caidas del disparador), con su fecha de adquisicion. Devuelve cuantos."""
+    from fuentes import fuente_orthanc
+
+    fechas = fuente_orthanc().fechas_todas()
+    nuevos = cola.faltantes(db, COL_QUEUE, fechas)
+    if not nuevos:
+        return 0
+    return cola.encolar(db, COL_QUEUE, nuevos, origen=origen, fechas={s: fechas[s] for s in nuevos})
+
+
+def _fechas_en_rango(desde: str, hasta: str) -> Dict[str, str]:
+    """Estudios con StudyDate en el rango -> fecha de adquisicion (una sola /tools/find expandida)."""
+    from fuentes import fecha_adquisicion, fuente_orthanc
+
+    infos = fuente_orthanc().client.post_tools_find(
+        json={"Level": "Study", "Query": {"StudyDate": f"{desde}-{hasta}"}, "Expand": True}
+    )
+    return {info["ID"]: fecha_adquisicion(info.get("MainDicomTags", {})) for info in infos}
+
+
+def _fechas(study_ids: List[str]) -> Dict[str, str]:
+    from fuentes import fuente_orthanc
+
+    return fuente_orthanc().fechas(study_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker del pipeline sobre la cola compartida en MongoDB")
+    sub = parser.add_subparsers(dest="comando")
+    p_encolar = sub.add_parser("encolar", help="agrega estudios a la cola")
+    p_encolar.add_argument("estudios", nargs="*", help="IDs de estudio de Orthanc")
+    p_encolar.add_argument("--desde", help="StudyDate inicial (YYYYMMDD), junto con --hasta")
+    p_encolar.add_argument("--hasta", help="StudyDate final, incluida")
+    sub.add_parser("estado", help="cantidad de estudios por estado")
+    parser.add_argument("--nodo", default=WORKER_NODE or f"{socket.gethostname()}:{os.getpid()}")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(threadName)s - %(name)s - %(message)s",
+    )
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("httpcore").setLevel(logging.WARNING)
+
+    if args.comando == "encolar":
+        fechas = _fechas(list(args.estudios)) if args.estudios else {}
+        if args.desde or args.hasta:
+            fechas.update(_fechas_en_rango((args.desde or "").replace("-", ""), (args.hasta or "").replace("-", "")))
+        estudios = list(args.estudios) + [s for s in fechas if s not in args.estudios]
+        n = cola.encolar(db, COL_QUEUE, estudios, origen="manual", fechas=fechas)
+        logger.info("[WORKER] %d de %d estudio(s) encolados en '%s'", n, len(estudios), COL_QUEUE)
+    elif args.comando == "estado":
+        logger.info("[WORKER] Cola '%s': %s", COL_QUEUE, cola.resumen(db, COL_QUEUE))
+    else:
+        try:
+            trabajar(args.nodo)
+        except KeyboardInterrupt:
+            logger.info("[WORKER] Detenido; los leases en curso vencerán y se reintentarán")
+
+
+if __name__ == "__main__":
+    main()
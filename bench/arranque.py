@@ -0,0 +1,126 @@
+"""
+Tiempo de arranque del pipeline: cuanto tarda importar el launcher y los
+modulos de cada grupo de --stages, cada uno en un proceso nuevo.
+
+Para cada escenario se informa el tiempo de import (minimo de --repeticiones),
+los modulos pesados que quedaron cargados y los hilos vivos (un cliente de
+Mongo o de Orthanc abierto al importar deja hilos de monitoreo). Falla
+(codigo 1) si algun escenario supera --limite-s o si uno que no es el OCR
+carga easyocr, torch, cv2, pandas o sympy. Con --detalle imprime los
+modulos mas lentos segun `python -X importtime`.
+
+No necesita Orthanc ni Mongo: los clientes no se conectan al importar.
+
+Uso:
+    python bench/arranque.py
+    python bench/arranque.py --limite-s 0.8 --repeticiones 5 --salida arranque.json
+    python bench/arranque.py --escenario ct --detalle
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List
+
+
+PIPELINE = Path(__file__).resolve().parent.parent / "DMS_pipeline"
+
+# escenario -> modulos que importa el launcher para correr esas etapas
+ESCENARIOS = {
+    "launcher": ["launcher"],
+    "upload": ["launcher", "mongo.vtl"],
+    "ct": ["launcher", "headers.run_header"],
+    "pet": ["launcher", "headers.run_header"],
+    "ocr": ["launcher", "ocr.run_ocr"],
+}
+PESADOS = ["easyocr", "torch", "cv2", "pandas", "sympy", "pyorthanc", "pydicom", "numpy", "httpx", "pymongo"]
+PROHIBIDOS = {"easyocr", "torch", "cv2", "pandas", "sympy"}  # solo el OCR puede cargarlos (al ejecutarse)
+
+_MEDIR = """
+import json, sys, threading, time
+inicio = time.perf_counter()
+for modulo in {modulos!r}:
+    __import__(modulo)
+segundos = time.perf_counter() - inicio
+print(json.dumps({{
+    "segundos": round(segundos, 4),
+    "pesados": [m for m in {pesados!r} if m in sys.modules],
+    "hilos": sorted(t.name for t in threading.enumerate() if t is not threading.main_thread()),
+}}))
+"""
+
+
+def _entorno() -> Dict[str, str]:
+    entorno = dict(os.environ)
+    # config.py arma la URI de Mongo con partes vacias si no hay ninguna
+    entorno.setdefault("MONGO_URI", "mongodb://localhost:27017")
+    entorno.setdefault("ORTHANC_URL", "http://localhost:8042")
+    return entorno
+
+
+def medir(modulos: List[str]) -> Dict[str, Any]:
+    codigo = _MEDIR.format(modulos=modulos, pesados=PESADOS)
+    salida = subprocess.run(
+        [sys.executable, "-c", codigo], cwd=PIPELINE, env=_entorno(), capture_output=True, text=True,
+    )
+    if salida.returncode != 0:
+        raise RuntimeError(f"No se pudo importar {modulos}:\n{salida.stderr}")
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def detalle(modulos: List[str], top: int = 15) -> List[str]:
+    """Modulos con mayor tiempo acumulado segun -X importtime."""
+    codigo = "".join(f"import {m}\n" for m in modulos)
+    salida = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", codigo], cwd=PIPELINE, env=_entorno(),
+        capture_output=True, text=True,
+    )
+    filas = []
+    for linea in salida.stderr.splitlines():
+        partes = linea.split("|")
+        if len(partes) == 3 and partes[1].strip().isdigit():
+            filas.append((int(partes[1]), partes[2].rstrip()))
+    return [f"{us / 1e6:8.3f} s {nombre}" for us, nombre in sorted(filas, reverse=True)[:top]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de arranque (import) del pipeline por escenario")
+    parser.add_argument("--escenario", action="append", choices=sorted(ESCENARIOS),
+                        help="escenario a medir (repetible; por defecto todos)")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--limite-s", type=float, default=1.0, help="tiempo maximo de import por escenario")
+    parser.add_argument("--detalle", action="store_true", help="modulos mas lentos por escenario")
+    parser.add_argument("--salida", help="guardar el reporte en JSON")
+    args = parser.parse_args()
+
+    reporte: Dict[str, Any] = {}
+    fallas: List[str] = []
+    for nombre in args.escenario or ESCENARIOS:
+        modulos = ESCENARIOS[nombre]
+        medidas = [medir(modulos) for _ in range(max(1, args.repeticiones))]
+        mejor = min(medidas, key=lambda m: m["segundos"])
+        reporte[nombre] = mejor
+        print(f"{nombre:<10} {mejor['segundos']:>7.3f} s  pesados={','.join(mejor['pesados']) or '-'}  "
+              f"hilos={','.join(mejor['hilos']) or '-'}")
+        if args.detalle:
+            for linea in detalle(modulos):
+                print(f"    {linea}")
+        if mejor["segundos"] > args.limite_s:
+            fallas.append(f"{nombre}: {mejor['segundos']:.3f} s > {args.limite_s} s")
+        if nombre != "ocr" and PROHIBIDOS & set(mejor["pesados"]):
+            fallas.append(f"{nombre}: carga {', '.join(sorted(PROHIBIDOS & set(mejor['pesados'])))}")
+
+    if args.salida:
+        Path(args.salida).write_text(json.dumps(reporte, indent=2, ensure_ascii=False))
+    if fallas:
+        print("\nArranque fuera de limite:")
+        for falla in fallas:
+            print(f"  - {falla}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Prueba de carga de la API: concurrencia controlada y reporte de latencias.
+
+Cada worker elige un endpoint (segun pesos) y lo pide en bucle durante
+`--duracion` segundos. Al final se informa por endpoint: requests, errores,
+p50/p95/p99, throughput y bytes; con `--pid` tambien la memoria (RSS)
+maxima del proceso del servidor durante la prueba.
+
+Uso:
+    python bench/carga.py --url http://localhost:8000 --concurrencia 16 --duracion 30
+    python bench/carga.py -e "/ct?limit=500" -e "/pet" -e "/" --pid $(pgrep -f uvicorn) --salida hoy.json
+    python bench/carga.py --base ayer.json --tolerancia 0.2   # falla si algun p95 empeora mas de 20%
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+
+ENDPOINTS_POR_DEFECTO = ["/ct", "/ocr", "/pet", "/"]
+
+
+def percentil(valores: List[float], p: float) -> Optional[float]:
+    """Percentil por rango mas cercano sobre una lista ya ordenada."""
+    if not valores:
+        return None
+    indice = max(0, min(len(valores) - 1, math.ceil(p / 100 * len(valores)) - 1))
+    return valores[indice]
+
+
+def rss_kb(pid: int) -> Optional[int]:
+    """Memoria residente del proceso (Linux, /proc)."""
+    try:
+        for linea in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if linea.startswith("VmRSS:"):
+                return int(linea.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+class Resultado:
+    def __init__(self):
+        self.latencias: List[float] = []
+        self.errores = 0
+        self.bytes = 0
+        self.estados: Dict[int, int] = {}
+
+
+async def _worker(cliente: httpx.AsyncClient, endpoints: List[str], pesos: List[float],
+                  resultados: Dict[str, Resultado], fin: float, rng: random.Random):
+    while time.perf_counter() < fin:
+        endpoint = rng.choices(endpoints, weights=pesos)[0]
+        res = resultados[endpoint]
+        inicio = time.perf_counter()
+        try:
+            respuesta = await cliente.get(endpoint)
+            cuerpo = respuesta.content  # incluye la descarga completa del cuerpo
+        except httpx.HTTPError:
+            res.errores += 1
+            continue
+        res.latencias.append(time.perf_counter() - inicio)
+        res.bytes += len(cuerpo)
+        res.estados[respuesta.status_code] = res.estados.get(respuesta.status_code, 0) + 1
+        if respuesta.status_code >= 400:
+            res.errores += 1
+
+
+async def _muestrear_memoria(pid: int, fin: float, muestras: List[int]):
+    while time.perf_counter() < fin:
+        valor = rss_kb(pid)
+        if valor is not None:
+            muestras.append(valor)
+        await asyncio.sleep(0.5)
+
+
+async def correr(url: str, endpoints: List[str], pesos: List[float], concurrencia: int,
+                 duracion: float, calentamiento: float, pid: Optional[int], timeout: float) -> Dict[str, Any]:
+    limites = httpx.Limits(max_connections=concurrencia, max_keepalive_connections=concurrencia)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limites) as cliente:
+        if calentamiento > 0:
+            descarte = {e: Resultado() for e in endpoints}
+            fin = time.perf_counter() + calentamiento
+            await asyncio.gather(*(
+                _worker(cliente, endpoints, pesos, descarte, fin, random.Random(i)) for i in range(concurrencia)
+            ))
+
+        resultados = {e: Resultado() for e in endpoints}
+        memoria: List[int] = []
+        rss_inicial = rss_kb(pid) if pid else None
+        inicio = time.perf_counter()
+        fin = inicio + duracion
+        tareas = [_worker(cliente, endpoints, pesos, resultados, fin, random.Random(1000 + i)) for i in range(concurrencia)]
+        if pid:
+            tareas.append(_muestrear_memoria(pid, fin, memoria))
+        await asyncio.gather(*tareas)
+        transcurrido = time.perf_counter() - inicio
+
+    reporte: Dict[str, Any] = {
+        "url": url,
+        "concurrencia": concurrencia,
+        "duracion_s": round(transcurrido, 2),
+        "endpoints": {},
+    }
+    total = 0
+    for endpoint, res in resultados.items():
+        lat = sorted(res.latencias)
+        total += len(lat)
+        reporte["endpoints"][endpoint] = {
+            "requests": len(lat),
+            "errores": res.errores,
+            "estados": res.estados,
+            "rps": round(len(lat) / transcurrido, 2),
+            "p50_ms": _ms(percentil(lat, 50)),
+            "p95_ms": _ms(percentil(lat, 95)),
+            "p99_ms": _ms(percentil(lat, 99)),
+            "max_ms": _ms(lat[-1] if lat else None),
+            "mb_por_s": round(res.bytes / transcurrido / 1e6, 2),
+        }
+    reporte["rps_total"] = round(total / transcurrido, 2)
+    if pid:
+        reporte["rss_inicial_mb"] = round(rss_inicial / 1024, 1) if rss_inicial else None
+        reporte["rss_max_mb"] = round(max(memoria) / 1024, 1) if memoria else None
+    return reporte
+
+
+def _ms(segundos: Optional[float]) -> Optional[float]:
+    return round(segundos * 1000, 1) if segundos is not None else None
+
+
+def imprimir(reporte: Dict[str, Any]) -> None:
+    print(f"\n{reporte['url']}  concurrencia={reporte['concurrencia']}  duracion={reporte['duracion_s']}s")
+    print(f"{'endpoint':<40} {'req':>7} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'MB/s':>7}")
+    for endpoint, r in reporte["endpoints"].items():
+        print(
+            f"{endpoint:<40} {r['requests']:>7} {r['errores']:>5} {r['rps']:>8} "
+            f"{_txt(r['p50_ms']):>8} {_txt(r['p95_ms']):>8} {_txt(r['p99_ms']):>8} {r['mb_por_s']:>7}"
+        )
+    print(f"Total: {reporte['rps_total']} req/s")
+    if "rss_max_mb" in reporte:
+        print(f"Memoria del servidor: {reporte['rss_inicial_mb']} MB al inicio, {reporte['rss_max_mb']} MB maximo")
+
+
+def _txt(valor: Optional[float]) -> str:
+    return "-" if valor is None else f"{valor:.1f}"
+
+
+def comparar(reporte: Dict[str, Any], base: Dict[str, Any], tolerancia: float) -> List[str]:
+    """Endpoints cuyo p95 empeoro mas que `tolerancia` (fraccion) respecto de la base."""
+    regresiones = []
+    for endpoint, actual in reporte["endpoints"].items():
+        previo = base.get("endpoints", {}).get(endpoint)
+        if not previo or not previo.get("p95_ms") or actual.get("p95_ms") is None:
+            continue
+        if actual["p95_ms"] > previo["p95_ms"] * (1 + tolerancia):
+            regresiones.append(f"{endpoint}: p95 {previo['p95_ms']} ms -> {actual['p95_ms']} ms")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("-e", "--endpoint", action="append", dest="endpoints",
+                        help="ruta a pedir, opcionalmente con peso: '/ct?limit=100@3' (repetible)")
+    parser.add_argument("--concurrencia", type=int, default=8)
+    parser.add_argument("--duracion", type=float, default=30, help="segundos de medicion")
+    parser.add_argument("--calentamiento", type=float, default=3, help="segundos previos sin medir")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--pid", type=int, help="PID del servidor para medir memoria (RSS)")
+    parser.add_argument("--salida", help="guardar el reporte en JSON")
+    parser.add_argument("--base", help="reporte JSON previo para detectar regresiones")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="empeoramiento de p95 permitido (fraccion)")
+    args = parser.parse_args()
+
+    endpoints, pesos = [], []
+    for spec in args.endpoints or ENDPOINTS_POR_DEFECTO:
+        ruta, _, peso = spec.partition("@")
+        endpoints.append(ruta)
+        pesos.append(float(peso or 1))
+
+    reporte = asyncio.run(correr(
+        args.url, endpoints, pesos, args.concurrencia, args.duracion, args.calentamiento, args.pid, args.timeout,
+    ))
+    imprimir(reporte)
+    if args.salida:
+        Path(args.salida).write_text(json.dumps(reporte, indent=2, ensure_ascii=False))
+
+    if args.base:
+        regresiones = comparar(reporte, json.loads(Path(args.base).read_text()), args.tolerancia)
+        for linea in regresiones:
+            print(f"[REGRESION] {linea}")
+        if regresiones:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Genera datos sinteticos con la forma real de series_ct, series_pet1 y
+dose_report para pruebas de carga de la API.
+
+Cada estudio CT tiene su reporte de dosis OCR (mismo StudyInstanceUID y
+nombre de paciente) y varias series con el diccionario completo de tags
+(formato /instances/{id}/tags de Orthanc). Los estudios PET llevan
+pet_quality y la secuencia de radiofarmaco.
+
+Uso:
+    python bench/generar_datos.py --uri mongodb://localhost:27017/DMSBench --estudios 20000 --pet 5000 --limpiar
+
+Para poblar tambien la coleccion VTL, despues correr desde DMS_pipeline/
+con MONGO_URI apuntando a la misma base:
+    python -m mongo.vtl
+"""
+
+import argparse
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List
+
+import pymongo
+
+
+logger = logging.getLogger(__name__)
+
+NOMBRES = ["PEREZ", "GONZALEZ", "MUNOZ", "ROJAS", "DIAZ", "SOTO", "CONTRERAS", "SILVA", "MARTINEZ", "SEPULVEDA"]
+PILA = ["JUAN", "MARIA", "JOSE", "ANA", "LUIS", "CAROLINA", "PEDRO", "CAMILA", "JORGE", "FRANCISCA"]
+PROTOCOLOS_CT = [
+    ("10.1 PET CT", "CTAC"),
+    ("10.2 MELANOMA", "CTAC"),
+    ("10.5 LOCALIZADO", "CTAC 3.75"),
+    ("5.1 TORAX", "TORAX"),
+]
+PROTOCOLOS_PET = ["PET FDG CUERPO", "PET PSMA", "PET FDG CEREBRO"]
+
+
+def _uid(rng: random.Random) -> str:
+    return "1.2.840.113619.2.55." + ".".join(str(rng.randint(1, 10**9)) for _ in range(3))
+
+
+def _tag(nombre: str, valor: Any, tipo: str = "String") -> Dict[str, Any]:
+    return {"Name": nombre, "Type": tipo, "Value": valor}
+
+
+def _relleno(rng: random.Random, cantidad: int) -> Dict[str, Any]:
+    """Tags adicionales para que el documento tenga el tamano de uno real."""
+    tags = {}
+    for i in range(cantidad):
+        grupo = rng.choice(("0018", "0020", "0028", "0040", "0043", "0045"))
+        tags[f"{grupo},{0x1000 + i:04x}"] = _tag(f"Tag{i}", f"{rng.random():.6f}\\{rng.randint(0, 4096)}")
+    return tags
+
+
+def _tags_comunes(p: Dict[str, Any], serie: Dict[str, Any], rng: random.Random, relleno: int) -> Dict[str, Any]:
+    fecha = p["fecha"].strftime("%Y%m%d")
+    hora = p["fecha"].strftime("%H%M%S") + ".000000"
+    tags = _relleno(rng, relleno)
+    tags.update({
+        "0008,0018": _tag("SOPInstanceUID", serie["sop_uid"]),
+        "0008,0020": _tag("StudyDate", fecha),
+        "0008,0021": _tag("SeriesDate", fecha),
+        "0008,0030": _tag("StudyTime", hora),
+        "0008,0031": _tag("SeriesTime", hora),
+        "0008,0032": _tag("AcquisitionTime", hora),
+        "0008,0060": _tag("Modality", serie["modalidad"]),
+        "0008,0070": _tag("Manufacturer", "GE MEDICAL SYSTEMS"),
+        "0008,1030": _tag("StudyDescription", p["protocolo"]),
+        "0008,103e": _tag("SeriesDescription", serie["descripcion"]),
+        "0010,0010": _tag("PatientName", p["nombre"]),
+        "0010,0020": _tag("PatientID", p["id"]),
+        "0010,1030": _tag("PatientWeight", str(p["peso"])),
+        "0018,1030": _tag("ProtocolName", p["protocolo"]),
+        "0020,000d": _tag("StudyInstanceUID", p["study_uid"]),
+        "0020,000e": _tag("SeriesInstanceUID", serie["uid"]),
+        "0020,0011": _tag("SeriesNumber", str(serie["numero"])),
+    })
+    return tags
+
+
+def _paciente(rng: random.Random, inicio: datetime, dias: int, protocolo: str) -> Dict[str, Any]:
+    return {
+        "nombre": f"{rng.choice(NOMBRES)}^{rng.choice(NOMBRES)}^{rng.choice(PILA)}",
+        "id": str(rng.randint(10**6, 10**7)),
+        "peso": round(rng.gauss(72, 14), 1),
+        "fecha": inicio + timedelta(days=rng.randrange(dias), minutes=rng.randrange(8 * 60, 19 * 60)),
+        "study_uid": _uid(rng),
+        "protocolo": protocolo,
+    }
+
+
+def _serie_doc(p: Dict[str, Any], serie: Dict[str, Any], rng: random.Random, relleno: int) -> Dict[str, Any]:
+    return {
+        "patient": {"patient_name": p["nombre"]},
+        "study": {"study_instance_uid": p["study_uid"], "study_description": p["protocolo"]},
+        "series": {
+            "series_instance_uid": serie["uid"],
+            "modality": serie["modalidad"],
+            "series_number": serie["numero"],
+        },
+        "first_instance": {
+            "sop_instance_uid": serie["sop_uid"],
+            "dicom_tags": _tags_comunes(p, serie, rng, relleno),
+        },
+    }
+
+
+def estudio_ct(rng: random.Random, inicio: datetime, dias: int, exam_no: int, relleno: int):
+    """(documentos de series CT, reporte OCR) de un estudio."""
+    protocolo, descripcion = rng.choice(PROTOCOLOS_CT)
+    p = _paciente(rng, inicio, dias, protocolo)
+    series, filas = [], [{"Serie": "1", "Type": "Scout", "ScanRange": "-", "CTDIvol": "-", "DLP": "-", "Phantom": "-"}]
+    for numero in range(2, 2 + rng.randint(1, 4)):
+        serie = {"uid": _uid(rng), "sop_uid": _uid(rng), "numero": numero, "modalidad": "CT", "descripcion": descripcion}
+        series.append(_serie_doc(p, serie, rng, relleno))
+        largo = rng.randint(150, 1800)
+        inicio_mm = rng.randint(0, 300)
+        filas.append({
+            "Serie": str(numero),
+            "Type": "Helical",
+            "ScanRange": f"S{inicio_mm:.2f}-I{largo - inicio_mm:.2f}",
+            "CTDIvol": f"{rng.uniform(1.5, 12):.2f}",
+            "DLP": f"{rng.uniform(80, 1200):.2f}",
+            "Phantom": "Body 32",
+        })
+    ocr = {
+        "encabezado": {
+            "Patient Name": p["nombre"].replace("^", " "),
+            "Exam no": str(exam_no),
+            "Accession Number": str(rng.randint(10**7, 10**8)),
+            "Patient ID": p["id"],
+            "Exam Description": protocolo,
+            "Total Exam DLP": f"{sum(float(f['DLP']) for f in filas[1:]):.2f}",
+        },
+        "series": filas,
+        "dicom_header": _tags_comunes(
+            p, {"uid": _uid(rng), "sop_uid": _uid(rng), "numero": 999, "modalidad": "SC", "descripcion": "Dose Report"},
+            rng, relleno // 4,
+        ),
+    }
+    return series, ocr
+
+
+def serie_pet(rng: random.Random, inicio: datetime, dias: int, relleno: int) -> Dict[str, Any]:
+    p = _paciente(rng, inicio, dias, rng.choice(PROTOCOLOS_PET))
+    serie = {"uid": _uid(rng), "sop_uid": _uid(rng), "numero": 3, "modalidad": "PT", "descripcion": "PET WB"}
+    doc = _serie_doc(p, serie, rng, relleno)
+    actividad_bq = rng.uniform(0.08, 0.12) * p["peso"] * 3.7e7
+    doc["first_instance"]["dicom_tags"]["0054,0016"] = _tag(
+        "RadiopharmaceuticalInformationSequence",
+        [{
+            "0018,1072": _tag("RadiopharmaceuticalStartTime", (p["fecha"] - timedelta(minutes=60)).strftime("%H%M%S")),
+            "0018,1074": _tag("RadionuclideTotalDose", f"{actividad_bq:.1f}"),
+            "0018,1075": _tag("RadionuclideHalfLife", "6586.2"),
+        }],
+        "Sequence",
+    )
+    doc["pet_quality"] = {
+        "status": "ok",
+        "gni_suvbw": rng.uniform(0.05, 0.3),
+        "coverage_mask_pct": rng.uniform(20, 60),
+        "params": {"thr_suv": 0.5, "block_size": 5, "min_valid": 20, "bins": 100},
+        "suv_meta": {
+            "PatientWeight_kg": p["peso"],
+            "Ainj_Bq": actividad_bq,
+            "HalfLife_s": 6586.2,
+            "Delta_t_s": 3600.0,
+        },
+    }
+    return doc
+
+
+def _lotes(docs: Iterator[Dict[str, Any]], tamano: int) -> Iterator[List[Dict[str, Any]]]:
+    lote: List[Dict[str, Any]] = []
+    for doc in docs:
+        lote.append(doc)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Datos sinteticos para pruebas de carga")
+    parser.add_argument("--uri", default="mongodb://localhost:27017/DMSBench")
+    parser.add_argument("--estudios", type=int, default=1000, help="estudios CT (cada uno con su reporte OCR)")
+    parser.add_argument("--pet", type=int, default=500, help="series PET")
+    parser.add_argument("--tags", type=int, default=120, help="tags de relleno por instancia")
+    parser.add_argument("--dias", type=int, default=730, help="rango de fechas hacia atras desde hoy")
+    parser.add_argument("--lote", type=int, default=1000)
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--col-ct", default="series_ct")
+    parser.add_argument("--col-pet", default="series_pet1")
+    parser.add_argument("--col-ocr", default="dose_report")
+    parser.add_argument("--limpiar", action="store_true", help="vacia las colecciones antes de insertar")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    rng = random.Random(args.semilla)
+    db = pymongo.MongoClient(args.uri).get_default_database()
+    inicio = datetime.now().replace(microsecond=0) - timedelta(days=args.dias)
+
+    if args.limpiar:
+        for col in (args.col_ct, args.col_pet, args.col_ocr):
+            db[col].drop()
+
+    t0 = time.perf_counter()
+    cts: List[Dict[str, Any]] = []
+    ocrs: List[Dict[str, Any]] = []
+    n_series = 0
+    for i in range(args.estudios):
+        series, ocr = estudio_ct(rng, inicio, args.dias, 100000 + i, args.tags)
+        cts.extend(series)
+        ocrs.append(ocr)
+        n_series += len(series)
+        if len(ocrs) >= args.lote or i == args.estudios - 1:
+            db[args.col_ct].insert_many(cts, ordered=False)
+            db[args.col_ocr].insert_many(ocrs, ordered=False)
+            cts, ocrs = [], []
+    logger.info("[OK] %d estudios CT (%d series) y %d reportes OCR", args.estudios, n_series, args.estudios)
+
+    pets = (serie_pet(rng, inicio, args.dias, args.tags) for _ in range(args.pet))
+    for lote in _lotes(pets, args.lote):
+        db[args.col_pet].insert_many(lote, ordered=False)
+    logger.info("[OK] %d series PET", args.pet)
+    logger.info("[OK] Generacion completa en %.1f s", time.perf_counter() - t0)
+
+
+if __name__ == "__main__":
+    main()
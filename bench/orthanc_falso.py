@@ -0,0 +1,499 @@
+"""
+Servidor REST que imita a Orthanc para pruebas del pipeline sin PACS.
+
+Genera en memoria pacientes con estudios "PET CUERPO COMPLETO-FD" que
+contienen:
+- varias series CT (pocas instancias pequenas; el pipeline solo lee tags),
+- una serie PT con `--cortes` cortes de `--matriz` x `--matriz` pixeles y la
+  secuencia de radiofarmaco completa (para el calculo de GNI),
+- la captura del reporte de dosis (serie 999, imagen con la tabla dibujada).
+
+Responde las rutas que usa pyorthanc en el pipeline:
+    GET /patients, /patients/{id}, /studies/{id}, /series/{id},
+        /instances/{id}, /instances/{id}/tags, /instances/{id}/file,
+        /studies/{id}/series, /studies/{id}/instances (siempre expandidas)
+    POST /tools/find (solo nivel Study por StudyDate, con o sin Expand, Since/Limit)
+y lleva la cuenta de requests y bytes enviados por tipo de ruta
+(GET /_bench/stats los devuelve en JSON). Con --latencia-ms y --fallas se
+simula un PACS cargado (demora por request y fraccion de respuestas 503),
+para probar los reintentos y la concurrencia adaptativa de orthanc/acceso.py.
+
+Con --exportar escribe las mismas instancias como archivos .dcm (para
+probar la ingesta desde directorio de fuentes/directorio.py).
+
+Uso:
+    python bench/orthanc_falso.py --estudios 20 --puerto 8042
+    python bench/orthanc_falso.py --estudios 200 --exportar /tmp/exportacion
+    ORTHANC_URL=http://localhost:8042 python launcher.py     # desde DMS_pipeline/
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.multival import MultiValue
+from pydicom.sequence import Sequence
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+try:
+    from PIL import Image, ImageDraw
+except ImportError:  # sin Pillow la captura de dosis queda sin texto
+    Image = ImageDraw = None
+
+
+logger = logging.getLogger(__name__)
+
+DESCRIPCION_ESTUDIO = "PET CUERPO COMPLETO-FD"
+SERIE_DOSIS = 999
+SOP_CT = "1.2.840.10008.5.1.4.1.1.2"
+SOP_PET = "1.2.840.10008.5.1.4.1.1.128"
+SOP_SC = "1.2.840.10008.5.1.4.1.1.7"
+NOMBRES = ["PEREZ", "GONZALEZ", "MUNOZ", "ROJAS", "DIAZ", "SOTO", "SILVA", "MARTINEZ"]
+PILA = ["JUAN", "MARIA", "JOSE", "ANA", "LUIS", "CAMILA", "PEDRO", "JORGE"]
+
+
+def _orthanc_id(*partes: str) -> str:
+    """Identificador con el formato de Orthanc (sha1 en 5 grupos de 8)."""
+    h = hashlib.sha1("|".join(partes).encode()).hexdigest()
+    return "-".join(h[i:i + 8] for i in range(0, 40, 8))
+
+
+def _dataset_base(paciente: Dict[str, Any], estudio: Dict[str, Any], serie: Dict[str, Any],
+                  sop_class: str, sop_uid: str, numero: int) -> Dataset:
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = sop_class
+    ds.file_meta.MediaStorageSOPInstanceUID = sop_uid
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.SOPClassUID = sop_class
+    ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
+    ds.PatientName = paciente["nombre"]
+    ds.PatientID = paciente["id"]
+    ds.PatientWeight = str(paciente["peso"])
+    ds.StudyInstanceUID = estudio["uid"]
+    ds.StudyDescription = DESCRIPCION_ESTUDIO
+    ds.StudyDate = estudio["fecha"].strftime("%Y%m%d")
+    ds.StudyTime = estudio["fecha"].strftime("%H%M%S")
+    ds.SeriesInstanceUID = serie["uid"]
+    ds.SeriesNumber = serie["numero"]
+    ds.SeriesDescription = serie["descripcion"]
+    ds.SeriesDate = ds.StudyDate
+    ds.SeriesTime = serie["hora"].strftime("%H%M%S")
+    ds.AcquisitionTime = ds.SeriesTime
+    ds.Modality = serie["modalidad"]
+    ds.Manufacturer = "GE MEDICAL SYSTEMS"
+    ds.ProtocolName = estudio["protocolo"]
+    ds.InstanceNumber = numero
+    return ds
+
+
+def _pixeles(ds: Dataset, arr: np.ndarray) -> None:
+    ds.Rows, ds.Columns = arr.shape
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = ds.BitsStored = arr.dtype.itemsize * 8
+    ds.HighBit = ds.BitsStored - 1
+    ds.PixelRepresentation = 1 if arr.dtype.kind == "i" else 0
+    ds.PixelData = arr.tobytes()
+
+
+def _bytes_dicom(ds: Dataset) -> bytes:
+    buffer = BytesIO()
+    pydicom.dcmwrite(buffer, ds, enforce_file_format=True)
+    return buffer.getvalue()
+
+
+def _corte_pet(rng: np.random.Generator, matriz: int, suv_a_bqml: float) -> np.ndarray:
+    """Cuerpo eliptico con captacion de fondo, un par de lesiones y ruido."""
+    y, x = np.mgrid[0:matriz, 0:matriz]
+    c = matriz / 2
+    cuerpo = ((x - c) / (0.40 * matriz)) ** 2 + ((y - c) / (0.28 * matriz)) ** 2 <= 1
+    suv = np.where(cuerpo, 1.2, 0.02)
+    for _ in range(rng.integers(0, 3)):
+        cx, cy = rng.uniform(0.3, 0.7, 2) * matriz
+        suv = suv + 6.0 * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * (0.03 * matriz) ** 2))
+    suv = suv * rng.normal(1.0, 0.15, suv.shape)
+    return np.clip(suv * suv_a_bqml, 0, 32767).astype(np.int16)
+
+
+def _captura_dosis(filas: List[Dict[str, str]], paciente: Dict[str, Any], exam_no: int) -> np.ndarray:
+    """Imagen del reporte de dosis: encabezado + tabla, texto claro sobre fondo oscuro."""
+    alto, ancho = 512, 640
+    if Image is None:
+        return np.zeros((alto, ancho), dtype=np.uint8)
+    img = Image.new("L", (ancho, alto), 0)
+    dibujo = ImageDraw.Draw(img)
+    lineas = [
+        f"Patient Name: {paciente['nombre'].replace('^', ' ')}",
+        f"Exam no: {exam_no}",
+        f"Patient ID: {paciente['id']}",
+        "Exam Description: PET CUERPO COMPLETO-FD",
+        "",
+        "Series Type Scan Range CTDIvol DLP Phantom",
+    ]
+    for f in filas:
+        lineas.append(" ".join(f[k] for k in ("Serie", "Type", "ScanRange", "CTDIvol", "DLP", "Phantom")))
+    total = sum(float(f["DLP"]) for f in filas if f["DLP"] != "-")
+    lineas += ["", f"Total Exam DLP: {total:.2f}"]
+    for i, linea in enumerate(lineas):
+        dibujo.text((20, 20 + 22 * i), linea, fill=255)
+    return np.asarray(img, dtype=np.uint8)
+
+
+def _tags_orthanc(ds: Dataset) -> Dict[str, Any]:
+    """Dataset pydicom -> formato de /instances/{id}/tags (sin PixelData)."""
+    salida: Dict[str, Any] = {}
+    for elem in ds:
+        if elem.tag == 0x7FE00010:
+            continue
+        clave = f"{elem.tag.group:04x},{elem.tag.element:04x}"
+        nombre = elem.keyword or "Unknown"
+        if elem.VR == "SQ":
+            salida[clave] = {"Name": nombre, "Type": "Sequence", "Value": [_tags_orthanc(item) for item in elem.value]}
+        elif elem.VR in ("OB", "OW", "UN"):
+            salida[clave] = {"Name": nombre, "Type": "Null", "Value": None}
+        else:
+            valor = elem.value
+            if isinstance(valor, (list, MultiValue)):
+                valor = "\\".join(str(v) for v in valor)
+            salida[clave] = {"Name": nombre, "Type": "String", "Value": "" if valor is None else str(valor)}
+    return salida
+
+
+class Catalogo:
+    """Recursos en memoria con las respuestas ya serializadas."""
+
+    def __init__(self, estudios: int = 10, series_ct: int = 3, cortes: int = 40, matriz: int = 128,
+                 semilla: int = 1):
+        self.rng = random.Random(semilla)
+        self.np_rng = np.random.default_rng(semilla)
+        self.recursos: Dict[str, Dict[str, Any]] = {}  # "/patients/{id}" -> dict
+        self.tags: Dict[str, bytes] = {}
+        self.archivos: Dict[str, bytes] = {}
+        self.pacientes: List[str] = []
+        inicio = datetime(2024, 1, 1, 8, 0)
+        for i in range(estudios):
+            self._agregar_estudio(inicio + timedelta(days=i, minutes=self.rng.randrange(600)),
+                                  100000 + i, series_ct, cortes, matriz)
+        self.json_pacientes = json.dumps(self.pacientes).encode()
+        self.cuerpos = {ruta: json.dumps(doc).encode() for ruta, doc in self.recursos.items()}
+        for ruta, doc in list(self.recursos.items()):
+            if doc["Type"] == "Study":
+                series = [self.recursos[f"/series/{s}"] for s in doc["Series"]]
+                instancias = [self.recursos[f"/instances/{i}"] for s in series for i in s["Instances"]]
+                self.cuerpos[f"{ruta}/series"] = json.dumps(series).encode()
+                self.cuerpos[f"{ruta}/instances"] = json.dumps(instancias).encode()
+
+    def _agregar_estudio(self, fecha: datetime, exam_no: int, series_ct: int, cortes: int, matriz: int):
+        rng = self.rng
+        paciente = {
+            "nombre": f"{rng.choice(NOMBRES)}^{rng.choice(NOMBRES)}^{rng.choice(PILA)}",
+            "id": str(rng.randint(10**6, 10**7)),
+            "peso": round(rng.gauss(72, 12), 1),
+        }
+        estudio = {"uid": self._uid(), "fecha": fecha, "protocolo": "10.1 PET CT"}
+        pid = _orthanc_id("patient", paciente["id"])
+        sid = _orthanc_id("study", estudio["uid"])
+        self.pacientes.append(pid)
+        self.recursos[f"/patients/{pid}"] = {
+            "ID": pid, "Type": "Patient", "IsStable": True,
+            "LastUpdate": fecha.strftime("%Y%m%dT%H%M%S"),
+            "MainDicomTags": {"PatientName": paciente["nombre"], "PatientID": paciente["id"]},
+            "Studies": [sid],
+        }
+        series_ids: List[str] = []
+        filas = [{"Serie": "1", "Type": "Scout", "ScanRange": "-", "CTDIvol": "-", "DLP": "-", "Phantom": "-"}]
+
+        for numero in range(2, 2 + series_ct):
+            serie = self._serie(fecha, "CT", numero, "CTAC")
+            imagenes = []
+            for n in range(1, 4):
+                ds = _dataset_base(paciente, estudio, serie, SOP_CT, self._uid(), n)
+                ds.RescaleSlope, ds.RescaleIntercept = 1, -1024
+                _pixeles(ds, self.np_rng.integers(0, 2000, (64, 64), dtype=np.int16))
+                imagenes.append(ds)
+            series_ids.append(self._registrar_serie(sid, serie, imagenes))
+            largo, ini = rng.randint(150, 1800), rng.randint(0, 300)
+            filas.append({
+                "Serie": str(numero), "Type": "Helical", "ScanRange": f"S{ini:.2f}-I{largo - ini:.2f}",
+                "CTDIvol": f"{rng.uniform(1.5, 12):.2f}", "DLP": f"{rng.uniform(80, 1200):.2f}", "Phantom": "Body 32",
+            })
+
+        # PET: actividad y tiempos coherentes para que el factor SUV sea valido
+        serie = self._serie(fecha + timedelta(minutes=60), "PT", 2 + series_ct, "PET-AC")
+        actividad = rng.uniform(0.08, 0.12) * paciente["peso"] * 3.7e7
+        suv_a_bqml = actividad / (paciente["peso"] * 1000.0)
+        radio = Dataset()
+        radio.RadiopharmaceuticalStartTime = fecha.strftime("%H%M%S")
+        radio.RadionuclideTotalDose = f"{actividad:.1f}"
+        radio.RadionuclideHalfLife = "6586.2"
+        imagenes = []
+        for n in range(1, cortes + 1):
+            ds = _dataset_base(paciente, estudio, serie, SOP_PET, self._uid(), n)
+            ds.RadiopharmaceuticalInformationSequence = Sequence([radio])
+            ds.RescaleSlope, ds.RescaleIntercept = 1, 0
+            ds.Units = "BQML"
+            _pixeles(ds, _corte_pet(self.np_rng, matriz, suv_a_bqml))
+            imagenes.append(ds)
+        series_ids.append(self._registrar_serie(sid, serie, imagenes))
+
+        serie = self._serie(fecha, "SC", SERIE_DOSIS, "Dose Report")
+        ds = _dataset_base(paciente, estudio, serie, SOP_SC, self._uid(), 1)
+        _pixeles(ds, _captura_dosis(filas, paciente, exam_no))
+        series_ids.append(self._registrar_serie(sid, serie, [ds]))
+
+        self.recursos[f"/studies/{sid}"] = {
+            "ID": sid, "Type": "Study", "IsStable": True, "ParentPatient": pid,
+            "LastUpdate": fecha.strftime("%Y%m%dT%H%M%S"),
+            "MainDicomTags": {
+                "StudyInstanceUID": estudio["uid"],
+                "StudyDescription": DESCRIPCION_ESTUDIO,
+                "StudyDate": fecha.strftime("%Y%m%d"),
+                "AccessionNumber": str(exam_no),
+            },
+            "PatientMainDicomTags": {"PatientName": paciente["nombre"], "PatientID": paciente["id"]},
+            "Series": series_ids,
+        }
+
+    def _uid(self) -> str:
+        # UIDs derivados de la semilla: la misma semilla reproduce el mismo catalogo
+        return generate_uid(entropy_srcs=[str(self.rng.random())])
+
+    def _serie(self, hora: datetime, modalidad: str, numero: int, descripcion: str) -> Dict[str, Any]:
+        return {"uid": self._uid(), "hora": hora, "modalidad": modalidad, "numero": numero, "descripcion": descripcion}
+
+    def _registrar_serie(self, sid: str, serie: Dict[str, Any], imagenes: List[Dataset]) -> str:
+        serid = _orthanc_id("series", serie["uid"])
+        instancias = []
+        for ds in imagenes:
+            iid = _orthanc_id("instance", ds.SOPInstanceUID)
+            instancias.append(iid)
+            self.recursos[f"/instances/{iid}"] = {
+                "ID": iid, "Type": "Instance", "ParentSeries": serid, "IndexInSeries": int(ds.InstanceNumber),
+                "MainDicomTags": {"SOPInstanceUID": ds.SOPInstanceUID, "InstanceNumber": str(ds.InstanceNumber)},
+            }
+            self.tags[iid] = json.dumps(_tags_orthanc(ds)).encode()
+            self.archivos[iid] = _bytes_dicom(ds)
+        self.recursos[f"/series/{serid}"] = {
+            "ID": serid, "Type": "Series", "IsStable": True, "ParentStudy": sid, "Status": "Unknown",
+            "MainDicomTags": {
+                "SeriesInstanceUID": serie["uid"],
+                "Modality": serie["modalidad"],
+                "SeriesNumber": str(serie["numero"]),
+                "SeriesDescription": serie["descripcion"],
+            },
+            "Instances": instancias,
+        }
+        return serid
+
+    def responder(self, ruta: str) -> Tuple[Optional[bytes], str, str]:
+        """(cuerpo, content-type, tipo de ruta) o cuerpo None si no existe."""
+        ruta = ruta.split("?", 1)[0].rstrip("/")
+        if ruta == "/patients":
+            return self.json_pacientes, "application/json", "patients"
+        partes = ruta.split("/")
+        if len(partes) == 4 and partes[1] == "studies" and partes[3] in ("series", "instances"):
+            return self.cuerpos.get(ruta), "application/json", f"studies/{partes[3]}"
+        if len(partes) == 4 and partes[1] == "instances":
+            if partes[3] == "tags":
+                return self.tags.get(partes[2]), "application/json", "instances/tags"
+            if partes[3] == "file":
+                return self.archivos.get(partes[2]), "application/dicom", "instances/file"
+        if len(partes) == 3:
+            return self.cuerpos.get(ruta), "application/json", partes[1]
+        return None, "application/json", "otra"
+
+    def buscar(self, consulta: Dict[str, Any]) -> List[Any]:
+        """/tools/find reducido: nivel Study, con StudyDate exacta o rango "desde-hasta"
+        (o sin filtro), paginado con "Since"/"Limit"; con "Expand" devuelve los
+        estudios completos."""
+        if str(consulta.get("Level", "")).lower() != "study":
+            return []
+        fecha = str(consulta.get("Query", {}).get("StudyDate", "") or "-")
+        desde, _, hasta = fecha.partition("-") if "-" in fecha else (fecha, "", fecha)
+        encontrados = []
+        for ruta, doc in self.recursos.items():
+            if ruta.startswith("/studies/"):
+                valor = doc["MainDicomTags"]["StudyDate"]
+                if (not desde or valor >= desde) and (not hasta or valor <= hasta):
+                    encontrados.append(doc["ID"])
+        encontrados = sorted(encontrados)[int(consulta.get("Since") or 0):]
+        if consulta.get("Limit"):
+            encontrados = encontrados[:int(consulta["Limit"])]
+        if consulta.get("Expand"):
+            return [self.recursos[f"/studies/{sid}"] for sid in encontrados]
+        return encontrados
+
+    def exportar(self, directorio: Path) -> int:
+        """Escribe las instancias como archivos .dcm (para la ingesta desde directorio)."""
+        for iid, datos in self.archivos.items():
+            destino = directorio / iid[:2] / f"{iid}.dcm"
+            destino.parent.mkdir(parents=True, exist_ok=True)
+            destino.write_bytes(datos)
+        return len(self.archivos)
+
+    def resumen(self) -> Dict[str, int]:
+        return {
+            "pacientes": len(self.pacientes),
+            "instancias": len(self.archivos),
+            "mb_dicom": round(sum(len(b) for b in self.archivos.values()) / 1e6, 1),
+        }
+
+
+class Contadores:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.por_ruta: Dict[str, Dict[str, int]] = {}
+
+    def sumar(self, tipo: str, enviados: int) -> None:
+        with self._lock:
+            c = self.por_ruta.setdefault(tipo, {"requests": 0, "bytes": 0})
+            c["requests"] += 1
+            c["bytes"] += enviados
+
+    def foto(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {k: dict(v) for k, v in self.por_ruta.items()}
+
+
+def _handler(catalogo: Catalogo, contadores: Contadores, latencia_s: float = 0.0, fallas: float = 0.0):
+    azar = random.Random(0)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, como el Orthanc real
+        disable_nagle_algorithm = True  # headers y cuerpo van en escrituras separadas
+
+        def _simular_carga(self) -> bool:
+            """Aplica la latencia y devuelve True si esta request debe fallar con 503."""
+            if latencia_s:
+                time.sleep(latencia_s)
+            if fallas and azar.random() < fallas:
+                cuerpo = b'{"Message": "Service unavailable"}'
+                self.send_response(503)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+                contadores.sumar("503", len(cuerpo))
+                return True
+            return False
+
+        def do_GET(self):
+            if self.path.startswith("/_bench/stats"):
+                cuerpo, tipo, ruta = json.dumps(contadores.foto()).encode(), "application/json", None
+            elif self._simular_carga():
+                return
+            else:
+                cuerpo, tipo, ruta = catalogo.responder(self.path)
+            if cuerpo is None:
+                cuerpo, estado = b'{"Message": "Unknown resource"}', 404
+            else:
+                estado = 200
+            self.send_response(estado)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+            if ruta is not None:
+                contadores.sumar(ruta if estado == 200 else "404", len(cuerpo))
+
+        def do_POST(self):
+            largo = int(self.headers.get("Content-Length") or 0)
+            consulta = json.loads(self.rfile.read(largo) or b"{}")
+            if self._simular_carga():
+                return
+            if self.path.rstrip("/") == "/tools/find":
+                cuerpo, estado = json.dumps(catalogo.buscar(consulta)).encode(), 200
+            else:
+                cuerpo, estado = b'{"Message": "Unknown resource"}', 404
+            self.send_response(estado)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+            contadores.sumar("tools/find" if estado == 200 else "404", len(cuerpo))
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class OrthancFalso:
+    """Servidor en un hilo aparte: `with OrthancFalso(catalogo) as srv: srv.url`."""
+
+    def __init__(self, catalogo: Catalogo, host: str = "127.0.0.1", puerto: int = 0,
+                 latencia_ms: float = 0.0, fallas: float = 0.0):
+        self.catalogo = catalogo
+        self.contadores = Contadores()
+        self.servidor = ThreadingHTTPServer(
+            (host, puerto), _handler(catalogo, self.contadores, latencia_ms / 1000.0, fallas)
+        )
+        self.servidor.daemon_threads = True
+        self._hilo: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, puerto = self.servidor.server_address[:2]
+        return f"http://{host}:{puerto}"
+
+    def iniciar(self) -> "OrthancFalso":
+        self._hilo = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self) -> None:
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.detener()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Orthanc falso para pruebas del pipeline")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8042)
+    parser.add_argument("--estudios", type=int, default=10)
+    parser.add_argument("--series-ct", type=int, default=3, help="series CT por estudio")
+    parser.add_argument("--cortes", type=int, default=40, help="cortes de la serie PET")
+    parser.add_argument("--matriz", type=int, default=128, help="filas/columnas de cada corte PET")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--latencia-ms", type=float, default=0.0, help="demora agregada a cada request")
+    parser.add_argument("--fallas", type=float, default=0.0, help="fraccion de requests que responden 503")
+    parser.add_argument("--exportar", help="escribir las instancias como .dcm en este directorio y salir")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    catalogo = Catalogo(args.estudios, args.series_ct, args.cortes, args.matriz, args.semilla)
+    if args.exportar:
+        n = catalogo.exportar(Path(args.exportar))
+        logger.info("[OK] %d instancia(s) exportadas en '%s'", n, args.exportar)
+        return
+    srv = OrthancFalso(catalogo, args.host, args.puerto, args.latencia_ms, args.fallas)
+    logger.info("[OK] Orthanc falso en %s | %s", srv.url, catalogo.resumen())
+    try:
+        srv.servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Micro-benchmarks de la metrica de calidad PET (headers/header_pet.py).
+
+Genera volumenes PET de cuerpo entero sinteticos (cuerpo eliptico que varia
+a lo largo del eje z, higado, vejiga, lesiones y ruido proporcional a la
+captacion) y mide el throughput de:
+    dataset_to_suv_slice, crop_center_pair, compute_noise_values_from_slice,
+    compute_gni, get_suv_factor_from_dicom
+y del camino completo compute_pet_quality_from_orthanc_series sobre una
+serie en memoria (cada instancia se decodifica desde bytes DICOM, como al
+descargarla de Orthanc).
+
+Cada medicion toma el mejor de --repeticiones. Termina con codigo 1 si el
+camino completo no devuelve status "ok" (se estaria midiendo un error) o si
+algun throughput cae mas que --tolerancia (fraccion) respecto de la base.
+La base de referencia versionada es bench/base_pet_calidad.json (caso por
+defecto); se regenera con --guardar en la maquina donde se compara.
+
+Uso:
+    python bench/pet_calidad.py                                # 300 cortes de 256x256 contra la base versionada
+    python bench/pet_calidad.py -c 200x192 -c 700x512 --guardar base_pet.json
+    python bench/pet_calidad.py -c 200x192 -c 700x512 --base base_pet.json --tolerancia 0.15
+"""
+
+import argparse
+import json
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "DMS_pipeline"))
+
+from config import QUALITY_BINS, QUALITY_BLOCK, QUALITY_MIN_VALID, QUALITY_THR_SUV  # noqa: E402
+from headers import header_pet  # noqa: E402
+
+
+BASE_REFERENCIA = Path(__file__).resolve().parent / "base_pet_calidad.json"
+
+PESO_KG = 72.0
+ACTIVIDAD_BQ = 2.7e8
+SOP_PET = "1.2.840.10008.5.1.4.1.1.128"
+
+
+def volumen_pet(cortes: int, matriz: int, semilla: int = 1) -> np.ndarray:
+    """Volumen en Bq/ml (int16) con la forma aproximada de un PET de cuerpo entero."""
+    rng = np.random.default_rng(semilla)
+    y, x = np.mgrid[0:matriz, 0:matriz].astype(np.float32)
+    c = matriz / 2
+    suv_a_bqml = ACTIVIDAD_BQ / (PESO_KG * 1000.0)
+    volumen = np.empty((cortes, matriz, matriz), dtype=np.int16)
+    lesiones = [(rng.uniform(0.1, 0.9), rng.uniform(0.35, 0.65, 2) * matriz) for _ in range(8)]
+    for z in range(cortes):
+        t = z / max(cortes - 1, 1)  # 0 = cabeza, 1 = pies
+        if t < 0.12:
+            ancho, alto, fondo = 0.18, 0.20, 5.5  # cerebro
+        elif t < 0.18:
+            ancho, alto, fondo = 0.10, 0.10, 1.0  # cuello
+        elif t < 0.55:
+            ancho, alto, fondo = 0.40, 0.27, 1.2  # torax y abdomen
+        else:
+            ancho, alto, fondo = 0.30, 0.20, 0.8  # pelvis y piernas
+        r2 = ((x - c) / (ancho * matriz)) ** 2 + ((y - c) / (alto * matriz)) ** 2
+        suv = np.where(r2 <= 1, fondo, 0.01).astype(np.float32)
+        if 0.35 < t < 0.45:  # higado
+            suv += 1.3 * (((x - c * 0.7) / (0.12 * matriz)) ** 2 + ((y - c) / (0.10 * matriz)) ** 2 <= 1)
+        if 0.58 < t < 0.62:  # vejiga
+            suv += 25.0 * (((x - c) / (0.05 * matriz)) ** 2 + ((y - c) / (0.05 * matriz)) ** 2 <= 1)
+        for zl, (cx, cy) in lesiones:
+            if abs(t - zl) < 0.01:
+                suv += 8.0 * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * (0.015 * matriz) ** 2))
+        # ruido de conteo: la desviacion crece con la raiz de la captacion
+        suv += rng.normal(0.0, 1.0, suv.shape).astype(np.float32) * 0.12 * np.sqrt(suv)
+        volumen[z] = np.clip(suv * suv_a_bqml, 0, 32767)
+    return volumen
+
+
+def _dataset(corte: np.ndarray, numero: int, serie_uid: str) -> Dataset:
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = SOP_PET
+    ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.SOPClassUID = SOP_PET
+    ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
+    ds.SeriesInstanceUID = serie_uid
+    ds.Modality = "PT"
+    ds.InstanceNumber = numero
+    ds.PatientWeight = str(PESO_KG)
+    ds.SeriesTime = ds.AcquisitionTime = "100000"
+    radio = Dataset()
+    radio.RadiopharmaceuticalStartTime = "090000"
+    radio.RadionuclideTotalDose = str(ACTIVIDAD_BQ)
+    radio.RadionuclideHalfLife = "6586.2"
+    ds.RadiopharmaceuticalInformationSequence = Sequence([radio])
+    ds.RescaleSlope, ds.RescaleIntercept = 1, 0
+    ds.Rows, ds.Columns = corte.shape
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 1
+    ds.PixelData = corte.tobytes()
+    return ds
+
+
+def _serializar(ds: Dataset) -> bytes:
+    buffer = BytesIO()
+    pydicom.dcmwrite(buffer, ds, enforce_file_format=True)
+    return buffer.getvalue()
+
+
+class InstanciaMemoria:
+    """Imita pyorthanc.Instance: cada lectura decodifica los bytes otra vez.
+
+    `local` evita la cache DICOM en disco (orthanc/cache.py), como con las
+    instancias de fuentes/directorio.py: los bytes ya estan en memoria.
+    """
+
+    local = True
+
+    def __init__(self, id_: str, contenido: bytes):
+        self.id_ = id_
+        self._contenido = contenido
+
+    def get_dicom_file_content(self) -> bytes:
+        return self._contenido
+
+    def get_pydicom(self) -> Dataset:
+        return pydicom.dcmread(BytesIO(self._contenido))
+
+
+class SerieMemoria:
+    def __init__(self, instancias: List[InstanciaMemoria]):
+        self.instances = instancias
+
+
+def _mejor(funcion: Callable[[], Any], repeticiones: int) -> float:
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+def medir_caso(cortes: int, matriz: int, repeticiones: int, semilla: int) -> Dict[str, Dict[str, float]]:
+    """Throughput de cada funcion para un volumen de `cortes` x `matriz`²."""
+    volumen = volumen_pet(cortes, matriz, semilla)
+    serie_uid = generate_uid()
+    datasets = [_dataset(volumen[z], z + 1, serie_uid) for z in range(cortes)]
+    for ds in datasets:
+        ds.pixel_array  # decodificado y cacheado: las mediciones por funcion no incluyen el parseo
+    params = {"thr": QUALITY_THR_SUV, "block": QUALITY_BLOCK, "min_valid": QUALITY_MIN_VALID, "bins": QUALITY_BINS}
+    factor, _ = header_pet.get_suv_factor_from_dicom(datasets[0])
+    suv = [header_pet.dataset_to_suv_slice(ds, factor) for ds in datasets]
+    mascaras = [s > params["thr"] for s in suv]
+    ruido = np.concatenate([
+        header_pet.compute_noise_values_from_slice(s, m, params["block"], params["min_valid"])
+        for s, m in zip(suv, mascaras)
+    ])
+    serie = SerieMemoria([InstanciaMemoria(f"i{z}", _serializar(ds)) for z, ds in enumerate(datasets)])
+    mpix = cortes * matriz * matriz / 1e6
+    llamadas_suv = 2000
+
+    mediciones: List[Tuple[str, Callable[[], Any], float, str]] = [
+        ("get_suv_factor_from_dicom",
+         lambda: [header_pet.get_suv_factor_from_dicom(datasets[0]) for _ in range(llamadas_suv)],
+         llamadas_suv, "llamadas/s"),
+        ("dataset_to_suv_slice",
+         lambda: [header_pet.dataset_to_suv_slice(ds, factor) for ds in datasets],
+         mpix, "Mpix/s"),
+        ("crop_center_pair",
+         lambda: [header_pet.crop_center_pair(s, m, params["block"]) for s, m in zip(suv, mascaras)],
+         mpix, "Mpix/s"),
+        ("compute_noise_values_from_slice",
+         lambda: [header_pet.compute_noise_values_from_slice(s, m, params["block"], params["min_valid"])
+                  for s, m in zip(suv, mascaras)],
+         mpix, "Mpix/s"),
+        ("compute_gni",
+         lambda: header_pet.compute_gni(ruido, params["bins"]),
+         ruido.size / 1e6, "Mvalores/s"),
+        ("compute_pet_quality_from_orthanc_series",
+         lambda: header_pet.compute_pet_quality_from_orthanc_series(serie, params),
+         cortes, "cortes/s"),
+    ]
+
+    resultados: Dict[str, Dict[str, float]] = {}
+    for nombre, funcion, trabajo, unidad in mediciones:
+        segundos = _mejor(funcion, repeticiones)
+        resultados[nombre] = {
+            "segundos": round(segundos, 4),
+            "throughput": round(trabajo / segundos, 3) if segundos > 0 else float("inf"),
+            "unidad": unidad,
+        }
+    calidad = header_pet.compute_pet_quality_from_orthanc_series(serie, params)
+    resultados["_calidad"] = {"status": calidad.get("status"), "gni_suvbw": calidad.get("gni_suvbw")}
+    return resultados
+
+
+def comparar(actual: Dict[str, Any], base: Dict[str, Any], tolerancia: float) -> List[str]:
+    """Mediciones cuyo throughput cayo mas que `tolerancia` respecto de la base."""
+    regresiones = []
+    for caso, funciones in actual["casos"].items():
+        previas = base.get("casos", {}).get(caso, {})
+        for nombre, r in funciones.items():
+            p = previas.get(nombre)
+            if nombre.startswith("_") or not p or not p.get("throughput"):
+                continue
+            if r["throughput"] < p["throughput"] * (1 - tolerancia):
+                regresiones.append(
+                    f"{caso} {nombre}: {p['throughput']} -> {r['throughput']} {r['unidad']}"
+                )
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de la metrica de calidad PET")
+    parser.add_argument("-c", "--caso", action="append", dest="casos",
+                        help="CORTESxMATRIZ, p. ej. 300x256 (repetible)")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--guardar", help="escribe los resultados como base (JSON)")
+    parser.add_argument("--base", default=str(BASE_REFERENCIA),
+                        help="base JSON contra la cual comparar (vacio: no comparar)")
+    parser.add_argument("--tolerancia", type=float, default=0.15, help="caida de throughput permitida (fraccion)")
+    args = parser.parse_args()
+
+    reporte: Dict[str, Any] = {"repeticiones": args.repeticiones, "casos": {}}
+    fallidos = []
+    for caso in args.casos or ["300x256"]:
+        cortes, _, matriz = caso.lower().partition("x")
+        resultados = medir_caso(int(cortes), int(matriz), args.repeticiones, args.semilla)
+        reporte["casos"][caso] = resultados
+        print(f"\n{caso}  (GNI {resultados['_calidad']['gni_suvbw']}, {resultados['_calidad']['status']})")
+        for nombre, r in resultados.items():
+            if not nombre.startswith("_"):
+                print(f"  {nombre:<42} {r['segundos']:>9.4f} s {r['throughput']:>12.2f} {r['unidad']}")
+        if resultados["_calidad"]["status"] != "ok":
+            fallidos.append(f"{caso}: status {resultados['_calidad']['status']!r}")
+
+    for linea in fallidos:
+        print(f"[ERROR] {linea}")
+    if fallidos:
+        sys.exit(1)
+
+    if args.guardar:
+        Path(args.guardar).write_text(json.dumps(reporte, indent=2))
+
+    if args.base:
+        regresiones = comparar(reporte, json.loads(Path(args.base).read_text()), args.tolerancia)
+        for linea in regresiones:
+            print(f"[REGRESION] {linea}")
+        if regresiones:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
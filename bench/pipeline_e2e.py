@@ -0,0 +1,342 @@
+"""
+Benchmark de punta a punta del pipeline (launcher.main) contra un Orthanc local.
+
+Levanta el Orthanc falso de orthanc_falso.py (o usa uno real con --orthanc),
+ejecuta `launcher.main` en un directorio temporal y mide por etapa:
+- tiempo de pared,
+- requests HTTP y bytes descargados (hook sobre httpx.Client.send, que es la
+  clase base del cliente de pyorthanc),
+- memoria residente maxima (muestreo de /proc/self/status),
+- comandos de escritura en Mongo y documentos escritos (CommandListener).
+
+Con --corridas 2 la segunda corrida mide el caso incremental (JSON ya
+exportados y documentos sin cambios); con --reexportar los JSON se borran
+antes de cada corrida y la segunda lee los DICOM de la cache local. Necesita un MongoDB real; la base
+indicada en --db se vacia con --limpiar.
+
+Uso:
+    python bench/pipeline_e2e.py --estudios 20 --cortes 60 --mongo mongodb://localhost:27017 --limpiar
+    python bench/pipeline_e2e.py --orthanc http://localhost:8042 --salida e2e.json
+    python bench/pipeline_e2e.py --base e2e.json --tolerancia 0.25   # falla si alguna etapa empeora
+    python bench/pipeline_e2e.py --latencia-ms 40 --fallas 0.05      # PACS lento e inestable
+    python bench/pipeline_e2e.py --reexportar --latencia-ms 20       # re-corrida con cache de DICOM
+    python bench/pipeline_e2e.py --directorio --reexportar           # ingesta desde disco, sin Orthanc
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+from pymongo import MongoClient, monitoring
+
+from carga import rss_kb
+from orthanc_falso import Catalogo, OrthancFalso
+
+
+logger = logging.getLogger(__name__)
+
+PIPELINE = Path(__file__).resolve().parent.parent / "DMS_pipeline"
+
+# (atributo de launcher, nombre de la etapa); con PIPELINE_WORKERS > 1 las
+# etapas independientes se solapan y la suma de tiempos supera el total
+ETAPAS = [
+    ("asegurar_indices", "indices"),
+    ("run_ocr_main", "ocr"),
+    ("run_ocr_estudios", "ocr"),
+    ("cargar_jsons_ocr", "carga_ocr"),
+    ("run_header_ct", "headers_ct"),
+    ("run_header_pet", "headers_pet"),
+    ("run_header_ct_estudios", "headers_ct"),
+    ("run_header_pet_estudios", "headers_pet"),
+    ("cargar_jsons_ct_headers", "carga_ct"),
+    ("cargar_jsons_pet_headers", "carga_pet"),
+    ("actualizar_vtl", "vtl"),
+]
+_ESCRITURAS = {"insert": "documents", "update": "updates", "delete": "deletes", "findAndModify": None}
+
+
+class Medicion:
+    """Contadores por etapa. Las etapas corren en hilos del launcher: la etapa en
+    curso es por hilo y la memoria se atribuye a todas las etapas activas."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hilo = threading.local()
+        self.activas: Dict[str, int] = {}
+        self.etapas: Dict[str, Dict[str, float]] = {}
+
+    @property
+    def etapa(self) -> Optional[str]:
+        return getattr(self._hilo, "etapa", None)
+
+    def _entrada(self, nombre: str) -> Dict[str, float]:
+        return self.etapas.setdefault(nombre, {
+            "segundos": 0.0, "http_requests": 0, "http_bytes": 0,
+            "mongo_escrituras": 0, "mongo_docs": 0, "mongo_lecturas": 0, "rss_max_kb": 0,
+        })
+
+    def entrar(self, nombre: str) -> None:
+        self._hilo.etapa = nombre
+        with self._lock:
+            self._entrada(nombre)
+            self.activas[nombre] = self.activas.get(nombre, 0) + 1
+
+    def salir(self, nombre: str, segundos: float) -> None:
+        self._hilo.etapa = None
+        with self._lock:
+            self._entrada(nombre)["segundos"] += segundos
+            self.activas[nombre] -= 1
+            if not self.activas[nombre]:
+                del self.activas[nombre]
+
+    def sumar(self, **valores: float) -> None:
+        nombre = self.etapa
+        if nombre is None:
+            return
+        with self._lock:
+            actual = self._entrada(nombre)
+            for clave, valor in valores.items():
+                actual[clave] += valor
+
+    def rss(self, kb: int) -> None:
+        with self._lock:
+            for nombre in self.activas:
+                actual = self._entrada(nombre)
+                if kb > actual["rss_max_kb"]:
+                    actual["rss_max_kb"] = kb
+
+
+MEDICION = Medicion()
+
+
+class _ListenerEscrituras(monitoring.CommandListener):
+    def started(self, event):
+        if event.command_name in _ESCRITURAS:
+            campo = _ESCRITURAS[event.command_name]
+            docs = len(event.command.get(campo) or ()) if campo else 1
+            MEDICION.sumar(mongo_escrituras=1, mongo_docs=docs)
+        elif event.command_name in ("find", "aggregate", "getMore", "count"):
+            MEDICION.sumar(mongo_lecturas=1)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def _instrumentar_httpx() -> None:
+    original = httpx.Client.send
+
+    def send(self, request, *args, **kwargs):
+        respuesta = original(self, request, *args, **kwargs)
+        MEDICION.sumar(http_requests=1, http_bytes=respuesta.num_bytes_downloaded)
+        return respuesta
+
+    httpx.Client.send = send
+
+
+def _envolver(nombre: str, funcion):
+    def etapa(*args, **kwargs):
+        MEDICION.entrar(nombre)
+        MEDICION.rss(rss_kb(os.getpid()) or 0)
+        inicio = time.perf_counter()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            MEDICION.salir(nombre, time.perf_counter() - inicio)
+    return etapa
+
+
+def _muestrear_memoria(fin: threading.Event) -> None:
+    pid = os.getpid()
+    while not fin.is_set():
+        kb = rss_kb(pid)
+        if kb is not None:
+            MEDICION.rss(kb)
+        fin.wait(0.05)
+
+
+def preparar_entorno(orthanc_url: str, mongo_uri: str, db: str, trabajo: Path):
+    """Configura el pipeline por variables de entorno y lo importa desde `trabajo`."""
+    os.environ.update({
+        "ORTHANC_URL": orthanc_url,
+        "MONGO_URI": mongo_uri,
+        "DB_NAME": db,
+        "STUDY_DESCRIPTION": os.getenv("STUDY_DESCRIPTION", "PET CUERPO COMPLETO-FD"),
+    })
+    os.chdir(trabajo)  # ocr_output/, header_ct/ y header_pet/ son relativos al cwd
+    sys.path.insert(0, str(PIPELINE))
+    monitoring.register(_ListenerEscrituras())  # antes de que el pipeline cree su MongoClient
+    _instrumentar_httpx()
+    import launcher
+
+    for atributo, nombre in ETAPAS:
+        if hasattr(launcher, atributo):
+            setattr(launcher, atributo, _envolver(nombre, getattr(launcher, atributo)))
+    return launcher
+
+
+def correr(launcher, directorio: Optional[Path] = None) -> Dict[str, Any]:
+    MEDICION.etapas = {}
+    MEDICION.activas = {}
+    fin = threading.Event()
+    muestreo = threading.Thread(target=_muestrear_memoria, args=(fin,), daemon=True)
+    muestreo.start()
+    inicio = time.perf_counter()
+    try:
+        if directorio is not None:
+            launcher.procesar_directorio(str(directorio))
+        else:
+            launcher.main()
+    finally:
+        fin.set()
+        muestreo.join()
+    total = time.perf_counter() - inicio
+
+    etapas = {}
+    for nombre, m in MEDICION.etapas.items():
+        etapas[nombre] = {
+            "segundos": round(m["segundos"], 3),
+            "http_requests": int(m["http_requests"]),
+            "http_mb": round(m["http_bytes"] / 1e6, 2),
+            "rss_max_mb": round(m["rss_max_kb"] / 1024, 1),
+            "mongo_escrituras": int(m["mongo_escrituras"]),
+            "mongo_docs": int(m["mongo_docs"]),
+            "mongo_lecturas": int(m["mongo_lecturas"]),
+        }
+    return {"total_s": round(total, 3), "etapas": etapas}
+
+
+def imprimir(reporte: Dict[str, Any]) -> None:
+    print(f"\nOrthanc: {reporte['orthanc']}  {reporte.get('catalogo') or ''}")
+    for i, corrida in enumerate(reporte["corridas"], 1):
+        print(f"\nCorrida {i}: {corrida['total_s']} s")
+        print(f"{'etapa':<12} {'seg':>9} {'http':>7} {'MB':>8} {'RSS MB':>8} {'escrit':>7} {'docs':>7} {'lect':>7}")
+        for nombre, e in corrida["etapas"].items():
+            print(
+                f"{nombre:<12} {e['segundos']:>9.3f} {e['http_requests']:>7} {e['http_mb']:>8} "
+                f"{e['rss_max_mb']:>8} {e['mongo_escrituras']:>7} {e['mongo_docs']:>7} {e['mongo_lecturas']:>7}"
+            )
+    print(f"\nAcceso a Orthanc: {reporte.get('orthanc_acceso')}")
+    print(f"Metadatos memorizados: {reporte.get('metadatos_orthanc')}")
+    print(f"Cache de DICOM: {reporte.get('cache_dicom')}")
+    print(f"RSS maximo del proceso: {reporte['rss_pico_mb']} MB")
+
+
+def comparar(reporte: Dict[str, Any], base: Dict[str, Any], tolerancia: float) -> List[str]:
+    """Etapas cuyo tiempo empeoro mas que `tolerancia` (fraccion), corrida por corrida."""
+    regresiones = []
+    for i, (actual, previa) in enumerate(zip(reporte["corridas"], base.get("corridas", [])), 1):
+        for nombre, e in actual["etapas"].items():
+            p = previa["etapas"].get(nombre)
+            if not p or p["segundos"] < 0.05:  # etapas casi vacias: solo ruido
+                continue
+            if e["segundos"] > p["segundos"] * (1 + tolerancia):
+                regresiones.append(f"corrida {i} {nombre}: {p['segundos']} s -> {e['segundos']} s")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de punta a punta del pipeline")
+    parser.add_argument("--orthanc", help="URL de un Orthanc existente (si no, se levanta el falso)")
+    parser.add_argument("--estudios", type=int, default=10)
+    parser.add_argument("--series-ct", type=int, default=3)
+    parser.add_argument("--cortes", type=int, default=40)
+    parser.add_argument("--matriz", type=int, default=128)
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--latencia-ms", type=float, default=0.0, help="demora por request del Orthanc falso")
+    parser.add_argument("--fallas", type=float, default=0.0, help="fraccion de 503 del Orthanc falso")
+    parser.add_argument("--mongo", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="DMSBenchE2E")
+    parser.add_argument("--limpiar", action="store_true", help="elimina la base --db antes de empezar")
+    parser.add_argument("--corridas", type=int, default=2, help="la primera en frio, las siguientes incrementales")
+    parser.add_argument("--reexportar", action="store_true",
+                        help="borra los JSON exportados antes de cada corrida (mide la cache local de DICOM)")
+    parser.add_argument("--directorio", action="store_true",
+                        help="exporta el catalogo a .dcm y lo procesa desde disco (fuentes/directorio.py)")
+    parser.add_argument("--trabajo", help="directorio de salida del pipeline (por defecto, uno temporal)")
+    parser.add_argument("--salida", help="guardar el reporte en JSON")
+    parser.add_argument("--base", help="reporte JSON previo para detectar regresiones")
+    parser.add_argument("--tolerancia", type=float, default=0.25)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    base = json.loads(Path(args.base).read_text()) if args.base else None
+    salida = Path(args.salida).resolve() if args.salida else None
+
+    if args.limpiar:
+        MongoClient(args.mongo).drop_database(args.db)
+
+    servidor = None
+    catalogo = None
+    if args.orthanc:
+        url = args.orthanc
+    else:
+        t0 = time.perf_counter()
+        catalogo = Catalogo(args.estudios, args.series_ct, args.cortes, args.matriz, args.semilla)
+        servidor = OrthancFalso(catalogo, latencia_ms=args.latencia_ms, fallas=args.fallas).iniciar()
+        url = servidor.url
+        logger.info("[OK] Orthanc falso en %s (%.1f s) | %s", url, time.perf_counter() - t0, catalogo.resumen())
+
+    trabajo = Path(args.trabajo or tempfile.mkdtemp(prefix="dms_e2e_"))
+    trabajo.mkdir(parents=True, exist_ok=True)
+    launcher = preparar_entorno(url, args.mongo, args.db, trabajo)
+    directorio = None
+    if args.directorio:
+        if catalogo is None:
+            parser.error("--directorio necesita el Orthanc falso (sin --orthanc)")
+        directorio = trabajo / "exportacion"
+        logger.info("[OK] %d instancia(s) exportadas en '%s'", catalogo.exportar(directorio), directorio)
+
+    reporte: Dict[str, Any] = {
+        "orthanc": url,
+        "catalogo": catalogo.resumen() if catalogo else None,
+        "trabajo": str(trabajo),
+        "corridas": [],
+    }
+    try:
+        for _ in range(max(1, args.corridas)):
+            if args.reexportar:
+                for salida_etapa in ("ocr_output", "header_ct", "header_pet"):
+                    for json_exportado in (trabajo / salida_etapa).glob("*.json"):
+                        json_exportado.unlink()
+            reporte["corridas"].append(correr(launcher, directorio))
+    finally:
+        if servidor is not None:
+            reporte["servidor"] = servidor.contadores.foto()
+            servidor.detener()
+    from orthanc.acceso import metricas  # mismo proceso que el pipeline: reintentos, limite AIMD, circuito
+
+    from orthanc.cache import estadisticas
+    from orthanc import metadatos
+
+    reporte["orthanc_acceso"] = metricas()
+    reporte["metadatos_orthanc"] = metadatos.estadisticas()  # de la ultima corrida
+    reporte["cache_dicom"] = estadisticas()
+    # ru_maxrss viene en KB en Linux
+    reporte["rss_pico_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    imprimir(reporte)
+    if salida:
+        salida.write_text(json.dumps(reporte, indent=2, ensure_ascii=False))
+
+    if base:
+        regresiones = comparar(reporte, base, args.tolerancia)
+        for linea in regresiones:
+            print(f"[REGRESION] {linea}")
+        if regresiones:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
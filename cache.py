@@ -0,0 +1,46 @@
+"""
+Cache en memoria (por proceso) para respuestas de la API.
+
+Cada entrada vive `ttl` segundos y el cache guarda como maximo `max_items`
+entradas, descartando la menos usada recientemente.
+"""
+
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Hashable, Optional
+
+
+class CacheTTL:
+    """Diccionario LRU con expiracion por entrada."""
+
+    def __init__(self, ttl: float, max_items: int = 256):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._datos: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, clave: Hashable) -> Optional[Any]:
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None or entrada[0] < time.monotonic():
+                if entrada is not None:
+                    del self._datos[clave]
+                self.misses += 1
+                return None
+            self._datos.move_to_end(clave)
+            self.hits += 1
+            return entrada[1]
+
+    def set(self, clave: Hashable, valor: Any) -> None:
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + self.ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_items:
+                self._datos.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._datos.clear()
@@ -0,0 +1,295 @@
+"""
+Filtros, proyecciones y paginacion para los endpoints de lectura (/ct, /ocr, /pet, /vtl).
+
+Cada coleccion guarda los tags DICOM en una ruta distinta, por lo que los
+filtros se traducen a rutas concretas segun el rol logico de la coleccion.
+La paginacion es por keyset sobre `_id` (ascendente): el cliente envia el
+`next_cursor` recibido para pedir la pagina siguiente. La sincronizacion
+incremental (`since`) usa en cambio la secuencia de ingesta `_ingest.seq`.
+"""
+
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from DMS_pipeline.mongo.indexes import TAGS_OCR, TAGS_SERIES, normalizar_texto
+
+
+class ConsultaInvalida(ValueError):
+    """Parametro de consulta invalido (la API responde 400)."""
+
+
+# Limite maximo por pagina, sin importar lo que pida el cliente
+MAX_LIMIT = int(os.getenv("API_MAX_LIMIT", "5000"))
+
+TAG_RE = re.compile(r"^[0-9A-Fa-f]{4},[0-9A-Fa-f]{4}$")
+_HEX4_RE = re.compile(r"^[0-9A-Fa-f]{4}$")
+
+
+def _tag(base: str, tag: str) -> str:
+    return f"{base}.{tag}.Value"
+
+
+# Rutas por rol de coleccion. `limite` es el tamano de pagina por defecto
+# (coincide con los topes historicos de cada endpoint).
+RUTAS: Dict[str, Dict[str, Any]] = {
+    "ct": {
+        "tags": TAGS_SERIES,
+        "fecha": _tag(TAGS_SERIES, "0008,0020"),
+        "protocolo": _tag(TAGS_SERIES, "0018,1030"),
+        "descripcion": _tag(TAGS_SERIES, "0008,103e"),
+        "paciente": "patient.patient_name",
+        "limite": 3000,
+    },
+    "pet": {
+        "tags": TAGS_SERIES,
+        "fecha": _tag(TAGS_SERIES, "0008,0020"),
+        "protocolo": _tag(TAGS_SERIES, "0018,1030"),
+        "descripcion": _tag(TAGS_SERIES, "0008,103e"),
+        "paciente": "patient.patient_name",
+        "limite": 1000,
+    },
+    "ocr": {
+        "tags": TAGS_OCR,
+        "fecha": _tag(TAGS_OCR, "0008,0020"),
+        "protocolo": "encabezado.Exam Description",
+        "descripcion": _tag(TAGS_OCR, "0008,1030"),
+        "paciente": "encabezado.Patient Name",
+        "limite": 1000,
+    },
+}
+
+
+def normalizar_fecha(valor: Optional[str]) -> Optional[str]:
+    """Acepta YYYYMMDD o YYYY-MM-DD y devuelve el formato DICOM (YYYYMMDD)."""
+    if not valor:
+        return None
+    texto = valor.strip()
+    for formato in ("%Y%m%d", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(texto, formato).strftime("%Y%m%d")
+        except ValueError:
+            continue
+    raise ConsultaInvalida(f"Fecha inválida: '{valor}' (use YYYYMMDD o YYYY-MM-DD)")
+
+
+def _contiene(texto: str) -> Dict[str, Any]:
+    return {"$regex": re.escape(texto.strip()), "$options": "i"}
+
+
+def construir_filtro(
+    rol: str,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    protocol: Optional[str] = None,
+    description: Optional[str] = None,
+    patient: Optional[str] = None,
+    cursor: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Traduce los parametros de la API a un filtro de Mongo.
+
+    - Fechas: rango inclusivo sobre StudyDate (string DICOM, comparacion lexicografica).
+    - protocol: igualdad exacta (usa el indice de protocolo).
+    - description / patient: contiene, sin distinguir mayusculas.
+    - cursor: `_id` del ultimo documento de la pagina anterior.
+    """
+    rutas = RUTAS[rol]
+    filtro: Dict[str, Any] = {}
+
+    desde = normalizar_fecha(date_from)
+    hasta = normalizar_fecha(date_to)
+    if desde or hasta:
+        rango: Dict[str, str] = {}
+        if desde:
+            rango["$gte"] = desde
+        if hasta:
+            rango["$lte"] = hasta
+        filtro[rutas["fecha"]] = rango
+
+    if protocol:
+        filtro[rutas["protocolo"]] = protocol.strip()
+    if description:
+        filtro[rutas["descripcion"]] = _contiene(description)
+    if patient:
+        filtro[rutas["paciente"]] = _contiene(patient)
+
+    if cursor:
+        try:
+            filtro["_id"] = {"$gt": ObjectId(cursor)}
+        except (InvalidId, TypeError):
+            raise ConsultaInvalida(f"Cursor inválido: '{cursor}'") from None
+
+    return filtro
+
+
+def _separar_campos(fields: str) -> List[str]:
+    """Separa por comas re-uniendo los tags 'gggg,eeee' que quedan partidos en dos."""
+    partes = [p.strip() for p in fields.split(",")]
+    campos: List[str] = []
+    i = 0
+    while i < len(partes):
+        actual = partes[i]
+        if _HEX4_RE.match(actual) and i + 1 < len(partes) and _HEX4_RE.match(partes[i + 1]):
+            campos.append(f"{actual},{partes[i + 1]}")
+            i += 2
+            continue
+        if actual:
+            campos.append(actual)
+        i += 1
+    return campos
+
+
+def construir_proyeccion(rol: str, fields: Optional[str]) -> Optional[Dict[str, int]]:
+    """Convierte una lista separada por comas en una proyeccion de Mongo.
+
+    Los tags con formato 'gggg,eeee' (hex en minusculas, como los entrega
+    Orthanc) se resuelven a la ruta de tags de la coleccion; el resto se toma
+    como ruta con puntos. Si se piden una ruta y una sub-ruta, se conserva
+    solo la mas general (Mongo rechaza la colision).
+    Sin `fields` se devuelve el documento completo.
+    """
+    if not fields:
+        return None
+
+    rutas: List[str] = []
+    for campo in _separar_campos(fields):
+        if TAG_RE.match(campo):
+            rutas.append(f"{RUTAS[rol]['tags']}.{campo.lower()}")
+        elif campo.startswith("$") or ".." in campo:
+            raise ConsultaInvalida(f"Campo inválido: '{campo}'")
+        else:
+            rutas.append(campo)
+
+    if not rutas:
+        return None
+
+    rutas = sorted(set(rutas))
+    finales: List[str] = []
+    for ruta in rutas:
+        if not any(ruta.startswith(f"{previa}.") for previa in finales):
+            finales.append(ruta)
+    return {ruta: 1 for ruta in finales}
+
+
+def resolver_limite(rol: str, limit: Optional[int]) -> int:
+    """Tamano de pagina: el del cliente acotado a [1, MAX_LIMIT]."""
+    if limit is None:
+        return min(RUTAS[rol]["limite"], MAX_LIMIT)
+    if limit < 1:
+        raise ConsultaInvalida("limit debe ser mayor que cero")
+    return min(limit, MAX_LIMIT)
+
+
+def normalizar_since(since: Optional[str]) -> Optional[int]:
+    """Cursor de sincronizacion: ultima secuencia de ingesta vista (0 = desde el inicio)."""
+    if since is None:
+        return None
+    try:
+        valor = int(since)
+    except ValueError:
+        raise ConsultaInvalida(f"since inválido: '{since}'") from None
+    if valor < 0:
+        raise ConsultaInvalida("since no puede ser negativo")
+    return valor
+
+
+def filtro_delta(filtro: Dict[str, Any], since: int, hasta: int) -> Dict[str, Any]:
+    """Cambios con secuencia en (since, hasta]; `hasta` es la marca de agua del rol."""
+    return {**filtro, "_ingest.seq": {"$gt": since, "$lte": hasta}}
+
+
+def proyeccion_delta(proyeccion: Optional[Dict[str, int]]) -> Optional[Dict[str, int]]:
+    """Asegura que la secuencia de ingesta venga en la respuesta (la necesita el cursor)."""
+    if proyeccion is None or "_ingest" in proyeccion:
+        return proyeccion
+    return {**proyeccion, "_ingest.seq": 1}
+
+
+def construir_filtro_vtl(
+    protocol: Optional[str] = None,
+    description: Optional[str] = None,
+    weight_min: Optional[float] = None,
+    weight_max: Optional[float] = None,
+    scan_length_min: Optional[float] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    description_exact: bool = False,
+) -> Dict[str, Any]:
+    """Filtro sobre la coleccion VTL (campos tipados, ver DMS_pipeline/mongo/vtl.py).
+
+    - protocol: igualdad sobre el protocolo normalizado (indice protocol_weight).
+    - description: contiene, sobre la descripcion de serie normalizada
+      (con description_exact, igualdad).
+    - weight_min/weight_max: rango inclusivo de peso en kg.
+    - scan_length_min: largo minimo del rango de escaneo en mm.
+    - date_from/date_to: rango inclusivo de fecha de estudio.
+    """
+    filtro: Dict[str, Any] = {}
+    if protocol:
+        filtro["protocol_norm"] = normalizar_texto(protocol)
+    if description:
+        texto = normalizar_texto(description)
+        filtro["series_description_norm"] = texto if description_exact else {"$regex": re.escape(texto)}
+
+    peso: Dict[str, float] = {}
+    if weight_min is not None:
+        peso["$gte"] = weight_min
+    if weight_max is not None:
+        peso["$lte"] = weight_max
+    if peso:
+        filtro["patient_weight_kg"] = peso
+
+    if scan_length_min is not None:
+        filtro["scan_length_mm"] = {"$gte": scan_length_min}
+
+    desde = normalizar_fecha(date_from)
+    hasta = normalizar_fecha(date_to)
+    if desde or hasta:
+        rango: Dict[str, datetime] = {}
+        if desde:
+            rango["$gte"] = datetime.strptime(desde, "%Y%m%d")
+        if hasta:
+            rango["$lt"] = datetime.strptime(hasta, "%Y%m%d") + timedelta(days=1)
+        filtro["study_ts"] = rango
+
+    return filtro
+
+
+def agregacion_tendencias_runs(desde: datetime) -> List[Dict[str, Any]]:
+    """Resumen diario por etapa y origen de las corridas del pipeline (ver DMS_pipeline/telemetria.py).
+
+    Un scan de evento de pocos estudios y un ciclo del scheduler no son
+    comparables: el origen entra en la clave, sin el sufijo de nodo o ruta
+    ("worker:host:pid" -> "worker", "directorio:/ruta" -> "directorio").
+    """
+    etapa = "$etapas"
+    return [
+        {"$match": {"inicio": {"$gte": desde}}},
+        {"$unwind": etapa},
+        {"$group": {
+            "_id": {
+                "etapa": f"{etapa}.nombre",
+                "origen": {"$arrayElemAt": [{"$split": [{"$ifNull": ["$origen", "manual"]}, ":"]}, 0]},
+                "dia": {"$dateToString": {"format": "%Y-%m-%d", "date": "$inicio"}},
+            },
+            "corridas": {"$sum": 1},
+            "errores": {"$sum": {"$cond": [{"$eq": [f"{etapa}.estado", "ok"]}, 0, 1]}},
+            "wall_s_prom": {"$avg": f"{etapa}.wall_s"},
+            "wall_s_max": {"$max": f"{etapa}.wall_s"},
+            "cpu_s_prom": {"$avg": f"{etapa}.cpu_s"},
+            "estudios_revisados_prom": {"$avg": f"{etapa}.estudios_revisados"},
+            "series_revisadas_prom": {"$avg": f"{etapa}.series_revisadas"},
+            "series_procesadas": {"$sum": f"{etapa}.series_procesadas"},
+            "estudios_procesados": {"$sum": f"{etapa}.estudios_procesados"},
+            "orthanc_requests": {"$sum": f"{etapa}.orthanc_requests"},
+            "orthanc_bytes": {"$sum": f"{etapa}.orthanc_bytes"},
+            "ocr_inferencia_s": {"$sum": f"{etapa}.ocr_inferencia_s"},
+            "docs_escritos": {"$sum": f"{etapa}.docs_escritos"},
+            "rss_pico_mb": {"$max": f"{etapa}.rss_pico_mb"},
+        }},
+        {"$sort": {"_id.etapa": 1, "_id.origen": 1, "_id.dia": 1}},
+    ]
@@ -0,0 +1,336 @@
+"""
+Agregados para los dashboards calculados en el servidor con numpy.
+
+Reemplaza los calculos que hacian los html sobre colecciones completas
+(quantile, xbinsFromFD, weeklyMovingMedian): la API lee solo los campos
+tipados necesarios y devuelve numeros agregados.
+
+Metricas disponibles:
+    ctdivol, dlp   -> coleccion VTL (OCR x CT por serie)
+    gni, activity  -> coleccion PET (pet_quality y dosis inyectada en mCi)
+"""
+
+import math
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from consultas import (
+    RUTAS,
+    ConsultaInvalida,
+    construir_filtro,
+    construir_filtro_vtl,
+    normalizar_texto,
+)
+from DMS_pipeline.mongo.indexes import TAGS_SERIES
+
+
+BQ_POR_MCI = 3.7e7
+_EPOCH = datetime(1970, 1, 1)
+
+METRICAS: Dict[str, str] = {
+    "ctdivol": "vtl",
+    "dlp": "vtl",
+    "gni": "pet",
+    "activity": "pet",
+}
+
+_TAG_RADIOFARMACO = "0054,0016"
+_TAG_DOSIS_TOTAL = "0018,1074"
+_PROYECCION_PET = {
+    "pet_quality.gni_suvbw": 1,
+    **{
+        f"{TAGS_SERIES}.{tag}": 1
+        for tag in ("0008,0020", "0008,0032", "0010,1030", "0018,1030", _TAG_RADIOFARMACO)
+    },
+}
+
+
+def fuente_metrica(metric: str) -> str:
+    fuente = METRICAS.get(metric)
+    if fuente is None:
+        raise ConsultaInvalida(f"Métrica desconocida: '{metric}' (use {', '.join(METRICAS)})")
+    return fuente
+
+
+def parse_lista_numeros(texto: Optional[str], nombre: str) -> List[float]:
+    """'50,60,70' -> [50.0, 60.0, 70.0] (ordenada)."""
+    if not texto:
+        return []
+    try:
+        return sorted(float(x) for x in texto.split(",") if x.strip())
+    except ValueError:
+        raise ConsultaInvalida(f"{nombre} debe ser una lista de números separados por coma") from None
+
+
+# ---------- Estadistica ----------
+
+def _f(valor) -> Optional[float]:
+    """numpy -> float JSON (None si no es finito)."""
+    if valor is None:
+        return None
+    valor = float(valor)
+    return valor if math.isfinite(valor) else None
+
+
+def cuantiles(valores: np.ndarray, percentiles: Sequence[float]) -> Dict[str, Optional[float]]:
+    """Percentiles con interpolacion lineal (igual que quantile() de los dashboards)."""
+    if valores.size == 0:
+        return {f"p{p:g}": None for p in percentiles}
+    calculados = np.percentile(valores, list(percentiles))
+    return {f"p{p:g}": _f(v) for p, v in zip(percentiles, calculados)}
+
+
+def nice_step(paso: float) -> Optional[float]:
+    """Redondea un ancho de bin a 1, 2, 5 o 10 x 10^k."""
+    if not math.isfinite(paso) or paso <= 0:
+        return None
+    potencia = 10 ** math.floor(math.log10(paso))
+    norma = paso / potencia
+    for nice in (1, 2, 5):
+        if norma <= nice:
+            return nice * potencia
+    return 10 * potencia
+
+
+def bins_fd(valores: np.ndarray) -> Optional[Dict[str, float]]:
+    """Bins de Freedman-Diaconis alineados a un paso 'redondo' (xbinsFromFD)."""
+    if valores.size < 2:
+        return None
+    q1, q3 = np.percentile(valores, [25, 75])
+    minimo, maximo = float(valores.min()), float(valores.max())
+    paso = (
+        nice_step(2 * (q3 - q1) / np.cbrt(valores.size))
+        or nice_step((maximo - minimo) / 12)
+        or 1.0
+    )
+    return {
+        "start": math.floor(minimo / paso) * paso,
+        "end": math.ceil(maximo / paso) * paso,
+        "size": paso,
+    }
+
+
+def histograma(valores: np.ndarray, subdivisiones: int = 1) -> Dict[str, Any]:
+    """Conteos sobre los bins de Freedman-Diaconis, con n, minimo, maximo y cuartiles.
+
+    `subdivisiones` parte cada bin en partes iguales (los dashboards usaban
+    el ancho FD / 4 o / 2 para un histograma mas fino).
+    """
+    bins = bins_fd(valores)
+    if bins is not None and subdivisiones > 1:
+        bins = {**bins, "size": bins["size"] / subdivisiones}
+    resumen: Dict[str, Any] = {
+        "n": int(valores.size),
+        "min": _f(valores.min()) if valores.size else None,
+        "max": _f(valores.max()) if valores.size else None,
+        "bins": bins,
+        "counts": [],
+    }
+    resumen.update(cuantiles(valores, (25, 50, 75)))
+    if bins is None:
+        return resumen
+    n_bins = max(1, int(round((bins["end"] - bins["start"]) / bins["size"])))
+    edges = bins["start"] + bins["size"] * np.arange(n_bins + 1)
+    counts, _ = np.histogram(valores, bins=edges)
+    resumen["counts"] = counts.tolist()
+    return resumen
+
+
+def mediana_movil(
+    ts: np.ndarray,
+    valores: np.ndarray,
+    window_days: float,
+    bucket_days: float,
+    min_count: int,
+) -> List[Dict[str, Any]]:
+    """Mediana en una ventana centrada, evaluada cada `bucket_days` dias.
+
+    `ts` en segundos epoch. Un bucket sin al menos `min_count` valores en la
+    ventana devuelve mediana None (igual que weeklyMovingMedian).
+    """
+    if ts.size == 0:
+        return []
+    orden = np.argsort(ts)
+    ts, valores = ts[orden], valores[orden]
+    medio = window_days * 86400 / 2
+    paso = bucket_days * 86400
+    inicio = math.floor(ts[0] / paso) * paso
+    centros = np.arange(inicio + paso / 2, ts[-1] + paso, paso)
+    lo = np.searchsorted(ts, centros - medio, side="left")
+    hi = np.searchsorted(ts, centros + medio, side="right")
+
+    puntos = []
+    for centro, a, b in zip(centros, lo, hi):
+        n = int(b - a)
+        puntos.append({
+            "t": (_EPOCH + timedelta(seconds=float(centro))).isoformat(),
+            "mediana": _f(np.median(valores[a:b])) if n >= min_count else None,
+            "n": n,
+        })
+    return puntos
+
+
+def etiqueta_banda(peso: float, bordes: Sequence[float]) -> str:
+    if not math.isfinite(peso):
+        return "sin_peso"
+    if not bordes:
+        return "todos"
+    i = int(np.searchsorted(bordes, peso, side="right"))
+    if i == 0:
+        return f"<{bordes[0]:g}"
+    if i == len(bordes):
+        return f">={bordes[-1]:g}"
+    return f"{bordes[i - 1]:g}-{bordes[i]:g}"
+
+
+def _orden_bandas(bordes: Sequence[float]) -> List[str]:
+    """Etiquetas de banda de menor a mayor peso (como las genera etiqueta_banda)."""
+    if not bordes:
+        return ["todos", "sin_peso"]
+    return (
+        [f"<{bordes[0]:g}"]
+        + [f"{a:g}-{b:g}" for a, b in zip(bordes, bordes[1:])]
+        + [f">={bordes[-1]:g}", "sin_peso"]
+    )
+
+
+# ---------- Lectura de datos tipados ----------
+
+def valor_tag(tags: Dict[str, Any], tag: str) -> Any:
+    valor = (tags or {}).get(tag)
+    if isinstance(valor, dict):
+        valor = valor.get("Value")
+    return valor
+
+
+def numero(valor: Any) -> float:
+    try:
+        return float(str(valor).strip())
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def ts_dicom(fecha: Any, hora: Any) -> float:
+    if not isinstance(fecha, str) or len(fecha) < 8:
+        return math.nan
+    hora = (hora if isinstance(hora, str) else "").split(".")[0].ljust(6, "0")
+    try:
+        dt = datetime(int(fecha[0:4]), int(fecha[4:6]), int(fecha[6:8]),
+                      int(hora[0:2]), int(hora[2:4]), int(hora[4:6]))
+    except ValueError:
+        return math.nan
+    return (dt - _EPOCH).total_seconds()
+
+
+def dosis_mci(tags: Dict[str, Any]) -> float:
+    secuencia = valor_tag(tags, _TAG_RADIOFARMACO)
+    if isinstance(secuencia, list) and secuencia and isinstance(secuencia[0], dict):
+        return numero(valor_tag(secuencia[0], _TAG_DOSIS_TOTAL)) / BQ_POR_MCI
+    return math.nan
+
+
+async def cargar_datos(db, colecciones: Dict[str, str], metric: str, params: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """Lee los campos tipados de la metrica y devuelve arreglos numpy alineados.
+
+    Claves: ts (segundos epoch), valor, peso, protocolo. Los registros sin
+    valor finito se descartan.
+    """
+    fuente = fuente_metrica(metric)
+    filas: List[tuple] = []
+
+    if fuente == "vtl":
+        filtro = construir_filtro_vtl(
+            protocol=params.get("protocol"),
+            description=params.get("description"),
+            weight_min=params.get("weight_min"),
+            weight_max=params.get("weight_max"),
+            scan_length_min=params.get("scan_length_min"),
+            date_from=params.get("date_from"),
+            date_to=params.get("date_to"),
+            description_exact=bool(params.get("description_exact")),
+        )
+        if params.get("exclude_description"):
+            filtro.setdefault("$and", []).append(
+                {"series_description_norm": {"$ne": normalizar_texto(params["exclude_description"])}}
+            )
+        filtro[metric] = {"$type": "number"}
+        proyeccion = {"_id": 0, metric: 1, "study_ts": 1, "patient_weight_kg": 1, "protocol_norm": 1}
+        async for d in db[colecciones["vtl"]].find(filtro, proyeccion):
+            ts = d.get("study_ts")
+            filas.append((
+                (ts - _EPOCH).total_seconds() if ts else math.nan,
+                d.get(metric),
+                d.get("patient_weight_kg") if d.get("patient_weight_kg") is not None else math.nan,
+                d.get("protocol_norm") or "",
+            ))
+    else:
+        filtro = construir_filtro(
+            "pet",
+            date_from=params.get("date_from"),
+            date_to=params.get("date_to"),
+            protocol=params.get("protocol"),
+            description=params.get("description"),
+        )
+        if params.get("exclude_description"):
+            # Igualdad sin distinguir mayusculas ni espacios en los bordes (p. ej. PET-AC-SF)
+            excluida = re.compile(rf"^\s*{re.escape(params['exclude_description'].strip())}\s*$", re.IGNORECASE)
+            filtro.setdefault("$and", []).append({RUTAS["pet"]["descripcion"]: {"$not": excluida}})
+        async for d in db[colecciones["pet"]].find(filtro, _PROYECCION_PET):
+            tags = (d.get("first_instance") or {}).get("dicom_tags") or {}
+            if metric == "gni":
+                valor = numero(((d.get("pet_quality") or {}).get("gni_suvbw")))
+            else:
+                valor = dosis_mci(tags)
+            filas.append((
+                ts_dicom(valor_tag(tags, "0008,0020"), valor_tag(tags, "0008,0032")),
+                valor,
+                numero(valor_tag(tags, "0010,1030")),
+                str(valor_tag(tags, "0018,1030") or "").strip().upper(),
+            ))
+
+    if not filas:
+        vacio = np.empty(0)
+        return {"ts": vacio, "valor": vacio, "peso": vacio, "protocolo": np.empty(0, dtype=object)}
+
+    ts, valor, peso, protocolo = zip(*filas)
+    datos = {
+        "ts": np.asarray(ts, dtype=float),
+        "valor": np.asarray(valor, dtype=float),
+        "peso": np.asarray(peso, dtype=float),
+        "protocolo": np.asarray(protocolo, dtype=object),
+    }
+    validos = np.isfinite(datos["valor"])
+    if fuente == "pet":
+        # En PET el rango de peso se aplica aqui (el peso es texto en los tags)
+        if params.get("weight_min") is not None:
+            validos &= datos["peso"] >= params["weight_min"]
+        if params.get("weight_max") is not None:
+            validos &= datos["peso"] <= params["weight_max"]
+    return {k: v[validos] for k, v in datos.items()}
+
+
+def percentiles_por_grupo(
+    datos: Dict[str, np.ndarray],
+    bordes_peso: Sequence[float],
+    percentiles: Sequence[float],
+) -> List[Dict[str, Any]]:
+    """Percentiles (p. ej. mediana = valor tipico local, p75 = DRL) por protocolo y banda de peso."""
+    if datos["valor"].size == 0:
+        return []
+    bandas = np.array([etiqueta_banda(p, bordes_peso) for p in datos["peso"]], dtype=object)
+    grupos = []
+    for protocolo in sorted(set(datos["protocolo"])):
+        en_protocolo = datos["protocolo"] == protocolo
+        presentes = set(bandas[en_protocolo])
+        for banda in [b for b in _orden_bandas(bordes_peso) if b in presentes]:
+            valores = datos["valor"][en_protocolo & (bandas == banda)]
+            grupos.append({
+                "protocol": protocolo,
+                "weight_band": banda,
+                "n": int(valores.size),
+                **cuantiles(valores, percentiles),
+            })
+    return grupos
@@ -0,0 +1,280 @@
+"""
+Exportacion columnar (Parquet / Arrow IPC) de los campos tipados por serie.
+
+Datasets:
+    vtl -> series CT con dosis OCR (coleccion VTL)
+    pet -> series PET con GNI, cobertura y actividad inyectada
+
+Los documentos se leen del cursor de Mongo y se escriben en row groups de
+`EXPORT_ROW_GROUP` filas, de modo que ni la API ni la CLI acumulan el
+dataset completo en memoria.
+
+Uso (CLI):
+    python exportacion.py vtl --desde 2023-01-01 --hasta 2024-12-31 -o vtl.parquet
+    python exportacion.py pet --formato arrow -o pet.arrow
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from consultas import ConsultaInvalida, construir_filtro, construir_filtro_vtl
+from DMS_pipeline.mongo.indexes import TAGS_SERIES
+import estadisticas
+
+
+logger = logging.getLogger(__name__)
+
+EXPORT_ROW_GROUP = int(os.getenv("EXPORT_ROW_GROUP", "10000"))
+
+FORMATOS = {
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+}
+
+_EPOCH = datetime(1970, 1, 1)
+
+SCHEMAS: Dict[str, pa.Schema] = {
+    "vtl": pa.schema([
+        ("exam_no", pa.string()),
+        ("patient_name", pa.string()),
+        ("study_instance_uid", pa.string()),
+        ("series_instance_uid", pa.string()),
+        ("series_number", pa.int32()),
+        ("series_description", pa.string()),
+        ("protocol_name", pa.string()),
+        ("protocol_norm", pa.string()),
+        ("patient_weight_kg", pa.float64()),
+        ("ctdivol", pa.float64()),
+        ("dlp", pa.float64()),
+        ("scan_range_mm", pa.string()),
+        ("scan_length_mm", pa.float64()),
+        ("study_ts", pa.timestamp("s")),
+        ("joined", pa.bool_()),
+    ]),
+    "pet": pa.schema([
+        ("patient_name", pa.string()),
+        ("study_instance_uid", pa.string()),
+        ("series_instance_uid", pa.string()),
+        ("series_number", pa.int32()),
+        ("series_description", pa.string()),
+        ("protocol_name", pa.string()),
+        ("patient_weight_kg", pa.float64()),
+        ("activity_mci", pa.float64()),
+        ("half_life_s", pa.float64()),
+        ("delta_t_s", pa.float64()),
+        ("gni_suvbw", pa.float64()),
+        ("coverage_mask_pct", pa.float64()),
+        ("pet_status", pa.string()),
+        ("study_ts", pa.timestamp("s")),
+    ]),
+}
+
+_TAGS_PET = ("0008,0020", "0008,0032", "0008,103e", "0010,1030", "0018,1030", "0020,0011", "0054,0016")
+PROYECCIONES: Dict[str, Dict[str, int]] = {
+    "vtl": {"_id": 0, **{campo: 1 for campo in SCHEMAS["vtl"].names}},
+    "pet": {
+        "_id": 0,
+        "patient.patient_name": 1,
+        "study.study_instance_uid": 1,
+        "series.series_instance_uid": 1,
+        "series.series_number": 1,
+        "pet_quality.status": 1,
+        "pet_quality.gni_suvbw": 1,
+        "pet_quality.coverage_mask_pct": 1,
+        "pet_quality.suv_meta": 1,
+        **{f"{TAGS_SERIES}.{tag}": 1 for tag in _TAGS_PET},
+    },
+}
+
+
+def _finito(valor: Any) -> Optional[float]:
+    valor = estadisticas.numero(valor)
+    return valor if valor == valor else None  # NaN -> None
+
+
+def _entero(valor: Any) -> Optional[int]:
+    valor = _finito(valor)
+    return int(valor) if valor is not None else None
+
+
+def fila_pet(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Campos tipados de una serie PET (suv_meta del pipeline; si falta, los tags)."""
+    tags = (doc.get("first_instance") or {}).get("dicom_tags") or {}
+    calidad = doc.get("pet_quality") or {}
+    suv = calidad.get("suv_meta") or {}
+    ts = estadisticas.ts_dicom(
+        estadisticas.valor_tag(tags, "0008,0020"), estadisticas.valor_tag(tags, "0008,0032")
+    )
+    actividad = _finito(suv.get("Ainj_Bq"))
+    actividad = actividad / estadisticas.BQ_POR_MCI if actividad is not None else _finito(estadisticas.dosis_mci(tags))
+    peso = _finito(suv.get("PatientWeight_kg"))
+    return {
+        "patient_name": (doc.get("patient") or {}).get("patient_name"),
+        "study_instance_uid": (doc.get("study") or {}).get("study_instance_uid"),
+        "series_instance_uid": (doc.get("series") or {}).get("series_instance_uid"),
+        "series_number": _entero((doc.get("series") or {}).get("series_number") or estadisticas.valor_tag(tags, "0020,0011")),
+        "series_description": estadisticas.valor_tag(tags, "0008,103e"),
+        "protocol_name": estadisticas.valor_tag(tags, "0018,1030"),
+        "patient_weight_kg": peso if peso is not None else _finito(estadisticas.valor_tag(tags, "0010,1030")),
+        "activity_mci": actividad,
+        "half_life_s": _finito(suv.get("HalfLife_s")),
+        "delta_t_s": _finito(suv.get("Delta_t_s")),
+        "gni_suvbw": _finito(calidad.get("gni_suvbw")),
+        "coverage_mask_pct": _finito(calidad.get("coverage_mask_pct")),
+        "pet_status": calidad.get("status"),
+        "study_ts": _EPOCH + timedelta(seconds=ts) if ts == ts else None,
+    }
+
+
+def _fila_vtl(doc: Dict[str, Any]) -> Dict[str, Any]:
+    fila = {campo: doc.get(campo) for campo in SCHEMAS["vtl"].names}
+    fila["series_number"] = _entero(fila["series_number"])
+    for campo in ("patient_weight_kg", "ctdivol", "dlp", "scan_length_mm"):
+        fila[campo] = _finito(fila[campo])
+    return fila
+
+
+_FILAS = {"vtl": _fila_vtl, "pet": fila_pet}
+
+
+def construir_consulta(dataset: str, date_from: Optional[str] = None, date_to: Optional[str] = None):
+    """(rol de coleccion, filtro, proyeccion) para un dataset y rango de fechas."""
+    if dataset == "vtl":
+        filtro = construir_filtro_vtl(date_from=date_from, date_to=date_to)
+    elif dataset == "pet":
+        filtro = construir_filtro("pet", date_from=date_from, date_to=date_to)
+    else:
+        raise ConsultaInvalida(f"Dataset desconocido: '{dataset}' (use {', '.join(SCHEMAS)})")
+    return dataset, filtro, PROYECCIONES[dataset]
+
+
+def validar_formato(formato: str) -> None:
+    if formato not in FORMATOS:
+        raise ConsultaInvalida(f"Formato desconocido: '{formato}' (use {', '.join(FORMATOS)})")
+
+
+class _Sumidero:
+    """Archivo de solo escritura que acumula bytes hasta que se vacian (para streaming)."""
+
+    def __init__(self):
+        self._partes: List[bytes] = []
+        self._posicion = 0
+        self.closed = False
+
+    def write(self, datos) -> int:
+        datos = bytes(datos)
+        self._partes.append(datos)
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self) -> int:
+        return self._posicion
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def vaciar(self) -> bytes:
+        datos = b"".join(self._partes)
+        self._partes = []
+        return datos
+
+
+class EscritorColumnar:
+    """Escribe lotes de documentos como row groups Parquet o record batches Arrow.
+
+    `sink` puede ser una ruta o un objeto con write(); sin `sink` los bytes
+    quedan en memoria y se obtienen con `vaciar()` despues de cada lote.
+    """
+
+    def __init__(self, dataset: str, formato: str = "parquet", sink=None):
+        validar_formato(formato)
+        self.dataset = dataset
+        self.schema = SCHEMAS[dataset]
+        self.filas = 0
+        self._sumidero = _Sumidero() if sink is None else None
+        destino = pa.PythonFile(self._sumidero, mode="w") if sink is None else sink
+        if formato == "parquet":
+            self._writer = pq.ParquetWriter(destino, self.schema, compression="zstd")
+        else:
+            self._writer = pa.ipc.new_stream(destino, self.schema)
+
+    def escribir(self, docs: Iterable[Dict[str, Any]]) -> None:
+        filas = [_FILAS[self.dataset](d) for d in docs]
+        if not filas:
+            return
+        tabla = pa.Table.from_pylist(filas, schema=self.schema)
+        self._writer.write_table(tabla)
+        self.filas += len(filas)
+
+    def cerrar(self) -> None:
+        self._writer.close()
+
+    def vaciar(self) -> bytes:
+        return self._sumidero.vaciar() if self._sumidero else b""
+
+
+async def exportar_stream(db, colecciones: Dict[str, str], dataset: str, formato: str, filtro, proyeccion):
+    """Generador asincrono de bytes: un row group por cada `EXPORT_ROW_GROUP` documentos.
+
+    La conversion y la codificacion de cada lote (Arrow, zstd) corren en un
+    hilo (asyncio.to_thread) para no bloquear el event loop mientras dura la
+    exportacion; los lotes de un mismo escritor se procesan de a uno.
+    """
+    escritor = EscritorColumnar(dataset, formato)
+    cursor = db[colecciones[dataset]].find(filtro, proyeccion).batch_size(EXPORT_ROW_GROUP)
+    lote: List[Dict[str, Any]] = []
+    async for doc in cursor:
+        lote.append(doc)
+        if len(lote) >= EXPORT_ROW_GROUP:
+            await asyncio.to_thread(escritor.escribir, lote)
+            lote = []
+            yield escritor.vaciar()
+    await asyncio.to_thread(escritor.escribir, lote)
+    await asyncio.to_thread(escritor.cerrar)
+    yield escritor.vaciar()
+
+
+def exportar_archivo(db, colecciones: Dict[str, str], dataset: str, formato: str, ruta: str,
+                     date_from: Optional[str] = None, date_to: Optional[str] = None) -> int:
+    """Variante sincrona (pymongo) para la CLI. Devuelve la cantidad de filas escritas."""
+    _, filtro, proyeccion = construir_consulta(dataset, date_from, date_to)
+    escritor = EscritorColumnar(dataset, formato, sink=ruta)
+    lote: List[Dict[str, Any]] = []
+    for doc in db[colecciones[dataset]].find(filtro, proyeccion).batch_size(EXPORT_ROW_GROUP):
+        lote.append(doc)
+        if len(lote) >= EXPORT_ROW_GROUP:
+            escritor.escribir(lote)
+            lote = []
+    escritor.escribir(lote)
+    escritor.cerrar()
+    return escritor.filas
+
+
+if __name__ == "__main__":
+    import pymongo
+
+    from seed_mongo import MONGO_URI, COLLECTIONS
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Exporta series tipadas a Parquet/Arrow")
+    parser.add_argument("dataset", choices=sorted(SCHEMAS))
+    parser.add_argument("--desde", help="fecha inicial (YYYY-MM-DD o YYYYMMDD)")
+    parser.add_argument("--hasta", help="fecha final inclusiva")
+    parser.add_argument("--formato", choices=sorted(FORMATOS), default="parquet")
+    parser.add_argument("-o", "--salida", help="archivo de salida (por defecto <dataset>.<formato>)")
+    args = parser.parse_args()
+
+    salida = args.salida or f"{args.dataset}.{FORMATOS[args.formato][1]}"
+    db = pymongo.MongoClient(MONGO_URI).get_default_database()
+    filas = exportar_archivo(db, COLLECTIONS, args.dataset, args.formato, salida, args.desde, args.hasta)
+    logger.info("[OK] %d filas exportadas a %s", filas, salida)
@@ -1,13 +1,38 @@
-from fastapi import FastAPI, Request
-from seed_mongo import db  # db:cliente de mongo.
+from fastapi import FastAPI, Request, Depends, HTTPException
+from fastapi.encoders import jsonable_encoder
+from seed_mongo import db, ensure_indexes, leer_seq_confirmada, leer_versiones, COLLECTIONS, VERSIONS_COLLECTION, RUNS_COLLECTION  # db:cliente de mongo.
+from consultas import (
+    ConsultaInvalida,
+    agregacion_tendencias_runs,
+    construir_filtro,
+    construir_filtro_vtl,
+    construir_proyeccion,
+    filtro_delta,
+    normalizar_since,
+    proyeccion_delta,
+    resolver_limite,
+    MAX_LIMIT,
+)
+from cache import CacheTTL
+import estadisticas
+import exportacion
+import metricas
 from typing import List, Dict, Any, Optional, Set
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from bson import ObjectId
+import orjson
+from pymongo.errors import OperationFailure
 from fastapi.staticfiles import StaticFiles
 import os
 from pathlib import Path
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
+import asyncio
+import hashlib
 import html as html_lib
+import time
+from threading import Lock
+import numpy as np
 import logging
 
 def _make_serializable(doc: dict) -> dict:
@@ -22,6 +47,22 @@ def _make_serializable(doc: dict) -> dict:
 
 app = FastAPI(title="API")
 
+# Cache de respuestas de lectura. La clave incluye la version de los datos de
+# cada coleccion usada (la incrementa el pipeline), asi que una carga nueva
+# invalida las entradas sin esperar el TTL.
+CACHE_RESPUESTAS = CacheTTL(
+    ttl=int(os.getenv("API_CACHE_TTL_SECONDS", "300")),
+    max_items=int(os.getenv("API_CACHE_MAX_ITEMS", "64")),
+)
+# Requests más lentos que esto (hasta los headers) se registran en el log
+SLOW_REQUEST_MS = float(os.getenv("API_SLOW_REQUEST_MS", "1000"))
+VERSION_POLL_SECONDS = float(os.getenv("API_VERSION_POLL_SECONDS", "5"))
+VERSIONES: Dict[str, int] = {}
+
+# format=ndjson: documentos por chunk (y batch_size del cursor de Mongo)
+STREAM_BATCH_SIZE = int(os.getenv("API_STREAM_BATCH_SIZE", "500"))
+FORMATOS = ("json", "ndjson")
+
 # [config]
 BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / "static"
@@ -48,43 +89,34 @@ def _is_hidden_or_ignored(name: str) -> bool:
     return name.startswith(".") or name.startswith("_")
 
 
-def extract_title(file_path: Path) -> Optional[str]:
+def read_html(file_path: Path) -> Optional[str]:
+    """Lee el archivo una sola vez; título, descripción y endpoints se extraen del texto."""
     try:
         with file_path.open("r", encoding="utf-8", errors="ignore") as f:
-            chunk = f.read(4096)  # ~4KB
-        m = TITLE_RE.search(chunk)
-        if not m:
-            return None
-        # Normalizar espacios y entidades HTML
-        title = html_lib.unescape(" ".join(m.group(1).split()))
-        return title if title else None
+            return f.read()
     except Exception as e:
-        LOGGER.warning("No se pudo extraer <title> de %s: %s", file_path, e)
+        LOGGER.warning("No se pudo leer %s: %s", file_path, e)
         return None
 
 
-def extract_description(file_path: Path) -> Optional[str]:
-    try:
-        with file_path.open("r", encoding="utf-8", errors="ignore") as f:
-            chunk = f.read(8192)
-        m = META_DESC_RE.search(chunk)
-        if not m:
-            return None
-        desc = html_lib.unescape(" ".join(m.group(1).split()))
-        return desc if desc else None
-    except Exception as e:
-        LOGGER.debug("No se pudo extraer meta description de %s: %s", file_path, e)
+def extract_title(content: str) -> Optional[str]:
+    m = TITLE_RE.search(content[:4096])  # ~4KB
+    if not m:
         return None
+    # Normalizar espacios y entidades HTML
+    title = html_lib.unescape(" ".join(m.group(1).split()))
+    return title if title else None
 
 
-def detect_endpoints(file_path: Path) -> List[str]:
-    try:
-        with file_path.open("r", encoding="utf-8", errors="ignore") as f:
-            content = f.read()
-    except Exception as e:
-        LOGGER.warning("No se pudo leer %s para detectar endpoints: %s", file_path, e)
-        return []
+def extract_description(content: str) -> Optional[str]:
+    m = META_DESC_RE.search(content[:8192])
+    if not m:
+        return None
+    desc = html_lib.unescape(" ".join(m.group(1).split()))
+    return desc if desc else None
+
 
+def detect_endpoints(content: str) -> List[str]:
     found: Set[str] = set()
     for pattern, key in KNOWN_ENDPOINTS.items():
         if pattern in content or pattern.replace("/", "\\/") in content:
@@ -92,12 +124,8 @@ def detect_endpoints(file_path: Path) -> List[str]:
     return sorted(found)
 
 
-def scan_static(static_dir: Path) -> List[Dict[str, Any]]:
-    items: List[Dict[str, Any]] = []
-    if not static_dir.exists():
-        LOGGER.warning("El directorio static no existe: %s", static_dir)
-        return items
-
+def _html_files(static_dir: Path):
+    """(ruta, ruta relativa, stat) de cada .html visible bajo static_dir."""
     for root, dirs, files in os.walk(static_dir):
         # Filtrar directorios ignorados
         dirs[:] = [d for d in dirs if not _is_hidden_or_ignored(d)]
@@ -111,25 +139,251 @@ def scan_static(static_dir: Path) -> List[Dict[str, Any]]:
                 rel_path = fpath.relative_to(static_dir)
             except Exception:
                 rel_path = Path(fname)
-
-            ruta_rel = rel_path.as_posix()
-            url = f"/static/{ruta_rel}"
+            try:
+                st = fpath.stat()
+            except OSError:
+                continue
+            yield fpath, rel_path, st
 
 
-            title = extract_title(fpath) or rel_path.stem
-            desc = extract_description(fpath)
+def _static_item(fpath: Path, rel_path: Path) -> Dict[str, Any]:
+    content = read_html(fpath) or ""
+    return {
+        "titulo": extract_title(content) or rel_path.stem,
+        "url": f"/static/{rel_path.as_posix()}",
+        "descripcion": extract_description(content),
+    }
 
-            items.append(
-                {
-                    "titulo": title,
-                    "url": url,
-                    "descripcion": desc,
-                }
-            )
 
+def _sort_items(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     # Orden: por título ascendente y luego por URL
-    items.sort(key=lambda x: (x.get("titulo", "").lower(), x.get("url", "")))
-    return items
+    return sorted(items, key=lambda x: (x.get("titulo", "").lower(), x.get("url", "")))
+
+
+def scan_static(static_dir: Path) -> List[Dict[str, Any]]:
+    if not static_dir.exists():
+        LOGGER.warning("El directorio static no existe: %s", static_dir)
+        return []
+    return _sort_items([_static_item(fpath, rel) for fpath, rel, _ in _html_files(static_dir)])
+
+
+class StaticCatalog:
+    """Catálogo de visualizaciones con el JSON y el HTML del índice ya renderizados.
+
+    Solo se revisa el disco cada `check_seconds` (stat de los .html, sin
+    leerlos); un archivo se vuelve a leer únicamente si cambió su mtime o
+    tamaño, y el índice se re-renderiza si cambió algún archivo.
+    """
+
+    def __init__(self, static_dir: Path, check_seconds: float):
+        self.static_dir = static_dir
+        self.check_seconds = check_seconds
+        self._lock = Lock()
+        self._checked_at = float("-inf")
+        self._signature: Optional[tuple] = None
+        self._files: Dict[str, tuple] = {}  # url -> (mtime_ns, size, item)
+        self.items: List[Dict[str, Any]] = []
+        self.json_body = b""
+        self.html_body = b""
+        self.json_etag = ""
+        self.html_etag = ""
+
+    def current(self, force: bool = False) -> "StaticCatalog":
+        with self._lock:
+            if not force and time.monotonic() - self._checked_at < self.check_seconds:
+                return self
+            self._checked_at = time.monotonic()
+            files = list(_html_files(self.static_dir)) if self.static_dir.exists() else []
+            signature = tuple(sorted((rel.as_posix(), st.st_mtime_ns, st.st_size) for _, rel, st in files))
+            if signature != self._signature:
+                self._rebuild(files)
+                self._signature = signature
+            return self
+
+    def _rebuild(self, files) -> None:
+        previous, self._files = self._files, {}
+        for fpath, rel, st in files:
+            url = f"/static/{rel.as_posix()}"
+            cached = previous.get(url)
+            if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+                self._files[url] = cached
+            else:
+                self._files[url] = (st.st_mtime_ns, st.st_size, _static_item(fpath, rel))
+        self.items = _sort_items([item for _, _, item in self._files.values()])
+        self.json_body = orjson.dumps({"items": self.items})
+        self.html_body = render_index(self.items).encode("utf-8")
+        self.json_etag = '"' + hashlib.blake2b(self.json_body, digest_size=16).hexdigest() + '"'
+        self.html_etag = '"' + hashlib.blake2b(self.html_body, digest_size=16).hexdigest() + '"'
+        LOGGER.info("Catálogo de /static actualizado: %d páginas", len(self.items))
+
+
+CATALOG = StaticCatalog(STATIC_DIR, float(os.getenv("STATIC_CATALOG_CHECK_SECONDS", "2")))
+
+
+@app.on_event("startup")
+def construir_catalogo():
+    CATALOG.current(force=True)
+
+
+async def _medir_streaming(cuerpo, inicio: float, metodo: str, ruta: str, estado: str):
+    """Reenvia el cuerpo contando bytes; registra tamaño y duracion al terminar (o si el cliente corta)."""
+    enviados = 0
+    try:
+        async for trozo in cuerpo:
+            enviados += len(trozo)
+            yield trozo
+    finally:
+        metricas.HTTP_BYTES.observar(float(enviados), ruta)
+        metricas.HTTP_STREAMING.observar(time.perf_counter() - inicio, metodo, ruta, estado)
+
+
+@app.middleware("http")
+async def medir_requests(request: Request, call_next):
+    """Latencia, tamaño de respuesta y requests lentos por ruta (plantilla, no URL)."""
+    inicio = time.perf_counter()
+    response = await call_next(request)
+    duracion = time.perf_counter() - inicio
+
+    ruta = getattr(request.scope.get("route"), "path", "sin_ruta")
+    metricas.HTTP_LATENCIA.observar(duracion, request.method, ruta, str(response.status_code))
+    largo = response.headers.get("content-length")
+    if largo is not None:
+        metricas.HTTP_BYTES.observar(float(largo), ruta)
+    elif hasattr(response, "body_iterator"):
+        # Streaming (NDJSON, exportaciones): bytes y tiempo total se conocen al enviar el ultimo trozo
+        response.body_iterator = _medir_streaming(
+            response.body_iterator, inicio, request.method, ruta, str(response.status_code),
+        )
+    if duracion * 1000 >= SLOW_REQUEST_MS:
+        metricas.HTTP_LENTAS.incrementar(ruta)
+        LOGGER.warning(
+            "Request lento: %s %s -> %s en %.0f ms",
+            request.method, request.url.path + (f"?{request.url.query}" if request.url.query else ""),
+            response.status_code, duracion * 1000,
+        )
+    return response
+
+
+@app.get("/metrics")
+def exponer_metricas():
+    return Response(content=metricas.exponer(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.on_event("startup")
+async def crear_indices():
+    # Crea índices de dedup/fecha/paciente/protocolo si no existen
+    try:
+        creados = await ensure_indexes()
+        LOGGER.info("Índices en MongoDB: %s", creados)
+    except Exception as e:
+        LOGGER.warning("No se pudieron crear índices en MongoDB: %s", e)
+
+
+async def _refrescar_versiones():
+    nuevas = await leer_versiones()
+    VERSIONES.clear()
+    VERSIONES.update(nuevas)
+
+
+async def _vigilar_versiones():
+    """Mantiene VERSIONES al día: change stream si Mongo lo permite (replica set), si no sondeo."""
+    try:
+        await _refrescar_versiones()
+        async with db[VERSIONS_COLLECTION].watch(full_document="updateLookup") as stream:
+            LOGGER.info("Versiones de datos: escuchando change stream de '%s'", VERSIONS_COLLECTION)
+            async for cambio in stream:
+                doc = cambio.get("fullDocument") or {}
+                if "_id" in doc:
+                    VERSIONES[doc["_id"]] = doc.get("version", 0)
+    except OperationFailure:
+        LOGGER.info("Versiones de datos: sin change streams, sondeo cada %ss", VERSION_POLL_SECONDS)
+    except Exception as e:
+        LOGGER.warning("Versiones de datos: change stream interrumpido (%s), se pasa a sondeo", e)
+
+    while True:
+        await asyncio.sleep(VERSION_POLL_SECONDS)
+        try:
+            await _refrescar_versiones()
+        except Exception as e:
+            LOGGER.warning("No se pudieron leer versiones de datos: %s", e)
+
+
+@app.on_event("startup")
+async def iniciar_versiones():
+    app.state.tarea_versiones = asyncio.create_task(_vigilar_versiones())
+
+
+def _etags_cliente(request: Request) -> Set[str]:
+    """ETags de If-None-Match (comparación débil, como pide RFC 7232 para GET)."""
+    valor = request.headers.get("if-none-match")
+    if not valor:
+        return set()
+    return {e.strip().removeprefix("W/") for e in valor.split(",") if e.strip()}
+
+
+def _validar_etag(request: Request, roles: tuple):
+    """Clave de cache, headers (con ETag si se conocen las versiones) y si el cliente ya está al día."""
+    versiones = tuple(VERSIONES.get(rol) for rol in roles)
+    clave = (request.url.path, tuple(sorted(request.query_params.multi_items())), versiones)
+
+    headers = {"Cache-Control": "no-cache"}
+    if None in versiones:
+        return clave, headers, False
+    etag = '"' + hashlib.blake2b(repr(clave).encode(), digest_size=16).hexdigest() + '"'
+    headers["ETag"] = etag
+    etags = _etags_cliente(request)
+    return clave, headers, etag in etags or "*" in etags
+
+
+def _json_default(obj):
+    """Tipos BSON que orjson no conoce (datetime lo serializa de forma nativa)."""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Tipo no serializable: {type(obj).__name__}")
+
+
+async def _lineas_ndjson(cursor):
+    """Un documento por línea, agrupando `STREAM_BATCH_SIZE` documentos por chunk."""
+    lote: List[bytes] = []
+    async for doc in cursor:
+        lote.append(orjson.dumps(doc, default=_json_default, option=orjson.OPT_APPEND_NEWLINE))
+        if len(lote) >= STREAM_BATCH_SIZE:
+            yield b"".join(lote)
+            lote = []
+    if lote:
+        yield b"".join(lote)
+
+
+def _respuesta_ndjson(request: Request, roles: tuple, cursor) -> Response:
+    """Respuesta NDJSON que recorre el cursor por lotes sin acumular resultados en memoria."""
+    _, headers, no_modificado = _validar_etag(request, roles)
+    if no_modificado:
+        return Response(status_code=304, headers=headers)
+    return StreamingResponse(
+        _lineas_ndjson(cursor.batch_size(STREAM_BATCH_SIZE)),
+        media_type="application/x-ndjson",
+        headers=headers,
+    )
+
+
+async def _respuesta_cacheada(request: Request, roles: tuple, producir) -> Response:
+    """Responde desde el cache si la versión de los datos no cambió.
+
+    El ETag se deriva de la URL y de las versiones de `roles`: si el cliente
+    ya lo tiene se responde 304 sin consultar Mongo ni serializar. Mientras
+    alguna versión no se conozca (colección nunca cargada por el pipeline)
+    no se envía ETag y el cache depende solo del TTL.
+    """
+    clave, headers, no_modificado = _validar_etag(request, roles)
+    if no_modificado:
+        return Response(status_code=304, headers=headers)
+
+    cuerpo = CACHE_RESPUESTAS.get(clave)
+    if cuerpo is None:
+        cuerpo = JSONResponse(content=jsonable_encoder(await producir())).body
+        CACHE_RESPUESTAS.set(clave, cuerpo)
+    return Response(content=cuerpo, media_type="application/json", headers=headers)
+
 
 @app.get("/ping") #verifica la conexion con mongoDB"""
 async def ping():
@@ -138,43 +392,414 @@ async def ping():
     return {"status": "ok"}
 
 
-@app.get("/ct") #enrutadores para obtener datos de la coleccion ct
-async def obtener_pacientes():
-    # Lee documentos de la colección y pasa por la función de serialización
-    docs = await db["series_ct"].find().to_list(length=3000)
+def parametros_listado(
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    protocol: Optional[str] = None,
+    description: Optional[str] = None,
+    patient: Optional[str] = None,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    format: str = "json",
+    since: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Parámetros comunes de /ct, /ocr y /pet (todos opcionales)."""
+    if format not in FORMATOS:
+        raise HTTPException(status_code=400, detail=f"format debe ser uno de: {', '.join(FORMATOS)}")
+    return {
+        "date_from": date_from,
+        "date_to": date_to,
+        "protocol": protocol,
+        "description": description,
+        "patient": patient,
+        "fields": fields,
+        "cursor": cursor,
+        "limit": limit,
+        "format": format,
+        "since": since,
+    }
+
+
+def _consulta_listado(rol: str, params: Dict[str, Any]):
+    """Filtro y proyección de Mongo para los parámetros de listado."""
+    try:
+        filtro = construir_filtro(
+            rol,
+            date_from=params["date_from"],
+            date_to=params["date_to"],
+            protocol=params["protocol"],
+            description=params["description"],
+            patient=params["patient"],
+            cursor=params["cursor"],
+        )
+        proyeccion = construir_proyeccion(rol, params["fields"])
+    except ConsultaInvalida as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return filtro, proyeccion
+
+
+def _cursor_listado(rol: str, params: Dict[str, Any], limite: Optional[int]):
+    """Cursor ordenado por _id con filtros y proyección (sin ejecutar todavía)."""
+    filtro, proyeccion = _consulta_listado(rol, params)
+    cursor = db[COLLECTIONS[rol]].find(filtro, proyeccion).sort("_id", 1)
+    return cursor.limit(limite) if limite else cursor
+
+
+async def _listar(rol: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Consulta paginada por _id con filtros y proyección; el límite lo fija el servidor."""
+    try:
+        limite = resolver_limite(rol, params["limit"])
+    except ConsultaInvalida as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    cursor = _cursor_listado(rol, params, limite)
+    docs = await cursor.to_list(length=limite)
     pacientes = [_make_serializable(d) for d in docs]
-    return {"pacientes": pacientes}
+    # Si la página vino llena puede haber más: el cliente continúa desde el último _id
+    next_cursor = pacientes[-1]["_id"] if len(pacientes) == limite else None
+    return {"pacientes": pacientes, "next_cursor": next_cursor}
+
+
+async def _delta(rol: str, filtro: Dict[str, Any], proyeccion, since: int, limite: int, campo: str) -> Dict[str, Any]:
+    """Documentos nuevos/modificados y bajas con secuencia de ingesta posterior a `since`.
+
+    `cursor` es la última secuencia entregada: el cliente la envía como
+    `since` en la siguiente llamada. Si `completo` es False quedan más
+    cambios y conviene pedir de nuevo de inmediato. Las bajas no se filtran
+    (solo guardan el _id): el cliente ignora las que no tenga.
+
+    Con filtros, un documento que cambió y dejó de cumplirlos también va en
+    `eliminados`: la página se arma sobre todos los cambios del rol y los
+    que no cumplen el filtro se informan como bajas.
+
+    Con varios escritores la secuencia N+1 puede quedar escrita antes que
+    la N: solo se entrega hasta la marca de agua del rol (todo lo anterior
+    ya está escrito), y lo que está en vuelo llega en una llamada posterior.
+    """
+    col = db[COLLECTIONS[rol]]
+    confirmada = max(since, await leer_seq_confirmada(rol))
+    if filtro:
+        cambios = await (
+            col.find(filtro_delta({}, since, confirmada), {"_id": 1, "clave": 1, "_ingest.seq": 1})
+            .sort("_ingest.seq", 1)
+            .limit(limite)
+            .to_list(length=limite)
+        )
+        completo = len(cambios) < limite
+        hasta = confirmada if completo else cambios[-1]["_ingest"]["seq"]
+        docs = await (
+            col.find(filtro_delta(filtro, since, hasta), proyeccion_delta(proyeccion))
+            .sort("_ingest.seq", 1)
+            .to_list(length=None)
+        )
+        vigentes = {d["_id"] for d in docs}
+        salidos = [{"doc_id": c["_id"], "clave": c.get("clave")} for c in cambios if c["_id"] not in vigentes]
+    else:
+        docs = await (
+            col.find(filtro_delta(filtro, since, confirmada), proyeccion_delta(proyeccion))
+            .sort("_ingest.seq", 1)
+            .limit(limite)
+            .to_list(length=limite)
+        )
+        completo = len(docs) < limite
+        hasta = confirmada if completo else docs[-1]["_ingest"]["seq"]
+        salidos = []
+    bajas = await (
+        db[COLLECTIONS["bajas"]]
+        .find({"rol": rol, "_ingest.seq": {"$gt": since, "$lte": hasta}},
+              {"_id": 0, "doc_id": 1, "clave": 1, "_ingest.seq": 1})
+        .sort("_ingest.seq", 1)
+        .to_list(length=None)
+    )
+    return {
+        campo: [_make_serializable(d) for d in docs],
+        "eliminados": [{"_id": str(b["doc_id"]), "clave": b.get("clave")} for b in bajas + salidos],
+        "cursor": str(hasta),
+        "completo": completo,
+    }
+
+
+async def _responder_listado(request: Request, rol: str, params: Dict[str, Any]) -> Response:
+    """format=json: página cacheada; format=ndjson: toda la consulta en streaming (limit opcional, sin tope);
+    since=<cursor>: solo los cambios desde la última sincronización."""
+    if params["since"] is not None:
+        try:
+            since = normalizar_since(params["since"])
+            limite = resolver_limite(rol, params["limit"])
+        except ConsultaInvalida as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if params["format"] != "json":
+            raise HTTPException(status_code=400, detail="since solo admite format=json")
+        filtro, proyeccion = _consulta_listado(rol, params)
+        return await _respuesta_cacheada(
+            request, (rol,), lambda: _delta(rol, filtro, proyeccion, since, limite, "pacientes")
+        )
+    if params["format"] == "ndjson":
+        if params["limit"] is not None and params["limit"] < 1:
+            raise HTTPException(status_code=400, detail="limit debe ser mayor que cero")
+        return _respuesta_ndjson(request, (rol,), _cursor_listado(rol, params, params["limit"]))
+    return await _respuesta_cacheada(request, (rol,), lambda: _listar(rol, params))
+
+
+@app.get("/ct") #enrutadores para obtener datos de la coleccion ct
+async def obtener_pacientes_ct(request: Request, params: Dict[str, Any] = Depends(parametros_listado)):
+    return await _responder_listado(request, "ct", params)
+
 
 @app.get("/ocr")
-async def obtener_pacientes():
-    #Lee algunos documentos de la colección (ajusta el nombre si es necesario)
-    docs = await db["dose_report"].find().to_list(length=1000)
-    pacientes = [_make_serializable(d) for d in docs]
-    return {"pacientes": pacientes}
+async def obtener_pacientes_ocr(request: Request, params: Dict[str, Any] = Depends(parametros_listado)):
+    return await _responder_listado(request, "ocr", params)
 
 
 @app.get("/pet")
-async def obtener_pacientes():
-    #Lee algunos documentos de la colección (ajusta el nombre si es necesario)
-    docs = await db["series_pet1"].find().to_list(length=1000)
-    pacientes = [_make_serializable(d) for d in docs]
-    return {"pacientes": pacientes}
+async def obtener_pacientes_pet(request: Request, params: Dict[str, Any] = Depends(parametros_listado)):
+    return await _responder_listado(request, "pet", params)
+
+
+@app.get("/vtl")
+async def obtener_series_vtl(
+    request: Request,
+    protocol: Optional[str] = None,
+    description: Optional[str] = None,
+    weight_min: Optional[float] = None,
+    weight_max: Optional[float] = None,
+    scan_length_min: Optional[float] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    description_exact: bool = False,
+    limit: Optional[int] = None,
+    format: str = "json",
+    since: Optional[str] = None,
+):
+    """Series CT con dosis OCR ya unidas en la ingesta, ordenadas de más nueva a más antigua."""
+    try:
+        desde = normalizar_since(since)
+        filtro = construir_filtro_vtl(
+            protocol=protocol,
+            description=description,
+            weight_min=weight_min,
+            weight_max=weight_max,
+            scan_length_min=scan_length_min,
+            date_from=date_from,
+            date_to=date_to,
+            description_exact=description_exact,
+        )
+    except ConsultaInvalida as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit debe ser mayor que cero")
+    if format not in FORMATOS:
+        raise HTTPException(status_code=400, detail=f"format debe ser uno de: {', '.join(FORMATOS)}")
+
+    def _cursor(limite: Optional[int]):
+        cursor = (
+            db[COLLECTIONS["vtl"]]
+            .find(filtro)
+            .sort([("study_ts", -1), ("patient_norm", 1), ("series_number", 1)])
+        )
+        return cursor.limit(limite) if limite else cursor
+
+    if desde is not None and format != "json":
+        raise HTTPException(status_code=400, detail="since solo admite format=json")
+    if format == "ndjson":
+        return _respuesta_ndjson(request, ("vtl",), _cursor(limit))
+
+    limite = min(limit or MAX_LIMIT, MAX_LIMIT)
+    if desde is not None:
+        return await _respuesta_cacheada(
+            request, ("vtl",), lambda: _delta("vtl", filtro, None, desde, limite, "series")
+        )
+
+    async def _consultar():
+        docs = await _cursor(limite).to_list(length=limite)
+        return {"series": [_make_serializable(d) for d in docs], "truncado": len(docs) == limite}
+
+    return await _respuesta_cacheada(request, ("vtl",), _consultar)
+
+
+def parametros_stats(
+    metric: str,
+    protocol: Optional[str] = None,
+    description: Optional[str] = None,
+    weight_min: Optional[float] = None,
+    weight_max: Optional[float] = None,
+    scan_length_min: Optional[float] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    description_exact: bool = False,
+    exclude_description: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Métrica y filtros comunes de /stats/* (ver estadisticas.METRICAS).
+
+    description_exact (solo VTL) pide igualdad en vez de "contiene";
+    exclude_description descarta las series con esa descripción exacta.
+    """
+    return {
+        "metric": metric,
+        "protocol": protocol,
+        "description": description,
+        "description_exact": description_exact,
+        "exclude_description": exclude_description,
+        "weight_min": weight_min,
+        "weight_max": weight_max,
+        "scan_length_min": scan_length_min,
+        "date_from": date_from,
+        "date_to": date_to,
+    }
+
+
+async def _stats(request: Request, params: Dict[str, Any], calcular) -> Response:
+    """Carga los datos de la métrica y aplica `calcular` (cacheado según la versión de la fuente)."""
+    try:
+        fuente = estadisticas.fuente_metrica(params["metric"])
+    except ConsultaInvalida as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def _calcular():
+        try:
+            datos = await estadisticas.cargar_datos(db, COLLECTIONS, params["metric"], params)
+        except ConsultaInvalida as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"metric": params["metric"], **calcular(datos)}
+
+    return await _respuesta_cacheada(request, (fuente,), _calcular)
+
+
+@app.get("/stats/drl")
+async def stats_drl(
+    request: Request,
+    params: Dict[str, Any] = Depends(parametros_stats),
+    weight_bands: Optional[str] = None,
+    percentiles: str = "25,50,75",
+):
+    """Percentiles por protocolo y banda de peso (p75 = nivel de referencia local)."""
+    try:
+        bordes = estadisticas.parse_lista_numeros(weight_bands, "weight_bands")
+        ps = estadisticas.parse_lista_numeros(percentiles, "percentiles")
+    except ConsultaInvalida as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not ps or any(p < 0 or p > 100 for p in ps):
+        raise HTTPException(status_code=400, detail="percentiles deben estar entre 0 y 100")
+    return await _stats(
+        request, params,
+        lambda datos: {"grupos": estadisticas.percentiles_por_grupo(datos, bordes, ps)},
+    )
+
+
+@app.get("/stats/histogram")
+async def stats_histogram(
+    request: Request,
+    params: Dict[str, Any] = Depends(parametros_stats),
+    subdivisions: int = 1,
+):
+    """Histograma con bins de Freedman-Diaconis (cada uno partido en `subdivisions`), cuartiles, n, mínimo y máximo."""
+    if subdivisions < 1 or subdivisions > 20:
+        raise HTTPException(status_code=400, detail="subdivisions debe estar entre 1 y 20")
+    return await _stats(request, params, lambda datos: estadisticas.histograma(datos["valor"], subdivisions))
+
+
+@app.get("/stats/rolling")
+async def stats_rolling(
+    request: Request,
+    params: Dict[str, Any] = Depends(parametros_stats),
+    window_days: float = 21,
+    bucket_days: float = 7,
+    min_count: int = 3,
+):
+    """Mediana móvil en el tiempo (por defecto ventana de 3 semanas evaluada semanalmente)."""
+    if window_days <= 0 or bucket_days <= 0 or min_count < 1:
+        raise HTTPException(status_code=400, detail="window_days, bucket_days y min_count deben ser positivos")
+
+    def _calcular(datos):
+        con_fecha = np.isfinite(datos["ts"])
+        return {"puntos": estadisticas.mediana_movil(
+            datos["ts"][con_fecha], datos["valor"][con_fecha], window_days, bucket_days, min_count,
+        )}
+
+    return await _stats(request, params, _calcular)
+
+
+@app.get("/export/{dataset}")
+async def exportar(
+    request: Request,
+    dataset: str,
+    format: str = "parquet",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+):
+    """Campos tipados por serie (vtl | pet) en Parquet o Arrow IPC, en streaming por row groups."""
+    try:
+        exportacion.validar_formato(format)
+        rol, filtro, proyeccion = exportacion.construir_consulta(dataset, date_from, date_to)
+    except ConsultaInvalida as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    _, headers, no_modificado = _validar_etag(request, (rol,))
+    if no_modificado:
+        return Response(status_code=304, headers=headers)
+    media_type, extension = exportacion.FORMATOS[format]
+    headers["Content-Disposition"] = f'attachment; filename="{dataset}.{extension}"'
+    return StreamingResponse(
+        exportacion.exportar_stream(db, COLLECTIONS, dataset, format, filtro, proyeccion),
+        media_type=media_type,
+        headers=headers,
+    )
+
+@app.get("/pipeline/runs")
+async def corridas_pipeline(limit: int = 20, estado: Optional[str] = None):
+    """Últimas corridas del pipeline con su telemetría por etapa (más reciente primero)."""
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit debe ser mayor que cero")
+    filtro = {"estado": estado} if estado else {}
+    limite = min(limit, 500)
+    docs = await db[RUNS_COLLECTION].find(filtro).sort("inicio", -1).limit(limite).to_list(length=limite)
+    return {"corridas": [_make_serializable(d) for d in docs]}
+
+
+@app.get("/pipeline/trends")
+async def tendencias_pipeline(days: int = 30):
+    """Serie diaria por etapa y origen (tiempos, volumen revisado/procesado, Orthanc, memoria) para planificar capacidad."""
+    if days < 1:
+        raise HTTPException(status_code=400, detail="days debe ser mayor que cero")
+    desde = datetime.utcnow() - timedelta(days=days)
+    etapas: Dict[str, List[Dict[str, Any]]] = {}
+    async for fila in db[RUNS_COLLECTION].aggregate(agregacion_tendencias_runs(desde)):
+        clave = fila.pop("_id")
+        punto = {"dia": clave["dia"], "origen": clave["origen"]}
+        for campo, valor in fila.items():
+            punto[campo] = round(valor, 3) if isinstance(valor, float) else valor
+        punto["orthanc_mb"] = round((punto.pop("orthanc_bytes") or 0) / 1e6, 2)
+        etapas.setdefault(clave["etapa"], []).append(punto)
+    return {"desde": desde, "etapas": etapas}
 
 
 from fastapi.staticfiles import StaticFiles
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
+def _static_response(request: Request, body: bytes, etag: str, media_type: str) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    etags = _etags_cliente(request)
+    if etag in etags or "*" in etags:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
 # [endpoint JSON]
 @app.get("/_apps.json")
-def apps_json():
-    items = scan_static(STATIC_DIR)
-    return JSONResponse(content={"items": items})
+def apps_json(request: Request):
+    catalog = CATALOG.current()
+    return _static_response(request, catalog.json_body, catalog.json_etag, "application/json")
 
 
 # [endpoint HTML]
 @app.get("/")
-def index():
-    items = scan_static(STATIC_DIR)
+def index(request: Request):
+    catalog = CATALOG.current()
+    return _static_response(request, catalog.html_body, catalog.html_etag, "text/html; charset=utf-8")
+
+
+def render_index(items: List[Dict[str, Any]]) -> str:
     total = len(items)
     # Construir filas HTML
     def _esc(s: Optional[str]) -> str:
@@ -276,4 +901,4 @@ def index():
     </body>
     </html>
     """
-    return HTMLResponse(content=html)
+    return html
@@ -0,0 +1,181 @@
+"""
+Metricas en formato de texto de Prometheus para la API (sin dependencias).
+
+- Latencia y tamano de respuesta por ruta (middleware en main.py). En las
+  respuestas en streaming (sin Content-Length) el cuerpo se cuenta al
+  enviarse y se mide ademas el tiempo hasta el ultimo byte.
+- Duracion de comandos de Mongo por comando y coleccion, medida con un
+  CommandListener de pymongo registrado en el cliente Motor (seed_mongo.py).
+
+Los histogramas usan buckets fijos y solo suman contadores bajo un lock,
+por lo que el costo por request es de unos pocos microsegundos.
+"""
+
+import bisect
+import math
+from threading import Lock
+from typing import Dict, List, Sequence, Tuple
+
+from pymongo import monitoring
+
+
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_BYTES = (1e3, 1e4, 1e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+BUCKETS_STREAMING = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _etiquetas(nombres: Sequence[str], valores: Sequence[str]) -> str:
+    pares = []
+    for nombre, valor in zip(nombres, valores):
+        valor = str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pares.append(f'{nombre}="{valor}"')
+    return ",".join(pares)
+
+
+def _num(valor: float) -> str:
+    return "+Inf" if math.isinf(valor) else repr(float(valor))
+
+
+class Histograma:
+    """Histograma acumulativo por combinacion de etiquetas."""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str], buckets: Sequence[float]):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # conteos por bucket + [+Inf, suma]
+        self._lock = Lock()
+
+    def observar(self, valor: float, *etiquetas: str) -> None:
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [0.0] * (len(self.buckets) + 2)
+            serie[i] += 1
+            serie[-1] += valor
+
+    def exponer(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for valores, serie in sorted(series.items()):
+            base = _etiquetas(self.etiquetas, valores)
+            sep = "," if base else ""
+            acumulado = 0.0
+            for limite, conteo in zip(self.buckets + (math.inf,), serie[:-1]):
+                acumulado += conteo
+                lineas.append(f'{self.nombre}_bucket{{{base}{sep}le="{_num(limite)}"}} {int(acumulado)}')
+            lineas.append(f"{self.nombre}_sum{{{base}}} {serie[-1]!r}")
+            lineas.append(f"{self.nombre}_count{{{base}}} {int(acumulado)}")
+        return lineas
+
+
+class Contador:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str]):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._series: Dict[Tuple[str, ...], float] = {}
+        self._lock = Lock()
+
+    def incrementar(self, *etiquetas: str, valor: float = 1) -> None:
+        with self._lock:
+            self._series[etiquetas] = self._series.get(etiquetas, 0) + valor
+
+    def exponer(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._lock:
+            series = dict(self._series)
+        for valores, total in sorted(series.items()):
+            lineas.append(f"{self.nombre}{{{_etiquetas(self.etiquetas, valores)}}} {total!r}")
+        return lineas
+
+
+HTTP_LATENCIA = Histograma(
+    "dms_http_request_duration_seconds",
+    "Tiempo hasta los headers de la respuesta, por ruta",
+    ("method", "route", "status"),
+    BUCKETS_LATENCIA,
+)
+HTTP_BYTES = Histograma(
+    "dms_http_response_size_bytes",
+    "Tamano del cuerpo de la respuesta (Content-Length, o bytes enviados en streaming)",
+    ("route",),
+    BUCKETS_BYTES,
+)
+HTTP_STREAMING = Histograma(
+    "dms_http_streaming_duration_seconds",
+    "Tiempo hasta el ultimo byte de las respuestas en streaming, por ruta",
+    ("method", "route", "status"),
+    BUCKETS_STREAMING,
+)
+HTTP_LENTAS = Contador(
+    "dms_http_slow_requests_total",
+    "Requests por sobre el umbral de lentitud",
+    ("route",),
+)
+MONGO_LATENCIA = Histograma(
+    "dms_mongo_command_duration_seconds",
+    "Duracion de comandos de MongoDB",
+    ("command", "collection"),
+    BUCKETS_LATENCIA,
+)
+MONGO_FALLAS = Contador(
+    "dms_mongo_command_failures_total",
+    "Comandos de MongoDB fallidos",
+    ("command", "collection"),
+)
+
+METRICAS = (HTTP_LATENCIA, HTTP_BYTES, HTTP_STREAMING, HTTP_LENTAS, MONGO_LATENCIA, MONGO_FALLAS)
+
+
+def exponer() -> str:
+    lineas: List[str] = []
+    for metrica in METRICAS:
+        lineas.extend(metrica.exponer())
+    return "\n".join(lineas) + "\n"
+
+
+# Comandos internos del driver que no interesan (handshake, monitoreo)
+_COMANDOS_IGNORADOS = {"hello", "ismaster", "isMaster", "ping", "saslStart", "saslContinue", "endSessions"}
+
+
+class MongoListener(monitoring.CommandListener):
+    """Mide cada comando entre started y succeeded/failed (por request_id)."""
+
+    def __init__(self):
+        self._colecciones: Dict[Tuple[int, int], str] = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def _clave(evento) -> Tuple[int, int]:
+        return (evento.request_id, evento.operation_id)
+
+    def started(self, event):
+        if event.command_name in _COMANDOS_IGNORADOS:
+            return
+        if event.command_name == "getMore":
+            # getMore trae el id del cursor; la coleccion va en "collection"
+            coleccion = event.command.get("collection", "")
+        else:
+            coleccion = event.command.get(event.command_name)
+            coleccion = coleccion if isinstance(coleccion, str) else ""
+        with self._lock:
+            self._colecciones[self._clave(event)] = coleccion
+
+    def _terminar(self, event) -> str:
+        with self._lock:
+            return self._colecciones.pop(self._clave(event), None)
+
+    def succeeded(self, event):
+        coleccion = self._terminar(event)
+        if coleccion is not None:
+            MONGO_LATENCIA.observar(event.duration_micros / 1e6, event.command_name, coleccion)
+
+    def failed(self, event):
+        coleccion = self._terminar(event)
+        if coleccion is not None:
+            MONGO_LATENCIA.observar(event.duration_micros / 1e6, event.command_name, coleccion)
+            MONGO_FALLAS.incrementar(event.command_name, coleccion)
@@ -1,6 +1,10 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 
+from DMS_pipeline.mongo.indexes import ensure_indexes_async
+from DMS_pipeline.mongo.versiones import leer_confirmada_async, leer_versiones_async
+from metricas import MongoListener
+
 MONGO_URI = os.getenv("MONGO_URI")  # Prioridad si viene completa
 if not MONGO_URI:
     HOST = os.getenv("MONGO_HOST", "10.73.173.21")
@@ -14,7 +18,34 @@ if not MONGO_URI:
     else:
         MONGO_URI = f"mongodb://{HOST}:{PORT}/{DB}"
 
-client = AsyncIOMotorClient(MONGO_URI)
+# El listener alimenta las metricas de comandos de Mongo expuestas en /metrics
+client = AsyncIOMotorClient(MONGO_URI, event_listeners=[MongoListener()])
 db = client.get_default_database()
 
+# Rol logico -> coleccion (mismos nombres que usa el pipeline)
+COLLECTIONS = {
+    "ocr": os.getenv("MONGO_COL_OCR", "dose_report"),
+    "ct": os.getenv("MONGO_COL_CT", "series_ct"),
+    "pet": os.getenv("MONGO_COL_PET", "series_pet1"),
+    "vtl": os.getenv("MONGO_COL_VTL", "dose_series"),
+    "bajas": os.getenv("MONGO_COL_TOMBSTONES", "data_tombstones"),
+}
+# Versiones por rol que incrementa el pipeline en cada carga con cambios
+VERSIONS_COLLECTION = os.getenv("MONGO_COL_VERSIONS", "data_versions")
+# Telemetria de cada corrida del pipeline (DMS_pipeline/telemetria.py)
+RUNS_COLLECTION = os.getenv("MONGO_COL_RUNS", "pipeline_runs")
+
+
+async def ensure_indexes():
+    """Crea los indices compartidos con el pipeline (idempotente)."""
+    return await ensure_indexes_async(db, COLLECTIONS)
+
+
+async def leer_versiones():
+    """Version actual de los datos de cada rol (ver DMS_pipeline/mongo/versiones.py)."""
+    return await leer_versiones_async(db, VERSIONS_COLLECTION)
+
 
+async def leer_seq_confirmada(rol: str) -> int:
+    """Secuencia de ingesta hasta la que todo lo del rol ya esta escrito (ver versiones.py)."""
+    return await leer_confirmada_async(db, VERSIONS_COLLECTION, rol)
@@ -0,0 +1,20 @@
+"""
+Configuracion comun de los tests: el pipeline (DMS_pipeline/) y los bench
+(bench/) no son paquetes instalables, se importan agregandolos al path.
+Los clientes de Mongo y Orthanc no se conectan al importar, asi que no
+hace falta ninguno de los dos servicios.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("ORTHANC_URL", "http://localhost:8042")
+
+for carpeta in ("DMS_pipeline", "bench"):
+    ruta = str(RAIZ / carpeta)
+    if ruta not in sys.path:
+        sys.path.insert(0, ruta)
@@ -0,0 +1,62 @@
+"""
+Arranque del launcher y seleccion de etapas (--stages).
+
+El import se mide en un proceso nuevo (ver bench/arranque.py): importar el
+launcher, o los modulos de una corrida de headers o de carga, no debe
+cargar los motores pesados del OCR y debe tardar menos de LIMITE_S.
+"""
+
+import pytest
+
+import arranque
+import launcher
+
+LIMITE_S = 1.0
+REPETICIONES = 3
+
+
+@pytest.mark.parametrize("escenario", ["launcher", "upload", "ct", "pet"])
+def test_import_sin_modulos_pesados(escenario):
+    medidas = [arranque.medir(arranque.ESCENARIOS[escenario]) for _ in range(REPETICIONES)]
+    mejor = min(medidas, key=lambda m: m["segundos"])
+    assert not arranque.PROHIBIDOS & set(mejor["pesados"])
+    assert mejor["segundos"] < LIMITE_S
+
+
+def test_import_no_abre_clientes():
+    # Un cliente de Mongo u Orthanc conectado al importar deja hilos de monitoreo
+    assert arranque.medir(["launcher"])["hilos"] == []
+
+
+def _nombres(etapas):
+    return [e.nombre for e in etapas]
+
+
+def test_seleccionar_etapas_sin_grupos_devuelve_todas():
+    etapas = launcher.etapas_pipeline()
+    assert launcher.seleccionar_etapas(etapas) is etapas
+    assert launcher.seleccionar_etapas(etapas, []) is etapas
+    assert launcher.seleccionar_etapas(etapas, " , ") is etapas
+
+
+def test_seleccionar_etapas_por_grupo():
+    etapas = launcher.etapas_pipeline()
+    assert _nombres(launcher.seleccionar_etapas(etapas, ["ct"])) == ["headers_ct"]
+    assert _nombres(launcher.seleccionar_etapas(etapas, "ocr, PET")) == ["ocr", "headers_pet"]
+    assert _nombres(launcher.seleccionar_etapas(etapas, "upload")) == [
+        "indices", "carga_ocr", "carga_ct", "carga_pet", "vtl",
+    ]
+
+
+def test_seleccionar_etapas_quita_dependencias_descartadas():
+    etapas = launcher.etapas_pipeline()
+    por_nombre = {e.nombre: e for e in launcher.seleccionar_etapas(etapas, "ct,upload")}
+    assert por_nombre["carga_ct"].depende == ("indices", "headers_ct")
+    assert por_nombre["carga_ocr"].depende == ("indices",)
+    assert por_nombre["carga_pet"].depende == ("indices",)
+    assert por_nombre["vtl"].depende == ("carga_ocr", "carga_ct")
+
+
+def test_seleccionar_etapas_grupo_desconocido():
+    with pytest.raises(ValueError, match="Etapas desconocidas: dicom"):
+        launcher.seleccionar_etapas(launcher.etapas_pipeline(), "ct,dicom")